@@ -1,11 +1,23 @@
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from logging import Formatter, StreamHandler
+from logging.handlers import QueueHandler, QueueListener
 from app.core.config import settings
 
+# id of the request (or websocket connection) being handled, set by RequestIdMiddleware
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
 class ColoredFormatter(Formatter):
     """Custom formatter adding color to log levels."""
-    
+
     # ANSI color codes
     COLORS = {
         logging.DEBUG: '\033[94m',    # Blue
@@ -28,23 +40,131 @@ class ColoredFormatter(Formatter):
         record.levelname = original_levelname
         return formatted
 
+
+# attributes every LogRecord has, anything else was passed with extra= and goes into the JSON line
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+class JsonFormatter(Formatter):
+    """One JSON object per line, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id, it has to run on the thread that logged."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """
+    Keeps a sample of the DEBUG records, then at most `rate` per second from each logging call,
+    so a debug line in a per-message path can't flood the output. Other levels always pass.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, rate: float = 0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate = rate  # 0 is no limit
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._buckets = {}  # (pathname, lineno) -> [tokens, last refill]
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.dropped += 1
+            return False
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault((record.pathname, record.lineno), [self.rate, now])
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.dropped += 1
+                return False
+            bucket[0] -= 1
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the QueueListener thread, which formats and writes them.
+    Records are queued as they are (not pre-formatted like QueueHandler does), the queue never leaves
+    the process, and a full queue drops the record instead of blocking the event loop.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogListener(QueueListener):
+    """Writes the queued records on its own thread."""
+
+    def enqueue_sentinel(self):
+        # the queue may be full, wait for the thread to make room rather than failing to stop
+        self.queue.put(self._sentinel)
+
+
 def setup_logger(name="app"):
-    """Configure and return a logger with colored console output."""
+    """Configure and return a logger whose records are written to stdout by a background thread."""
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    # debug calls return right away (before building a record) unless they would be written
+    logger.setLevel(logging.DEBUG if settings.DEBUG else settings.LOG_LEVEL.upper())
 
-    # Console handler with colored output
+    # Console handler, colored text or JSON lines, only ever called on the listener thread
     console_handler = StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
-    
-    # Simplified format with colored level names
-    formatter = ColoredFormatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        # Simplified format with colored level names
+        formatter = ColoredFormatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
     console_handler.setFormatter(formatter)
 
-    logger.addHandler(console_handler)
+    queue_handler = NonBlockingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(DebugRateLimitFilter(settings.LOG_DEBUG_SAMPLE_RATE, settings.LOG_DEBUG_RATE_LIMIT))
+    logger.addHandler(queue_handler)
+
+    listener = LogListener(queue_handler.queue, console_handler)
+    listener.start()
+    # writes out what is still queued when the process exits
+    atexit.register(listener.stop)
     return logger
 
 # Global logger instance
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
+
+# the pools in app.core.pool are SQLAlchemy pools, which log every checkout/checkin at DEBUG and dispose/recreate
+# at INFO under their class's module; keep them at SQLAlchemy's own default (warnings and up) like sqlalchemy.pool
+logging.getLogger("app.core.pool").setLevel(max(logging.WARNING, logger.level))
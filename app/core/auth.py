@@ -1,40 +1,100 @@
 from datetime import datetime, timedelta
+import asyncio
 from functools import wraps
 from typing import Optional
+import hashlib
 import json
-import inspect  # <-- To check if a function is a coroutine
+import time
+import inspect  # <-- To read the websocket endpoints' parameters
 from fastapi import Request, HTTPException, Depends, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
-from fastapi.concurrency import run_in_threadpool  # <-- To run sync endpoints asynchronously
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from jose import JWTError, jwt, ExpiredSignatureError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.queries import sql
 
-from app.core.database import get_db
+from app.core.database import get_async_read_db, AsyncSessionLocal
 from app.core.config import settings
 from app.config.constants import ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
 from app.config.logger import logger
 from app.core.helper import row2dict
+from app.core.cache import TTLCache
+from app.core.token_codec import get_token_codec, TokenError, TokenExpiredError
+from app.core.ws_codec import negotiate
 from app.schemas.user import User
-from app.core.websocket_super_simple import WebSocketManager
 
-ws_manager = WebSocketManager()
+# signs and verifies every token issued by the app, backend picked by TOKEN_BACKEND
+token_codec = get_token_codec(settings.TOKEN_BACKEND, settings.SECRET_KEY, settings.ALGORITHM)
 
-# get the current user from the request
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User | None:
-    user_id = request.state.user.get('id')
+# validated User schemas keyed by user id, shared between requests (treat them as read-only)
+user_cache = TTLCache(max_size=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
 
-    if user_id is not None:
+# drop a cached user, call this after every write to the users row
+def invalidate_user(user_id) -> None:
+    user_cache.invalidate(str(user_id))
 
-        query = "SELECT * FROM users WHERE id = :user_id"
-        user = db.execute(text(query), {"user_id": user_id}).first()
+# verified JWT claims keyed by the token's sha256 digest, each entry expires with the token
+token_cache = TTLCache(max_size=settings.TOKEN_CACHE_MAX_SIZE, ttl=0)
 
-        #logger.debug(f"user: {user}")
-        #logger.debug(f"User.model_validate(user): {User.model_validate(user)}")
+# decode and verify a JWT, skipping the signature check for tokens verified before
+def decode_token(token: str) -> dict:
+    if not isinstance(token, str):
+        raise TokenError("Invalid token")
 
-        return User.model_validate(user)
-    
-    return None
+    key = hashlib.sha256(token.encode()).digest()
+
+    # every caller gets its own copy, the cached claims are shared between requests
+    payload = token_cache.get(key)
+    if payload is not None:
+        return dict(payload)
+
+    # raises TokenExpiredError/TokenError, failures are never cached
+    payload = token_codec.decode(token)
+
+    exp = payload.get("exp")
+    if exp is not None:
+        token_cache.set(key, dict(payload), ttl=exp - time.time())
+
+    return payload
+
+# get a user by id from the user cache, or from the db (and cache it)
+async def fetch_user(db: AsyncSession, user_id: str) -> User | None:
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+
+    query = "SELECT * FROM users WHERE id = :user_id"
+    user = (await db.execute(sql("auth.get_user", query), {"user_id": user_id})).first()
+
+    #logger.debug(f"user: {user}")
+    #logger.debug(f"User.model_validate(user): {User.model_validate(user)}")
+
+    if user is None:
+        return None
+
+    current_user = User.model_validate(user)
+    user_cache.set(user_id, current_user)
+
+    return current_user
+
+# Authenticates the request, as a dependency of the endpoint: user: User = Depends(get_current_user)
+# FastAPI resolves the dependency tree once when the route is registered, and the request's read session
+# (get_async_read_db: the replica when there is one, otherwise the endpoint's own get_async_db session)
+# serves both the refresh and the user lookup.
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_async_read_db)) -> User:
+    auth_header = request.headers.get("Authorization")
+    access_token = auth_header[7:] if auth_header and auth_header.startswith("Bearer ") else None
+
+    verified_access_token, user_id = await verify_tokens(access_token, request.cookies.get("refresh_token"), db)
+
+    # the token was refreshed, TokenRefreshMiddleware sends it back in the X-New-Access-Token header
+    if verified_access_token != access_token:
+        request.state.new_access_token = verified_access_token
+
+    user = await fetch_user(db, user_id)
+
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    request.state.user = user
+    return user
 
 # creates new access tokens
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -45,9 +105,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode.update({"exp": expire, "token_type": "access", "iat": datetime.now()})
-    encoded_jwt = jwt.encode(
-        to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
-    )
+    encoded_jwt = token_codec.encode(to_encode)
     return encoded_jwt
 
 
@@ -58,27 +116,21 @@ def create_refresh_token(data: dict) -> str:
     expire = datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire, "token_type": "refresh", "iat": datetime.now()})
 
-    return jwt.encode(
-        to_encode,
-        settings.SECRET_KEY,
-        algorithm=settings.ALGORITHM,  # Original: data instead of to_encode
-    )
+    return token_codec.encode(to_encode)  # Original: data instead of to_encode
 
 
 # refreshes the access token is refresh token is valid
-async def refresh_access_token(refresh_token: str) -> tuple[str, str]:
+async def refresh_access_token(refresh_token: str, db: AsyncSession | None = None) -> tuple[str, str]:
     """
     Validates refresh token and generates new access token
     Returns username and new access token if refresh token is valid
-    """
-    # open up a new db session
-    db = next(get_db())
 
+    The user check goes through the user cache and, on a miss, the caller's session,
+    so the request that follows the refresh finds its user already cached.
+    """
     try:
         # check if refresh token is valid
-        payload = jwt.decode(
-            refresh_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
+        payload = decode_token(refresh_token)
 
         # check if payload is of valid type
         if payload.get("token_type") != "refresh":
@@ -90,8 +142,11 @@ async def refresh_access_token(refresh_token: str) -> tuple[str, str]:
             raise HTTPException(status_code=401, detail="User id not found in payload")
 
         # Verify user exists
-        query = "SELECT * FROM users WHERE id = :user_id"
-        user = db.execute(text(query), {"user_id": user_id}).first()
+        if db is not None:
+            user = await fetch_user(db, user_id)
+        else:
+            async with AsyncSessionLocal() as session:
+                user = await fetch_user(session, user_id)
 
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
@@ -104,23 +159,21 @@ async def refresh_access_token(refresh_token: str) -> tuple[str, str]:
 
         return new_access_token, user_id
     
-    except ExpiredSignatureError:
+    except TokenExpiredError:
         raise HTTPException(status_code=401, detail="Refresh token expired") # TODO prompt a logout/login
 
-    except JWTError:
+    except TokenError:
         raise HTTPException(status_code=401, detail="Invalid refresh token") # TODO prompt a logout/login
-    
-    finally:
-        db.close()
 
 
 # verify both access and refresh token
 async def verify_tokens(
-    access_token: str | None, refresh_token: str | None
+    access_token: str | None, refresh_token: str | None, db: AsyncSession | None = None
 ) -> tuple[str, str | None]:
     """
     Verifies access token or uses refresh token to get new access token
     Returns username and new access token (if refreshed)
+    `db` is the request's session, reused for the user check when a refresh is needed
     """
     if not access_token:
         raise HTTPException(status_code=401, detail="No access token provided")
@@ -130,9 +183,7 @@ async def verify_tokens(
 
     # First try to verify access token
     try:
-        payload = jwt.decode(
-            access_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
+        payload = decode_token(access_token)
 
         if payload.get("token_type") != "access":
             raise HTTPException(
@@ -148,7 +199,7 @@ async def verify_tokens(
 
         return access_token, user_id
     
-    except ExpiredSignatureError:
+    except TokenExpiredError:
         # Access token invalid - try refresh if available
         if not refresh_token:
             raise HTTPException(
@@ -156,7 +207,7 @@ async def verify_tokens(
             )
 
         try:
-            new_access_token, user_id = await refresh_access_token(refresh_token)
+            new_access_token, user_id = await refresh_access_token(refresh_token, db)
 
             return new_access_token, user_id
         
@@ -165,81 +216,10 @@ async def verify_tokens(
                 status_code=401, detail="Could not validate credentials"
             )
 
-    except JWTError:
+    except TokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-def token_auth():
-    """
-    Decorator to enforce token validation and refresh logic.
-    This decorator extracts the access token and refresh token, validates them,
-    and if necessary refreshes the access token. It also attaches a new access token
-    to the JSONResponse if a refresh occurred.
-    
-    This implementation supports both asynchronous and synchronous endpoint functions.
-    If the endpoint is synchronous, it is executed in a thread pool to avoid blocking the event loop.
-    """
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(request: Request, *args, **kwargs):
-            # Store the original access token from the Authorization header.
-            auth_header = request.headers.get("Authorization")
-            original_access_token = None
-            new_access_token = None
-            
-            # Extract tokens from request.
-            if auth_header and auth_header.startswith("Bearer "):
-                original_access_token = auth_header.split(" ")[1]
-            
-            # Get the refresh token from cookies.
-            refresh_token = request.cookies.get("refresh_token")
-            
-            #logger.debug(f"token_auth original_access_token: {original_access_token}")
-            #logger.debug(f"token_auth refresh_token: {refresh_token}")
-            
-            # Verify the tokens. The verify_tokens() function returns a tuple:
-            # (access_token, user_id). If the access token was refreshed, the returned
-            # access_token will be different from the original.
-            verified_access_token, user_id = await verify_tokens(original_access_token, refresh_token)
-            
-            # Check if the token was refreshed.
-            if original_access_token != verified_access_token:
-                new_access_token = verified_access_token
-            
-            #logger.debug(f"Verified access token: {verified_access_token}")
-            #logger.debug(f"user_id: {user_id}")
-            
-            # Make sure that the endpoint function receives the request object if it expects it.
-            if "request" in func.__code__.co_varnames:
-                kwargs["request"] = request
-            
-            # Attach the user information to the request so that endpoint functions can use it.
-            request.state.user = {"id": user_id}
-            
-            # Execute the endpoint function.
-            #
-            # If func is a coroutine (i.e. asynchronous), simply await it.
-            # Otherwise, wrap it in run_in_threadpool so that it does not block the event loop.
-            if inspect.iscoroutinefunction(func):
-                response = await func(*args, **kwargs)
-            else:
-                response = await run_in_threadpool(func, *args, **kwargs)
-            
-            # If a new access token was generated (i.e. the token was refreshed) and the response
-            # is a JSONResponse, attach the new access token to the response JSON.
-            if new_access_token:
-                if isinstance(response, JSONResponse):
-                    # Decode the current response body so we can add the new token.
-                    response_data = json.loads(bytes(response.body).decode())
-                    response_data["new_access_token"] = new_access_token
-                    response = JSONResponse(content=response_data)
-            
-            return response
-
-        return wrapper
-
-    return decorator
-
 # async def token_auth_ws(websocket: WebSocket) -> tuple[WebSocket, str]:
 
 #     user_id = ''
@@ -308,18 +288,18 @@ def token_auth_ws():
         @wraps(func)
         async def wrapper(websocket: WebSocket, *args, **kwargs):
             # Accept the connection first
-            logger.info(f"--------------------------------------: {websocket}")
-            logger.info(f"token_auth_ws: {websocket.cookies}")
-            temp_user_id = 'temp_user'
+            logger.debug("--------------------------------------: %s", websocket)
+            logger.debug("token_auth_ws: %s", websocket.cookies)
 
-            await ws_manager.connect(websocket, temp_user_id)
+            # the user isn't known before the auth message, the endpoint registers the socket under its id
+            await websocket.accept()
             
             try:
                 # Get auth message with access_token
                 auth_msg = await websocket.receive_text()
                 auth_msg = json.loads(auth_msg)
                 
-                logger.debug('auth message', auth_msg)
+                logger.debug('auth message: %s', auth_msg)
                 
                 # Validate auth message
                 if not auth_msg or auth_msg.get('type') != 'authenticate' or auth_msg.get('token') is None:
@@ -334,9 +314,7 @@ def token_auth_ws():
                 
                 try:
                     # Decode and validate token
-                    payload = jwt.decode(
-                        access_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-                    )
+                    payload = decode_token(access_token)
                     
                     if payload.get("token_type") != "access":
                         await websocket.send_json({
@@ -359,7 +337,7 @@ def token_auth_ws():
                     # Successfully authenticated - run the handler with the user_id
                     return await func(websocket, user_id=user_id, *args, **kwargs)
                     
-                except JWTError:
+                except TokenError:
                     await websocket.send_json({
                         "type": "error",
                         "message": "Invalid or expired token"
@@ -370,54 +348,68 @@ def token_auth_ws():
             except WebSocketDisconnect:
                 logger.info("Client disconnected during authentication")
             except Exception as e:
-                logger.error(f"Authentication error: {str(e)}")
+                logger.error("Authentication error: %s", e)
                 await websocket.close(code=1008)
                 
         return wrapper
     
     return decorator
 
+async def close_websocket(websocket: WebSocket, code: int = 1000) -> None:
+    """Close a websocket that may already be closed/disconnected"""
+    try:
+        await websocket.close(code=code)
+    except Exception as e:
+        logger.debug("Error closing websocket: %s  might already be closed", e)
+
+
 def token_auth_ws_v2():
     """Decorator for WebSocket authentication"""
     def decorator(func):
+        # whether the endpoint takes the authenticated user_id, looked up once rather than on every connect
+        has_user_id_param = 'user_id' in inspect.signature(func).parameters
+
         @wraps(func)
         async def wrapper(websocket: WebSocket, *args, **kwargs):
-            # accept websocket connection
-            logger.info(f"token_auth_ws_v2 start")
-            temp_user_id = 'temp_user'
-
-            await ws_manager.connect(websocket, temp_user_id)
+            # accept websocket connection, the endpoint registers it once the user is known.
+            # The message encoding is picked from the client's subprotocols, the endpoint finds it in websocket.state
+            logger.debug("token_auth_ws_v2 start")
+            websocket.state.codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+            await websocket.accept(subprotocol=subprotocol)
 
-            # get first ws message which contains the access_token
+            # get first ws message which contains the access_token, a socket that never sends it is dropped
             try:
-                auth_msg = await websocket.receive_text()
+                try:
+                    async with asyncio.timeout(settings.WEBSOCKET_AUTH_TIMEOUT_SECONDS):
+                        auth_msg = await websocket.receive_text()
+                except TimeoutError:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": "Authentication timed out"
+                    })
+                    await close_websocket(websocket, code=1008)
+                    return
                 auth_msg = json.loads(auth_msg)
 
-                logger.debug(f'auth message: {auth_msg}')
+                logger.debug('auth message: %s', auth_msg)
 
                 access_token = auth_msg.get('token')
-                logger.debug(f'access_token: {access_token}')
+                logger.debug('access_token: %s', access_token)
                 
                 # validate access_token
                 try:
-                    payload = jwt.decode(
-                        access_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-                    )   
+                    payload = decode_token(access_token)
 
                     if payload.get("token_type") != "access":
                         await websocket.send_json({
                             "type": "error",
                             "message": "Invalid access token type"
                         })
-                        await ws_manager.disconnect(temp_user_id, websocket)
+                        await close_websocket(websocket, code=1008)
                         return
                     
                     user_id = str(payload.get("sub"))
-                    logger.debug(f'user_id: {user_id}')
-                    
-                    # Check if the function already has a user_id parameter
-                    sig = inspect.signature(func)
-                    has_user_id_param = 'user_id' in sig.parameters
+                    logger.debug('user_id: %s', user_id)
                     
                     # If the endpoint already expects a user_id parameter, modify kwargs
                     if has_user_id_param:
@@ -427,18 +419,18 @@ def token_auth_ws_v2():
                     # if access_token is valid, run the handler
                     return await func(websocket, *args, **kwargs)
                 
-                except JWTError as e:
-                    logger.error(f"JWT validation error: {str(e)}")
+                except TokenError as e:
+                    logger.error("JWT validation error: %s", e)
                     await websocket.send_json({
                         "type": "error",
                         "message": "Invalid or expired token"
                     })
-                    await ws_manager.disconnect(temp_user_id, websocket)
+                    await close_websocket(websocket, code=1008)
                     return
 
             except Exception as e:
-                logger.error(f"Authentication error: {str(e)}")
-                await ws_manager.disconnect(temp_user_id, websocket)
+                logger.error("Authentication error: %s", e)
+                await close_websocket(websocket, code=1008)
                 return
     
         return wrapper
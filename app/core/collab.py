@@ -0,0 +1,410 @@
+"""
+Server-authoritative collaborative editing of a note's text (note.content["content"]).
+
+Clients send text operations (app/core/ot.py) made against a revision of the document. Every worker
+process with editors of a note holds a replica of the document, and every replica applies the ops
+in the order the pub/sub backend delivers them (postgres delivers notifications in commit order,
+the same order for every listener), so all replicas agree on the text and on the revision number.
+An op is rebased over the ops applied since its revision, then numbered with the next revision.
+
+A worker that gets the first editor of a note syncs its replica: it publishes a marker, any replica
+that already has the document writes it to the database and answers with the revision it had at
+the marker, the new replica loads the stored text and replays the ops that followed the marker.
+Without an answer nobody is editing the note and the stored text is the document.
+
+Documents are written back every COLLAB_FLUSH_INTERVAL_SECONDS while edited (and when the last
+local editor leaves), with the revision in note.collab_rev, so persistence costs one UPDATE per
+interval instead of one per keystroke.
+
+Protocol, on top of the note room websocket:
+    client -> {"type": "op", "rev": n, "op": [...], "id": "client op id"}
+    server -> {"type": "snapshot", "rev": n, "text": "..."}              on join (or after a resync)
+    server -> {"type": "ops", "ops": [{"rev", "op", "id", "connection"}]}  applied ops, in batches
+    server -> {"type": "error", "id": ..., "message": "..."}            rejected op
+The sender recognizes its own ops in "ops" by its connection id (the ack). Revisions in "ops" are
+contiguous, a client that sees a gap (its queue overflowed) or reconnects joins again with
+?rev=<last revision> and gets the missing ops instead of a snapshot, if they are still in history.
+"""
+import asyncio
+import json
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Dict, Optional
+
+from app.config.logger import logger
+from app.core import ot
+from app.core.queries import sql
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.websocket import WebSocketManager, websocket_manager
+
+
+COLLAB_LOAD_QUERY = """
+    SELECT coalesce(content->>'content', '') AS text, collab_rev, version - collab_rev AS version_offset
+    FROM note WHERE id = :id
+"""
+
+# Only the first replica to flush a revision writes it, the others would write the same text.
+# Bumps version so the content ETag and the PATCH endpoint see the change, by as many revisions as it
+# writes: version - collab_rev then only changes when something else (a PATCH) wrote the note, and a
+# replica that loaded another offset holds an outdated document that must not overwrite the note.
+COLLAB_FLUSH_QUERY = """
+    UPDATE note
+    SET content = jsonb_set(
+            CASE WHEN jsonb_typeof(content) = 'object' THEN content ELSE CAST('{}' AS jsonb) END,
+            '{content}', to_jsonb(CAST(:text AS text))
+        ),
+        collab_rev = :rev, version = version + (:rev - collab_rev), updated_at = now()
+    WHERE id = :id AND collab_rev < :rev AND version - collab_rev = :version_offset
+    RETURNING id
+"""
+
+COLLAB_VERSION_OFFSET_QUERY = """
+    SELECT version - collab_rev AS version_offset FROM note WHERE id = :id
+"""
+
+
+class CollabDocument:
+    """
+    This process' replica of one note's document.
+
+    Every message of the note's channel goes through a single task in delivery order, which is
+    what keeps the replicas identical. Submitted ops are checked against the replica, then
+    published, and only applied once they come back from the channel.
+    """
+
+    def __init__(self, service: "CollabService", note_id: int):
+        self.service = service
+        self.note_id = note_id
+        self.room_id = f"note:{note_id}"
+        self.channel = f"collab:{self.room_id}"
+
+        self.text = ""
+        self.rev = 0
+        # (rev, op) of the latest applied ops, op is the one that produced rev
+        self.history: deque[tuple[int, list]] = deque(maxlen=service.history_size)
+        # revision of the last op seen on the channel, ahead of rev only right after loading a newer snapshot
+        self.stream_rev = 0
+        self.flushed_rev = 0
+        # version - collab_rev of the stored note when it was loaded, see COLLAB_FLUSH_QUERY
+        self.version_offset = 0
+        self.ready = asyncio.Event()
+        # local connections that got the document, ops are only sent to them
+        self.editors: set[str] = set()
+
+        self._inbox: asyncio.Queue[str] = asyncio.Queue()
+        self._sync_request: Optional[str] = None
+        self._marker_seen = False
+        # ops that followed our sync marker, replayed once the snapshot is loaded
+        self._buffer: list[dict] = []
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        await self.service.backend.subscribe(self.channel, self._inbox.put_nowait)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run()), loop.create_task(self._flush_periodically())]
+        await self._start_sync()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await self.service.backend.unsubscribe(self.channel)
+        if self.ready.is_set():
+            await self.flush()
+
+    @property
+    def oldest_rev(self) -> int:
+        """Oldest revision ops can still be made against"""
+        return self.rev - len(self.history)
+
+    def rebase(self, op: list, base_rev: int) -> list:
+        """Transform an op made against base_rev over every op applied since"""
+        for _, applied in islice(self.history, base_rev - self.oldest_rev, None):
+            op = ot.transform(op, applied, "left")
+        return op
+
+    def ops_since(self, rev: int) -> Optional[list[dict]]:
+        """The ops after rev, None if they are no longer in history"""
+        if not self.oldest_rev <= rev <= self.rev:
+            return None
+        return [{"rev": applied_rev, "op": op} for applied_rev, op in islice(self.history, rev - self.oldest_rev, None)]
+
+    async def flush(self, verify: bool = False) -> bool:
+        """
+        Write the document back if it changed since the last flush, False if the note was changed outside
+        of it (the document is outdated). verify checks that even when there is nothing to write.
+        """
+        rev, content = self.rev, self.text
+        if rev <= self.flushed_rev and not verify:
+            return True
+        params = {"id": self.note_id, "text": content, "rev": rev, "version_offset": self.version_offset}
+        async with AsyncSessionLocal() as session:
+            written = None
+            if rev > self.flushed_rev:
+                written = (await session.execute(sql("collab.flush", COLLAB_FLUSH_QUERY), params)).first()
+            if written is None:
+                # another replica flushed this revision already, or the note was written by something else
+                stored = (await session.execute(sql("collab.version_offset", COLLAB_VERSION_OFFSET_QUERY), {"id": self.note_id})).first()
+                if stored is not None and stored.version_offset != self.version_offset:
+                    logger.warning("Note %s was changed outside of collaborative editing, reloading it", self.note_id)
+                    return False
+            await session.commit()
+        self.flushed_rev = max(self.flushed_rev, rev)
+        return True
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.service.flush_interval)
+            try:
+                if not await self.flush():
+                    await self._resync()
+            except Exception as e:
+                logger.error("Error flushing note %s: %s", self.note_id, e)
+
+    async def _load(self) -> None:
+        async with AsyncSessionLocal() as session:
+            res = (await session.execute(sql("collab.load", COLLAB_LOAD_QUERY), {"id": self.note_id})).one_or_none()
+        self.text, self.rev, self.version_offset = (res.text, res.collab_rev, res.version_offset) if res is not None else ("", 0, 0)
+        self.stream_rev = self.flushed_rev = self.rev
+        self.history.clear()
+
+    async def _start_sync(self) -> None:
+        self.ready.clear()
+        self._sync_request = uuid.uuid4().hex
+        self._marker_seen = False
+        self._buffer = []
+        await self.service.publish(self.channel, "sync", self._sync_request)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while True:
+            if self.ready.is_set() or not self._marker_seen:
+                deadline = None
+            elif deadline is None:
+                deadline = loop.time() + self.service.sync_timeout
+
+            try:
+                if deadline is None:
+                    data = await self._inbox.get()
+                else:
+                    data = await asyncio.wait_for(self._inbox.get(), max(deadline - loop.time(), 0))
+            except TimeoutError:
+                await self._sync_timed_out()
+                continue
+
+            # take whatever else already arrived, the ops among it go to the editors in one message
+            messages = [data]
+            while not self._inbox.empty():
+                messages.append(self._inbox.get_nowait())
+
+            applied = []
+            try:
+                for data in messages:
+                    kind, body = data.split("\n", 1)
+                    if not self.ready.is_set():
+                        await self._handle_syncing(kind, body)
+                    elif kind == "op":
+                        if not self._apply(json.loads(body), applied):
+                            self._send_ops(applied)
+                            await self._resync()
+                    else:
+                        self._send_ops(applied)
+                        await self._handle(kind, body)
+                self._send_ops(applied)
+            except Exception as e:
+                logger.error("Error in collaborative editing of note %s: %s", self.note_id, e)
+                await self._resync()
+
+    def _send_ops(self, applied: list) -> None:
+        if applied:
+            self.service.manager.send_many(self.room_id, self.editors, {"type": "ops", "ops": list(applied)})
+            applied.clear()
+
+    async def _handle(self, kind: str, body: str) -> None:
+        if kind == "sync" and body != self._sync_request:
+            # hand the document over to a new replica: store it as of this point of the channel
+            rev = self.rev
+            try:
+                flushed = await self.flush(verify=True)
+            except Exception as e:
+                logger.error("Error flushing note %s for a new replica: %s", self.note_id, e)
+                return
+            if not flushed:
+                # the stored note is newer than this document, the new replica loads it once nobody answers
+                # (CollabService.note_changed sends a marker nobody waits for to get here)
+                await self._resync()
+                return
+            await self.service.publish(self.channel, "synced", json.dumps({"request": body, "rev": rev}))
+
+    def _apply(self, message: dict, applied: list) -> bool:
+        """Apply an op of the channel, False if this replica can't (it lacks history) and must resync"""
+        self.stream_rev += 1
+        if self.stream_rev <= self.rev:
+            # already part of the snapshot this replica loaded
+            return True
+
+        base_rev = message["rev"]
+        if not self.oldest_rev <= base_rev <= self.rev:
+            logger.warning("Note %s: op against revision %s outside of history, resyncing", self.note_id, base_rev)
+            return False
+
+        op = self.rebase(message["op"], base_rev)
+        self.text = ot.apply(self.text, op)
+        self.rev += 1
+        self.history.append((self.rev, op))
+        applied.append({"rev": self.rev, "op": op, "id": message["id"], "connection": message["connection"]})
+        return True
+
+    async def _handle_syncing(self, kind: str, body: str) -> None:
+        if kind == "sync" and body == self._sync_request:
+            self._marker_seen = True
+        elif kind == "op" and self._marker_seen:
+            self._buffer.append(json.loads(body))
+        elif kind == "synced" and self._marker_seen:
+            answer = json.loads(body)
+            if answer["request"] != self._sync_request:
+                return
+            await self._load()
+            # the buffered ops are numbered from the answering replica's revision at our marker
+            self.stream_rev = answer["rev"]
+            await self._finish_sync()
+
+    async def _sync_timed_out(self) -> None:
+        if self._buffer:
+            # ops were published, so someone has the document and will answer a new marker
+            await self._start_sync()
+            return
+        await self._load()
+        await self._finish_sync()
+
+    async def _finish_sync(self) -> None:
+        buffer, self._buffer = self._buffer, []
+        for message in buffer:
+            if not self._apply(message, []):
+                await self._start_sync()
+                return
+        self.ready.set()
+
+        # editors already here (after a resync) start over from the current document
+        self.service.manager.send_many(self.room_id, self.editors, self.snapshot())
+
+    def snapshot(self) -> dict:
+        return {"type": "snapshot", "rev": self.rev, "text": self.text}
+
+    async def _resync(self) -> None:
+        try:
+            await self._start_sync()
+        except Exception as e:
+            logger.error("Error resyncing note %s: %s", self.note_id, e)
+
+
+class CollabService:
+    """The documents of the notes being edited in this process, one per note with local editors."""
+
+    def __init__(
+        self,
+        manager: WebSocketManager,
+        flush_interval: float = settings.COLLAB_FLUSH_INTERVAL_SECONDS,
+        history_size: int = settings.COLLAB_HISTORY_SIZE,
+        sync_timeout: float = settings.COLLAB_SYNC_TIMEOUT_SECONDS,
+    ):
+        self.manager = manager
+        self.backend = manager.backend
+        self.flush_interval = flush_interval
+        self.history_size = history_size
+        self.sync_timeout = sync_timeout
+        self.documents: Dict[int, CollabDocument] = {}
+
+    async def publish(self, channel: str, kind: str, body: str) -> None:
+        await self.backend.publish(channel, f"{kind}\n{body}")
+
+    async def note_changed(self, note_id: int) -> None:
+        """
+        The note was written outside of collaborative editing (PATCH): the replicas, in every process,
+        check the stored note against their document and reload it
+        """
+        await self.publish(f"collab:note:{note_id}", "sync", uuid.uuid4().hex)
+
+    async def open(self, note_id: int) -> CollabDocument:
+        """The note's document, synced, for an editor that already joined the note's room"""
+        document = self.documents.get(note_id)
+        if document is None:
+            document = self.documents[note_id] = CollabDocument(self, note_id)
+            try:
+                await document.start()
+            except Exception:
+                del self.documents[note_id]
+                await document.stop()
+                raise
+        await document.ready.wait()
+        return document
+
+    async def leave(self, note_id: int, connection_id: str) -> None:
+        """
+        Forget an editor (that already left the note's room), the document is written back
+        and dropped once the last local editor is gone
+        """
+        document = self.documents.get(note_id)
+        if document is None:
+            return
+        document.editors.discard(connection_id)
+        if self.manager.room_size(document.room_id):
+            return
+        del self.documents[note_id]
+        try:
+            await document.stop()
+        except Exception as e:
+            logger.error("Error closing note %s: %s", note_id, e)
+
+    async def stop(self) -> None:
+        for note_id in list(self.documents):
+            document = self.documents.pop(note_id)
+            try:
+                await document.stop()
+            except Exception as e:
+                logger.error("Error closing note %s: %s", note_id, e)
+
+    def join(self, document: CollabDocument, connection_id: str, rev: Optional[int] = None) -> None:
+        """Catch a new editor up: the ops it missed if it knows a recent revision, the whole document otherwise"""
+        missed = document.ops_since(rev) if rev is not None else None
+        if missed is None:
+            self.manager.send(document.room_id, connection_id, document.snapshot())
+        else:
+            self.manager.send(document.room_id, connection_id, {"type": "ops", "ops": missed})
+        document.editors.add(connection_id)
+
+    async def submit(self, document: CollabDocument, connection_id: str, message: dict) -> None:
+        """Check an editor's op against the document and publish it, errors go back to the editor"""
+        op_id = message.get("id")
+
+        def reject(reason: str) -> None:
+            self.manager.send(document.room_id, connection_id, {"type": "error", "id": op_id, "message": reason})
+
+        base_rev = message.get("rev")
+        if isinstance(base_rev, bool) or not isinstance(base_rev, int):
+            return reject("Op needs the revision it was made against")
+        try:
+            op = ot.check(message.get("op"))
+        except ot.OTError as e:
+            return reject(str(e))
+
+        await document.ready.wait()
+        if not document.oldest_rev <= base_rev <= document.rev:
+            return reject("Revision is no longer in history, reload the note")
+        try:
+            ot.apply(document.text, document.rebase(op, base_rev))
+        except ot.OTError as e:
+            return reject(str(e))
+
+        body = json.dumps({"rev": base_rev, "op": op, "id": op_id, "connection": connection_id})
+        try:
+            await self.publish(document.channel, "op", body)
+        except Exception as e:
+            logger.error("Error publishing op for note %s: %s", document.note_id, e)
+            reject("Op could not be applied, it may be too large")
+
+
+# Create a global instance, on top of the note rooms of the websocket manager
+collab_service = CollabService(websocket_manager)
@@ -12,7 +12,25 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int | str = 30
     ALGORITHM: str = "HS256"  # Adding this for JWT encoding
+    TOKEN_BACKEND: str = "hmac"  # JWT implementation: hmac (stdlib), jose or pyjwt
     LOG_LEVEL: str = "INFO"
+    # Log records are written to stdout by a background thread, records past a full queue are dropped
+    LOG_FORMAT: str = "text"  # text (colored) or json (one object per line, with the request id)
+    LOG_QUEUE_SIZE: int = 10000
+    # DEBUG records only: the fraction kept, then at most this many per second from each logging call (0 is no limit)
+    LOG_DEBUG_SAMPLE_RATE: float = 1.0
+    LOG_DEBUG_RATE_LIMIT: float = 10
+
+    # Password hashing (bcrypt runs on a dedicated thread pool, not on the event loop)
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_LIMIT: int = 32  # hashes allowed to wait for a worker before returning 503
+
+    # Authenticated user cache used by get_current_user (per worker process)
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_SIZE: int = 10000
+
+    # Verified JWT claims cache used by verify_tokens and the websocket auth (per worker process)
+    TOKEN_CACHE_MAX_SIZE: int = 10000
 
     # Database settings
     DATABASE_URL: str
@@ -22,6 +40,44 @@ class Settings(BaseSettings):
     DATABASE_HOST: str
     DATABASE_PORT: str
 
+    # Connection pool settings (per engine, per worker process)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30  # seconds to wait for a free connection before failing
+    DB_POOL_RECYCLE: int = 1800  # seconds before a connection is replaced, -1 disables
+    DB_POOL_PRE_PING: bool = True
+    # server side prepared statements kept per async connection (asyncpg), 0 turns them off (pgbouncer in transaction mode)
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 256
+
+    # Optional read replica of the database (same credentials and database name), read-only endpoints
+    # query it when DATABASE_REPLICA_HOST is set, otherwise everything goes to the primary
+    DATABASE_REPLICA_HOST: str = ""
+    DATABASE_REPLICA_PORT: str = ""  # defaults to DATABASE_PORT
+    # a client that wrote reads from the primary for this many seconds after, longer than the replica's usual lag
+    DB_REPLICA_STICKY_SECONDS: int = 5
+
+    # Websocket rooms are fanned out to the other worker processes through postgres (LISTEN/NOTIFY),
+    # "memory" only reaches the current process (tests, single worker)
+    WEBSOCKET_BACKEND: str = "postgres"
+    # Outbound messages buffered per websocket before the slow consumer policy kicks in:
+    # drop_oldest, coalesce (replace queued messages of the same kind, then drop oldest) or disconnect
+    WEBSOCKET_SEND_QUEUE_SIZE: int = 256
+    WEBSOCKET_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    WEBSOCKET_SEND_TIMEOUT_SECONDS: float = 10  # a single send blocked this long disconnects the client
+    # Every connection gets a {"type": "ping"} this often, one that sent nothing (not even a pong)
+    # for WEBSOCKET_IDLE_TIMEOUT_SECONDS is closed, so half-open sockets don't pile up
+    WEBSOCKET_PING_INTERVAL_SECONDS: float = 20
+    WEBSOCKET_IDLE_TIMEOUT_SECONDS: float = 60
+    WEBSOCKET_AUTH_TIMEOUT_SECONDS: float = 10  # to send the token message after connecting
+    # Per worker process, connections past these are refused
+    WEBSOCKET_MAX_CONNECTIONS: int = 10000
+    WEBSOCKET_MAX_CONNECTIONS_PER_USER: int = 20
+
+    # Collaborative editing: documents being edited live in memory and are written back at most this often
+    COLLAB_FLUSH_INTERVAL_SECONDS: float = 2
+    COLLAB_HISTORY_SIZE: int = 1000  # ops kept per document, to rebase late ops and catch up reconnecting clients
+    COLLAB_SYNC_TIMEOUT_SECONDS: float = 0.3  # wait for another worker to hand over a document before loading it
+
     FRONTEND_URL: str 
     CORS_ORIGINS: str | list[str]
 
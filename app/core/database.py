@@ -1,18 +1,63 @@
 # Import SQLAlchemy components
+from fastapi import Depends, Request
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.core.config import settings
+from app.core.pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool, instrument_engine
 
 
 # Build the database URL
 DATABASE_URL = f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.POSTGRES_DB}"
 
+# Same database, reached through the asyncpg driver so queries don't block the event loop
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.POSTGRES_DB}"
+
+# Pool configuration shared by both engines
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
+
+# asyncpg prepares every statement on the server, enough are kept per connection for the app.core.queries registry
+ASYNC_CONNECT_ARGS = {"prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE}
+
 # Create database engine using connection URL from settings
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+
+# Create async database engine for the async endpoints
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, connect_args=ASYNC_CONNECT_ARGS, **POOL_OPTIONS)
+
+# Optional read replica for the read-only endpoints, async only (the sync engine has no readers left)
+if settings.DATABASE_REPLICA_HOST:
+    REPLICA_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.DATABASE_REPLICA_HOST}:{settings.DATABASE_REPLICA_PORT or settings.DATABASE_PORT}/{settings.POSTGRES_DB}"
+    replica_async_engine = create_async_engine(REPLICA_ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, connect_args=ASYNC_CONNECT_ARGS, **POOL_OPTIONS)
+else:
+    replica_async_engine = None
+
+# Collect checkout/overflow stats for the /health/db endpoint
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+if replica_async_engine is not None:
+    instrument_engine(replica_async_engine.sync_engine)
 
 # Create session factory with specified configuration
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Create async session factory (objects stay usable after commit, there is no lazy loading in async)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Same for the replica, None without one
+ReplicaAsyncSessionLocal = async_sessionmaker(bind=replica_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False) if replica_async_engine is not None else None
+
+# Cookie set by ReadYourWritesMiddleware after a write, its holder reads from the primary until it expires
+READ_PRIMARY_COOKIE = "read_primary"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
 # Create base class for declarative models
 Base = declarative_base()
 
@@ -29,3 +74,41 @@ def get_db():
         raise
     finally:
         db.close()
+
+
+# Async dependency function to manage database sessions (same commit/rollback rules as get_db)
+async def get_async_db():
+    # Create new async database session
+    db = AsyncSessionLocal()
+    try:
+        # Yield session to caller
+        yield db
+        await db.commit()  # Auto-commit after request
+    except Exception:
+        await db.rollback()  # Rollback on error
+        raise
+    finally:
+        await db.close()
+
+
+# Session factory for the request's reads: the replica, unless there is none, the request itself writes
+# (its reads have to see the primary's state), or the client wrote recently (read-your-writes)
+def read_session_factory(request: Request) -> async_sessionmaker:
+    if ReplicaAsyncSessionLocal is None or request.method not in SAFE_METHODS or request.cookies.get(READ_PRIMARY_COOKIE):
+        return AsyncSessionLocal
+    return ReplicaAsyncSessionLocal
+
+
+# Async dependency for read-only endpoints. Reads that stay on the primary reuse the request's get_async_db
+# session (FastAPI caches it per request), so a request never holds two primary connections; only the
+# replica gets a session of its own, nothing is committed on it (a replica session can't write anyway)
+async def get_async_read_db(request: Request, primary_db: AsyncSession = Depends(get_async_db)):
+    factory = read_session_factory(request)
+    if factory is AsyncSessionLocal:
+        yield primary_db
+        return
+    db = factory()
+    try:
+        yield db
+    finally:
+        await db.close()
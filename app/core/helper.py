@@ -1,3 +1,13 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import Response
+from sqlalchemy import Row
+
 from app.config.logger import logger
 
 
@@ -13,4 +23,73 @@ def rows2dict(rows) -> list[dict]:
     """Convert a list of SQLAlchemy Rows/Models to a list of dictionaries"""
     if rows is None:
         return []
-    return [row2dict(row) for row in rows]
\ No newline at end of file
+    return [row2dict(row) for row in rows]
+
+def _json_default(value):
+    # orjson handles dicts, lists, datetimes and UUIDs itself and only calls this for the rest
+    if isinstance(value, Row):
+        return dict(zip(value._fields, value))
+    if isinstance(value, uuid.UUID):
+        # asyncpg's UUID subclass
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _zip_rows(content):
+    # the rows of a result share their keys, looking them up once per list is most of the saving
+    if isinstance(content, list) and content and isinstance(content[0], Row):
+        keys = content[0]._fields
+        return [dict(zip(keys, row)) for row in content]
+    if isinstance(content, dict):
+        return {key: _zip_rows(value) for key, value in content.items()}
+    return content
+
+
+def rows2json(content) -> bytes:
+    """
+    Serialize Rows (a list of them from one result, or a dict holding such lists) straight to JSON bytes
+    with orjson, without the rows2dict copy and the jsonable_encoder pass FastAPI makes over it
+    """
+    return orjson.dumps(_zip_rows(content), default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_response(content, **kwargs) -> Response:
+    """An application/json Response of rows2json(content), returned as is by FastAPI"""
+    return Response(content=rows2json(content), media_type="application/json", **kwargs)
+
+def encode_cursor(*values) -> str:
+    """Pack keyset pagination values (datetimes, ints, strings) into an opaque url-safe cursor"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Unpack a cursor made by encode_cursor, raises ValueError if it was tampered with"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE/ILIKE wildcards so user input only matches literally (postgres' default escape is \\)"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def parse_etags(header: str | None) -> list[str]:
+    """Entity tags listed in an If-None-Match/If-Match header, weak W/ prefixes dropped ("*" is kept as is)"""
+    if not header:
+        return []
+    etags = []
+    for etag in header.split(","):
+        etag = etag.strip()
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        if etag:
+            etags.append(etag)
+    return etags
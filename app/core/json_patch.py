@@ -0,0 +1,156 @@
+import copy
+from typing import Any
+
+
+class JsonPatchError(ValueError):
+    """The patch can't be applied to the document (bad pointer, missing member, failed test...)."""
+
+
+def parse_pointer(pointer: str) -> list[str]:
+    """Split a JSON pointer (RFC 6901) into its unescaped reference tokens, "" is the whole document"""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _array_index(array: list, token: str, allow_end: bool) -> int:
+    if allow_end and token == "-":
+        return len(array)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index {token!r}")
+    index = int(token)
+    if index > len(array) or (index == len(array) and not allow_end):
+        raise JsonPatchError(f"Array index {index} out of range")
+    return index
+
+
+def _resolve(doc: Any, tokens: list[str]) -> Any:
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise JsonPatchError(f"Member {token!r} not found")
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[_array_index(doc, token, allow_end=False)]
+        else:
+            raise JsonPatchError(f"Can't reference {token!r} inside a {type(doc).__name__}")
+    return doc
+
+
+def _get(doc: Any, pointer: str) -> Any:
+    return _resolve(doc, parse_pointer(pointer))
+
+
+def _add(doc: Any, pointer: str, value: Any) -> Any:
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+    parent, token = _resolve(doc, tokens[:-1]), tokens[-1]
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, token, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Can't add {pointer!r} to a {type(parent).__name__}")
+    return doc
+
+
+def _remove(doc: Any, pointer: str) -> tuple[Any, Any]:
+    """Remove the value at pointer, returns (doc, removed value)"""
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise JsonPatchError("Can't remove the whole document")
+    parent, token = _resolve(doc, tokens[:-1]), tokens[-1]
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Member {token!r} not found")
+        return doc, parent.pop(token)
+    if isinstance(parent, list):
+        return doc, parent.pop(_array_index(parent, token, allow_end=False))
+    raise JsonPatchError(f"Can't remove {pointer!r} from a {type(parent).__name__}")
+
+
+def _splice(doc: Any, pointer: str, offset: int, length: int, text: str) -> Any:
+    """Replace `length` characters at `offset` of the string at pointer with `text`"""
+    current = _get(doc, pointer)
+    if not isinstance(current, str):
+        raise JsonPatchError(f"{pointer!r} is not a string")
+    if offset < 0 or length < 0 or offset + length > len(current):
+        raise JsonPatchError(f"Range {offset}:{offset + length} out of bounds for a string of length {len(current)}")
+    value = current[:offset] + text + current[offset + length:]
+    if not parse_pointer(pointer):
+        return value
+    doc, _ = _remove(doc, pointer)
+    return _add(doc, pointer, value)
+
+
+def _value(operation: dict) -> Any:
+    """The operation's value, a copy, which add, replace and test require (a null value is still a value)"""
+    if "value" not in operation:
+        raise JsonPatchError(f"{operation.get('op')} is missing its value")
+    return copy.deepcopy(operation["value"])
+
+
+def _json_equal(a: Any, b: Any) -> bool:
+    """Equality of JSON values (RFC 6902 test): same type, true is not 1, numbers compare by value"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+
+def apply_patch(doc: Any, operations: list[dict]) -> Any:
+    """
+    Apply a JSON Patch (RFC 6902: add, remove, replace, move, copy, test) to a copy of `doc`.
+
+    Also accepts {"op": "splice", "path": ..., "offset": n, "length": m, "value": "text"}, which
+    replaces a character range of a string, so an edit of a long text sends only the changed range.
+    Offsets count unicode code points. All or nothing: raises JsonPatchError and leaves `doc` as is.
+    """
+    doc = copy.deepcopy(doc)
+    for operation in operations:
+        op, path = operation.get("op"), operation.get("path")
+        if not isinstance(path, str):
+            raise JsonPatchError(f"Operation {op!r} is missing its path")
+
+        if op == "add":
+            doc = _add(doc, path, _value(operation))
+        elif op == "remove":
+            doc, _ = _remove(doc, path)
+        elif op == "replace":
+            value = _value(operation)
+            if parse_pointer(path):
+                doc, _ = _remove(doc, path)
+            doc = _add(doc, path, value)
+        elif op == "move":
+            source = operation.get("from")
+            if not isinstance(source, str):
+                raise JsonPatchError("move is missing its from")
+            if path != source and path.startswith(source + "/"):
+                raise JsonPatchError("Can't move a value into one of its children")
+            doc, value = _remove(doc, source)
+            doc = _add(doc, path, value)
+        elif op == "copy":
+            source = operation.get("from")
+            if not isinstance(source, str):
+                raise JsonPatchError("copy is missing its from")
+            doc = _add(doc, path, copy.deepcopy(_get(doc, source)))
+        elif op == "test":
+            if not _json_equal(_get(doc, path), _value(operation)):
+                raise JsonPatchError(f"Test failed at {path!r}")
+        elif op == "splice":
+            offset, length, text = operation.get("offset"), operation.get("length", 0), operation.get("value")
+            # bool is an int in python, not in JSON
+            if not isinstance(offset, int) or isinstance(offset, bool) or not isinstance(length, int) or isinstance(length, bool) or not isinstance(text, str):
+                raise JsonPatchError("splice needs an integer offset and length and a string value")
+            doc = _splice(doc, path, offset, length, text)
+        else:
+            raise JsonPatchError(f"Unknown operation {op!r}")
+    return doc
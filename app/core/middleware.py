@@ -0,0 +1,270 @@
+"""
+Request ids for the logs, refreshed access tokens, read-your-writes for the read replica, and request metrics in the Prometheus text format, served at /metrics.
+
+Every uvicorn worker counts its own requests. With several workers, point PROMETHEUS_MULTIPROC_DIR
+at a directory shared by them and emptied before the server starts (docker/prod/start.sh does),
+the workers then write their metrics there and /metrics adds them up whichever worker answers.
+Without it /metrics only reports the worker that answered.
+"""
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.responses import Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config.logger import request_id
+from app.core import queries
+from app.core.database import READ_PRIMARY_COOKIE, SAFE_METHODS
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# seconds, requests here are mostly a few ms, bcrypt logins and slow queries take hundreds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# response header carrying the access token get_current_user refreshed, the client replaces its own with it
+NEW_ACCESS_TOKEN_HEADER = "X-New-Access-Token"
+
+# label for requests that matched no route (404s), so scanners don't create a series per path
+UNMATCHED_ROUTE = "unmatched"
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status code", ["method", "route", "status"])
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from receiving a request to the end of its response",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time spent executing database queries per request",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled", ["method"], multiprocess_mode="livesum",
+)
+
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Execution time of the named SQL statements (app.core.queries)",
+    ["query"], buckets=LATENCY_BUCKETS,
+)
+
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections", "Open (accepted) websocket connections", ["route"], multiprocess_mode="livesum",
+)
+WEBSOCKET_MESSAGES = Counter(
+    "websocket_messages_total", "Websocket messages, in is received from clients", ["route", "direction"],
+)
+WEBSOCKET_MESSAGE_BYTES = Counter(
+    "websocket_message_bytes_total", "Websocket message payload bytes (before compression)", ["route", "direction"],
+)
+
+# database seconds of the current request, a list so queries run in threads and greenlets add to the same total
+_db_duration: ContextVar[Optional[list]] = ContextVar("db_duration", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _observe_query(conn, context)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # a failed query never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_start"):
+        _observe_query(context.connection, context.execution_context, failed=True)
+
+
+def _observe_query(conn, context, failed: bool = False) -> None:
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    total = _db_duration.get()
+    if total is not None:
+        total[0] += elapsed
+    # statements from the app.core.queries registry carry their name
+    name = context.execution_options.get("query_name") if context is not None else None
+    if name is not None:
+        QUERY_DURATION.labels(name).observe(elapsed)
+        queries.observe(name, elapsed * 1000, failed)
+
+
+def _route(scope: Scope) -> str:
+    # the route template (/api/v1/note/{user_id}/{note_id}), set on the scope by the router
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+def _payload_size(message: Message) -> int:
+    if message.get("bytes") is not None:
+        return len(message["bytes"])
+    if message.get("text") is not None:
+        return len(message["text"].encode())
+    return 0
+
+
+class MetricsMiddleware:
+    """Times HTTP requests (total and database time) and counts websocket connections and messages."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _http(self, scope: Scope, receive: Receive, send: Send) -> None:
+        method = scope["method"]
+        status = 500  # unless the app gets to send a response
+        db_duration = [0.0]
+        token = _db_duration.set(db_duration)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            in_progress.dec()
+            _db_duration.reset(token)
+            route = _route(scope)
+            REQUESTS.labels(method, route, str(status)).inc()
+            REQUEST_DURATION.labels(method, route).observe(duration)
+            REQUEST_DB_DURATION.labels(method, route).observe(db_duration[0])
+
+    async def _websocket(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # the route is only known once the router has run, which is before the app accepts or receives anything
+        connections = None
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                route = _route(scope)
+                WEBSOCKET_MESSAGES.labels(route, "in").inc()
+                WEBSOCKET_MESSAGE_BYTES.labels(route, "in").inc(_payload_size(message))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal connections
+            await send(message)
+            if message["type"] == "websocket.send":
+                route = _route(scope)
+                WEBSOCKET_MESSAGES.labels(route, "out").inc()
+                WEBSOCKET_MESSAGE_BYTES.labels(route, "out").inc(_payload_size(message))
+            elif message["type"] == "websocket.accept" and connections is None:
+                connections = WEBSOCKET_CONNECTIONS.labels(_route(scope))
+                connections.inc()
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if connections is not None:
+                connections.dec()
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request and websocket connection an id, the client's X-Request-ID if it sent a sane one,
+    which the log records carry and HTTP responses echo back in X-Request-ID.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        value = incoming if 0 < len(incoming) <= 128 and incoming.isprintable() else uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = value
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
+
+
+class TokenRefreshMiddleware:
+    """Adds X-New-Access-Token to the response when get_current_user refreshed the request's access token."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # request.state is a view of scope["state"]
+                new_access_token = scope.get("state", {}).get("new_access_token")
+                if new_access_token:
+                    MutableHeaders(scope=message)[NEW_ACCESS_TOKEN_HEADER] = new_access_token
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Sets the read_primary cookie on the response to every successful write request (not GET/HEAD/OPTIONS),
+    the client's reads then go to the primary (see read_session_factory) until the replica has caught up.
+    """
+
+    def __init__(self, app: ASGIApp, sticky_seconds: int):
+        self.app = app
+        # same attributes as the refresh token cookie, the frontend is on another site
+        self.cookie = f"{READ_PRIMARY_COOKIE}=1; Max-Age={sticky_seconds}; Path=/; HttpOnly; Secure; SameSite=none"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                MutableHeaders(scope=message).append("set-cookie", self.cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def metrics_response() -> Response:
+    """All the metrics in the Prometheus text format, added up over the workers in multiprocess mode"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead() -> None:
+    """Drop this worker's in-progress and connection gauges when it shuts down (counters are kept)"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,187 @@
+"""
+Operational transformation for plain text.
+
+An operation is a list of components walking the document from the start:
+    n (int > 0)      retain (skip) n characters
+    "text"           insert text
+    {"d": n}         delete n characters
+Characters are unicode code points. Trailing retains are implicit.
+
+Same model (and transform rules) as the ottypes "text" type, so existing client libraries can
+produce and consume the operations.
+"""
+
+
+class OTError(ValueError):
+    """Malformed operation, or an operation that doesn't fit the document."""
+
+
+def check(op) -> list:
+    """Validate the shape of an operation, returns it normalized"""
+    if not isinstance(op, list):
+        raise OTError("Operation must be a list")
+    for component in op:
+        if isinstance(component, bool):
+            raise OTError(f"Invalid component {component!r}")
+        if isinstance(component, int):
+            if component <= 0:
+                raise OTError("Retain must be positive")
+        elif isinstance(component, str):
+            if not component:
+                raise OTError("Insert must not be empty")
+        elif isinstance(component, dict):
+            n = component.get("d")
+            if set(component) != {"d"} or isinstance(n, bool) or not isinstance(n, int) or n <= 0:
+                raise OTError(f"Invalid delete {component!r}")
+        else:
+            raise OTError(f"Invalid component {component!r}")
+    return normalize(op)
+
+
+def _append(op: list, component) -> None:
+    """Append a component, merging it with the last one when they are of the same kind"""
+    if component == 0 or component == "" or component == {"d": 0}:
+        return
+    if op:
+        last = op[-1]
+        if isinstance(component, int) and isinstance(last, int):
+            op[-1] = last + component
+            return
+        if isinstance(component, str) and isinstance(last, str):
+            op[-1] = last + component
+            return
+        if isinstance(component, dict) and isinstance(last, dict):
+            op[-1] = {"d": last["d"] + component["d"]}
+            return
+    op.append(component)
+
+
+def _trim(op: list) -> list:
+    if op and isinstance(op[-1], int):
+        op.pop()
+    return op
+
+
+def normalize(op: list) -> list:
+    result = []
+    for component in op:
+        _append(result, component)
+    return _trim(result)
+
+
+def apply(text: str, op: list) -> str:
+    """Apply an operation to a document, raises OTError if it doesn't fit"""
+    parts = []
+    pos = 0
+    for component in op:
+        if isinstance(component, int):
+            if pos + component > len(text):
+                raise OTError("Retain past the end of the document")
+            parts.append(text[pos:pos + component])
+            pos += component
+        elif isinstance(component, str):
+            parts.append(component)
+        else:
+            if pos + component["d"] > len(text):
+                raise OTError("Delete past the end of the document")
+            pos += component["d"]
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+class _Take:
+    """Consumes an operation in pieces of a requested length"""
+
+    def __init__(self, op: list):
+        self.op = op
+        self.index = 0
+        self.offset = 0
+
+    def peek(self):
+        return self.op[self.index] if self.index < len(self.op) else None
+
+    def take(self, n: int = -1, indivisible: str | None = None):
+        """
+        Up to n characters of the next component (all of it with n=-1), inserts are never
+        split when `indivisible` is "i". Past the end an implicit retain of n is returned.
+        """
+        if self.index == len(self.op):
+            return None if n == -1 else n
+
+        component = self.op[self.index]
+        if isinstance(component, int):
+            if n == -1 or component - self.offset <= n:
+                part = component - self.offset
+                self.index += 1
+                self.offset = 0
+                return part
+            self.offset += n
+            return n
+
+        if isinstance(component, str):
+            if n == -1 or indivisible == "i" or len(component) - self.offset <= n:
+                part = component[self.offset:]
+                self.index += 1
+                self.offset = 0
+                return part
+            part = component[self.offset:self.offset + n]
+            self.offset += n
+            return part
+
+        if n == -1 or indivisible == "d" or component["d"] - self.offset <= n:
+            part = {"d": component["d"] - self.offset}
+            self.index += 1
+            self.offset = 0
+            return part
+        self.offset += n
+        return {"d": n}
+
+
+def _length(component) -> int:
+    if isinstance(component, int):
+        return component
+    if isinstance(component, str):
+        return len(component)
+    return component["d"]
+
+
+def transform(op: list, other: list, side: str) -> list:
+    """
+    Rewrite `op` so it applies after `other` (both made against the same document).
+    `side` breaks ties between inserts at the same position: "left" puts op's insert first.
+    """
+    if side not in ("left", "right"):
+        raise ValueError(f"side must be 'left' or 'right', not {side!r}")
+
+    result = []
+    pieces = _Take(op)
+
+    for component in other:
+        if isinstance(component, int):
+            # other retains: copy op over the same range
+            length = component
+            while length > 0:
+                chunk = pieces.take(length, "i")
+                _append(result, chunk)
+                if not isinstance(chunk, str):
+                    length -= _length(chunk)
+        elif isinstance(component, str):
+            # other inserts: op skips the inserted text, unless op inserts at the same place first
+            if side == "left" and isinstance(pieces.peek(), str):
+                _append(result, pieces.take())
+            _append(result, len(component))
+        else:
+            # other deletes: whatever op did to the deleted range goes away, except its inserts
+            length = component["d"]
+            while length > 0:
+                chunk = pieces.take(length, "i")
+                if isinstance(chunk, int):
+                    length -= chunk
+                elif isinstance(chunk, str):
+                    _append(result, chunk)
+                else:
+                    length -= chunk["d"]
+
+    while (component := pieces.take()) is not None:
+        _append(result, component)
+    return _trim(result)
@@ -0,0 +1,123 @@
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+# upper bounds (ms) of the checkout wait time histogram buckets, the last bucket is +Inf
+WAIT_TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolStats:
+    """Counters for a single connection pool, safe to update from worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.wait_time_total_ms = 0.0
+        self.wait_time_buckets = [0] * (len(WAIT_TIME_BUCKETS_MS) + 1)
+
+    def observe_wait(self, wait_ms: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total_ms += wait_ms
+            self.wait_time_buckets[bisect_left(WAIT_TIME_BUCKETS_MS, wait_ms)] += 1
+
+    def observe_connect(self) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def observe_overflow(self) -> None:
+        with self._lock:
+            self.overflow_events += 1
+
+    def observe_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            # cumulative counts per bucket, same shape as a prometheus histogram
+            histogram = {}
+            running = 0
+            for bound, count in zip((*WAIT_TIME_BUCKETS_MS, "+Inf"), self.wait_time_buckets):
+                running += count
+                histogram[str(bound)] = running
+
+            return {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+                "wait_time_avg_ms": round(self.wait_time_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_time_ms_histogram": histogram,
+            }
+
+
+class InstrumentedPoolMixin:
+    """Times every connection checkout and records timeouts and overflow connections on the pool's PoolStats."""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.observe_timeout()
+            raise
+        self.stats.observe_wait((time.perf_counter() - start) * 1000)
+        return conn
+
+    def _inc_overflow(self):
+        # _overflow starts at -pool_size, so a positive value means the new connection is beyond pool_size
+        created = super()._inc_overflow()
+        if created and self._overflow > 0:
+            self.stats.observe_overflow()
+        return created
+
+    def recreate(self):
+        # keep the same stats object when the engine recreates the pool (e.g. after dispose)
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine) -> PoolStats:
+    """Attach a PoolStats to the engine's (instrumented) pool and start counting connects."""
+    pool = engine.pool
+    pool.stats = PoolStats()
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        engine.pool.stats.observe_connect()
+
+    return pool.stats
+
+
+def pool_status(engine) -> dict:
+    """Current occupancy plus the collected stats of an engine's pool."""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+        "timeout": pool.timeout(),
+        **pool.stats.snapshot(),
+    }
@@ -0,0 +1,171 @@
+import asyncio
+from typing import Callable, Dict, Set
+
+import asyncpg
+
+from app.config.logger import logger
+
+
+# called with the payload of every message published on a subscribed channel
+MessageCallback = Callable[[str], None]
+
+
+class PubSubBackend:
+    """
+    Delivers messages published on a channel to every subscriber of that channel, in any worker process.
+    Subscribers also receive their own process' messages, filtering those out is up to the caller.
+    """
+
+    name: str = ""
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def subscribe(self, channel: str, callback: MessageCallback) -> None:
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str) -> None:
+        raise NotImplementedError
+
+    async def publish(self, channel: str, payload: str) -> None:
+        raise NotImplementedError
+
+
+class InMemoryBackend(PubSubBackend):
+    """
+    Single process backend, for tests and single worker deployments.
+    Backends sharing a `bus` see each other's messages, which is how tests stand in for several workers.
+    """
+
+    name = "memory"
+
+    def __init__(self, bus: Dict[str, Set[MessageCallback]] | None = None):
+        # {channel: callbacks of every backend subscribed to it}
+        self.bus = bus if bus is not None else {}
+        self._callbacks: Dict[str, MessageCallback] = {}
+
+    async def subscribe(self, channel: str, callback: MessageCallback) -> None:
+        self._callbacks[channel] = callback
+        self.bus.setdefault(channel, set()).add(callback)
+
+    async def unsubscribe(self, channel: str) -> None:
+        callback = self._callbacks.pop(channel, None)
+        subscribers = self.bus.get(channel)
+        if callback is not None and subscribers is not None:
+            subscribers.discard(callback)
+            if not subscribers:
+                del self.bus[channel]
+
+    async def publish(self, channel: str, payload: str) -> None:
+        for callback in list(self.bus.get(channel, ())):
+            callback(payload)
+
+    async def stop(self) -> None:
+        for channel in list(self._callbacks):
+            await self.unsubscribe(channel)
+
+
+class PostgresBackend(PubSubBackend):
+    """
+    LISTEN/NOTIFY on the app database, so every worker (and every host) sharing it gets the messages.
+
+    Each worker keeps one dedicated connection that LISTENs on the channels it has subscribers for,
+    and reconnects (and re-LISTENs) if that connection drops. Messages are published with pg_notify
+    on a second connection. NOTIFY payloads are limited to 8000 bytes, larger messages are refused.
+    """
+
+    name = "postgres"
+
+    # postgres' NOTIFY payload limit (in the default build)
+    MAX_PAYLOAD_BYTES = 7999
+    RECONNECT_DELAY_SECONDS = 1.0
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        # {channel: asyncpg listener wrapping the subscriber's callback}
+        self._listeners: Dict[str, Callable] = {}
+        self._listen_connection = None
+        self._publish_connection = None
+        # asyncpg connections run one query at a time
+        self._listen_lock = asyncio.Lock()
+        self._publish_lock = asyncio.Lock()
+        self._reconnect_task: asyncio.Task | None = None
+        self._stopped = False
+
+    async def start(self) -> None:
+        self._stopped = False
+        await self._connect_listener()
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for connection in (self._listen_connection, self._publish_connection):
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        self._listen_connection = self._publish_connection = None
+
+    async def _connect_listener(self) -> None:
+        async with self._listen_lock:
+            connection = await asyncpg.connect(self.dsn)
+            connection.add_termination_listener(self._on_listener_lost)
+            for channel, listener in self._listeners.items():
+                await connection.add_listener(channel, listener)
+            self._listen_connection = connection
+
+    def _on_listener_lost(self, connection) -> None:
+        if self._stopped or connection is not self._listen_connection:
+            return
+        logger.error("pubsub LISTEN connection lost, reconnecting")
+        self._listen_connection = None
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._stopped:
+            try:
+                await self._connect_listener()
+                return
+            except Exception as e:
+                logger.error("pubsub reconnect failed: %s", e)
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+
+    @staticmethod
+    def _listener(callback: MessageCallback):
+        # asyncpg's listener signature
+        def on_notification(connection, pid, channel, payload):
+            callback(payload)
+        return on_notification
+
+    async def subscribe(self, channel: str, callback: MessageCallback) -> None:
+        listener = self._listeners[channel] = self._listener(callback)
+        async with self._listen_lock:
+            if self._listen_connection is not None:
+                await self._listen_connection.add_listener(channel, listener)
+
+    async def unsubscribe(self, channel: str) -> None:
+        listener = self._listeners.pop(channel, None)
+        if listener is None:
+            return
+        async with self._listen_lock:
+            if self._listen_connection is not None:
+                await self._listen_connection.remove_listener(channel, listener)
+
+    async def publish(self, channel: str, payload: str) -> None:
+        if len(payload.encode()) > self.MAX_PAYLOAD_BYTES:
+            raise ValueError(f"Message of {len(payload.encode())} bytes is too large to publish")
+
+        async with self._publish_lock:
+            if self._publish_connection is None or self._publish_connection.is_closed():
+                self._publish_connection = await asyncpg.connect(self.dsn)
+            await self._publish_connection.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+
+def get_pubsub_backend(name: str, dsn: str) -> PubSubBackend:
+    if name == InMemoryBackend.name:
+        return InMemoryBackend()
+    if name == PostgresBackend.name:
+        return PostgresBackend(dsn)
+    raise ValueError(f"Unknown websocket backend {name!r}, expected 'postgres' or 'memory'")
@@ -0,0 +1,70 @@
+"""
+Registry of the hand-written SQL, every statement is executed as sql("name", statement).
+
+The first call wraps the statement in text() and names it, every later call gets that same TextClause
+back (a dict lookup), so SQLAlchemy parses the bind parameters and computes the cache key once and
+takes the compiled statement from the engine's compiled cache. asyncpg then prepares each statement
+on the server and keeps DB_PREPARED_STATEMENT_CACHE_SIZE of them per connection, repeat executions
+skip Postgres' parsing (and planning, once it settles on a generic plan).
+
+The engine listeners in app.core.middleware time the executions of named statements, per worker here
+(query_stats, served at /health/queries) and in db_query_duration_seconds for /metrics.
+"""
+import threading
+
+from sqlalchemy import TextClause, text
+
+
+class QueryStats:
+    """Executions of one named statement, safe to update from worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float, failed: bool = False) -> None:
+        with self._lock:
+            self.executions += 1
+            self.errors += failed
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "errors": self.errors,
+                "total_ms": round(self.total_ms, 3),
+                "avg_ms": round(self.total_ms / self.executions, 3) if self.executions else 0.0,
+                "max_ms": round(self.max_ms, 3),
+            }
+
+
+# (name, statement) -> the statement's TextClause, a name can cover several variants of a dynamic statement
+_statements: dict[tuple[str, str], TextClause] = {}
+_stats: dict[str, QueryStats] = {}
+
+
+def sql(name: str, statement: str) -> TextClause:
+    """The statement as a TextClause named `name`, built on the first call"""
+    key = (name, statement)
+    clause = _statements.get(key)
+    if clause is None:
+        _stats.setdefault(name, QueryStats())
+        clause = _statements.setdefault(key, text(statement).execution_options(query_name=name))
+    return clause
+
+
+def observe(name: str, elapsed_ms: float, failed: bool = False) -> None:
+    stats = _stats.get(name)
+    if stats is not None:
+        stats.observe(elapsed_ms, failed)
+
+
+def query_stats() -> dict:
+    """Every named statement's executions, the most time spent first"""
+    table = {name: stats.snapshot() for name, stats in _stats.items()}
+    return dict(sorted(table.items(), key=lambda item: item[1]["total_ms"], reverse=True))
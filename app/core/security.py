@@ -1,8 +1,8 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
-from typing import Optional
-from jwcrypto import jwt
-from app.core.config import SECRET_KEY, ALGORITHM
+from app.core.config import settings
 
 # import bcrypt
 # if not hasattr(bcrypt, '__about__'):
@@ -17,20 +17,46 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password) 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    """Create a JWT token."""
-    to_encode = data.copy()
-    
-    # Set token expiration
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    
-    to_encode.update({"exp": expire})
-    # Create JWT token
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-def decode_access_token(token: str) -> dict:
-    pass
\ No newline at end of file
+
+class HashingExecutor:
+    """
+    Runs bcrypt on a small thread pool so a login storm doesn't freeze the event loop.
+    bcrypt releases the GIL, so the workers hash in parallel with request handling.
+    Once `workers + queue_limit` hashes are in flight new ones fail fast with a 503.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.max_in_flight = workers + queue_limit
+        # only touched from the event loop thread, no lock needed
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def run(self, func, *args):
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        # the slot is held until the hash is done, not until the request stops waiting (a client that
+        # disconnects leaves its hash queued or running); done callbacks run on the worker thread
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+
+
+hashing_executor = HashingExecutor(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_executor.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await hashing_executor.run(get_password_hash, password)
@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from calendar import timegm
+from datetime import datetime
+
+
+class TokenError(Exception):
+    """Token is malformed, has a bad signature or fails claim validation."""
+
+
+class TokenExpiredError(TokenError):
+    """Token signature is valid but its exp claim is in the past."""
+
+
+def _normalize_claims(claims: dict) -> dict:
+    # registered time claims may be passed as datetimes, JWTs carry them as unix timestamps
+    normalized = dict(claims)
+    for claim in ("exp", "iat", "nbf"):
+        if isinstance(normalized.get(claim), datetime):
+            normalized[claim] = timegm(normalized[claim].utctimetuple())
+    return normalized
+
+
+class TokenCodec:
+    """Encodes and verifies signed JWTs, one subclass per JWT library."""
+
+    name: str = ""
+
+    def __init__(self, secret_key: str, algorithm: str):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def encode(self, claims: dict) -> str:
+        raise NotImplementedError
+
+    def decode(self, token: str) -> dict:
+        """Return the verified claims or raise TokenExpiredError/TokenError."""
+        raise NotImplementedError
+
+
+class JoseCodec(TokenCodec):
+    """python-jose, the original implementation."""
+
+    name = "jose"
+
+    def __init__(self, secret_key: str, algorithm: str):
+        super().__init__(secret_key, algorithm)
+        from jose import jwt, JWTError, ExpiredSignatureError
+        self._jwt = jwt
+        self._errors = (JWTError, ExpiredSignatureError)
+
+    def encode(self, claims: dict) -> str:
+        return self._jwt.encode(_normalize_claims(claims), self.secret_key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        jwt_error, expired_error = self._errors
+        try:
+            return self._jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except expired_error as e:
+            raise TokenExpiredError(str(e)) from e
+        except jwt_error as e:
+            raise TokenError(str(e)) from e
+
+
+class PyJWTCodec(TokenCodec):
+    """PyJWT, optional: only importable when `pyjwt` is installed."""
+
+    name = "pyjwt"
+
+    def __init__(self, secret_key: str, algorithm: str):
+        super().__init__(secret_key, algorithm)
+        try:
+            import jwt
+        except ImportError as e:
+            raise RuntimeError("TOKEN_BACKEND=pyjwt requires the 'pyjwt' package") from e
+        self._jwt = jwt
+
+    def encode(self, claims: dict) -> str:
+        return self._jwt.encode(_normalize_claims(claims), self.secret_key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        try:
+            return self._jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except self._jwt.ExpiredSignatureError as e:
+            raise TokenExpiredError(str(e)) from e
+        except self._jwt.InvalidTokenError as e:
+            raise TokenError(str(e)) from e
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class HMACCodec(TokenCodec):
+    """
+    Minimal HS256/HS384/HS512 JWTs built on the standard library only.
+    Produces and accepts the same compact tokens as jose/PyJWT, so backends can be switched
+    without logging anybody out.
+    """
+
+    name = "hmac"
+
+    DIGESTS = {
+        "HS256": hashlib.sha256,
+        "HS384": hashlib.sha384,
+        "HS512": hashlib.sha512,
+    }
+
+    def __init__(self, secret_key: str, algorithm: str):
+        super().__init__(secret_key, algorithm)
+        if algorithm not in self.DIGESTS:
+            raise ValueError(f"HMACCodec does not support algorithm {algorithm}")
+        self._key = secret_key.encode()
+        self._digest = self.DIGESTS[algorithm]
+        # the header never changes, encode it once
+        self._header = _b64encode(json.dumps({"alg": algorithm, "typ": "JWT"}, separators=(",", ":")).encode())
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return hmac.new(self._key, signing_input, self._digest).digest()
+
+    def encode(self, claims: dict) -> str:
+        payload = _b64encode(json.dumps(_normalize_claims(claims), separators=(",", ":")).encode())
+        signing_input = self._header + b"." + payload
+        return (signing_input + b"." + _b64encode(self._sign(signing_input))).decode()
+
+    def decode(self, token: str) -> dict:
+        try:
+            header_segment, payload_segment, signature_segment = token.split(".")
+            signature = _b64decode(signature_segment)
+        except (AttributeError, ValueError) as e:
+            raise TokenError("Malformed token") from e
+
+        signing_input = f"{header_segment}.{payload_segment}".encode()
+        if not hmac.compare_digest(signature, self._sign(signing_input)):
+            raise TokenError("Signature verification failed")
+
+        try:
+            header = json.loads(_b64decode(header_segment))
+            claims = json.loads(_b64decode(payload_segment))
+        except ValueError as e:
+            raise TokenError("Malformed token") from e
+
+        if header.get("alg") != self.algorithm:
+            raise TokenError("Algorithm not allowed")
+        if not isinstance(claims, dict):
+            raise TokenError("Invalid payload")
+
+        now = time.time()
+        exp = claims.get("exp")
+        if exp is not None:
+            if not isinstance(exp, (int, float)):
+                raise TokenError("Expiration Time claim (exp) must be a number")
+            if exp <= now:
+                raise TokenExpiredError("Signature has expired")
+        nbf = claims.get("nbf")
+        if nbf is not None:
+            if not isinstance(nbf, (int, float)):
+                raise TokenError("Not Before claim (nbf) must be a number")
+            if nbf > now:
+                raise TokenError("The token is not yet valid (nbf)")
+
+        return claims
+
+
+TOKEN_CODECS = {codec.name: codec for codec in (HMACCodec, JoseCodec, PyJWTCodec)}
+
+
+def get_token_codec(name: str, secret_key: str, algorithm: str) -> TokenCodec:
+    try:
+        codec_class = TOKEN_CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown token backend {name!r}, expected one of {sorted(TOKEN_CODECS)}")
+    return codec_class(secret_key, algorithm)
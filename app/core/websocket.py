@@ -1,185 +1,505 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, Set, Callable, Any, Optional
-import json
+from typing import Dict, Set, Callable, Any, Iterable, Optional
+from collections import deque
+from bisect import bisect_left
+from functools import partial
+import time
+import uuid
 import asyncio
 from datetime import datetime
 
+from app.config.logger import logger
+from app.core.config import settings
+from app.core.database import DATABASE_URL
+from app.core.pubsub import PubSubBackend, get_pubsub_backend
+from app.core.ws_codec import Codec, EncodedMessage, Frame, JSON_CODEC
+
+
+# upper bounds (ms) of the queued-to-sent latency histogram buckets, the last bucket is +Inf
+SEND_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+# what happens when a client's outbound queue is full
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# close code sent to evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# close code sent to connections that stopped answering pings ("going away")
+IDLE_CLOSE_CODE = 1001
+
+
+class ConnectionLimitExceeded(Exception):
+    """Refused connection, this process already has too many (for the user, or in total)."""
+
+    def __init__(self, message: str, close_code: int):
+        super().__init__(message)
+        self.close_code = close_code
+
+
+class RoomStats:
+    """Delivery counters of one room in this process (only touched from the event loop, no locking)."""
+
+    def __init__(self):
+        self.broadcasts = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self.send_latency_total_ms = 0.0
+        self.send_latency_buckets = [0] * (len(SEND_LATENCY_BUCKETS_MS) + 1)
+
+    def observe_send(self, latency_ms: float) -> None:
+        self.sent += 1
+        self.send_latency_total_ms += latency_ms
+        self.send_latency_buckets[bisect_left(SEND_LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+    def snapshot(self) -> dict:
+        # cumulative counts per bucket, same shape as the pool wait time histogram
+        histogram = {}
+        running = 0
+        for bound, count in zip((*SEND_LATENCY_BUCKETS_MS, "+Inf"), self.send_latency_buckets):
+            running += count
+            histogram[str(bound)] = running
+
+        return {
+            "broadcasts": self.broadcasts,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "evicted": self.evicted,
+            "send_latency_avg_ms": round(self.send_latency_total_ms / self.sent, 3) if self.sent else 0.0,
+            "send_latency_ms_histogram": histogram,
+        }
+
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded messages (text or binary frames, in the connection's codec) for one
+    websocket, drained by its own writer task, so a slow client only ever delays (and costs memory for) itself.
+
+    When the queue is full the policy decides:
+        drop_oldest: the oldest queued message is dropped
+        coalesce:    a queued message with the same coalesce key is dropped, otherwise drop_oldest
+        disconnect:  the client is evicted (also when a single send blocks for `send_timeout`)
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        stats: RoomStats,
+        on_evict: Callable[[], None],
+        codec: Codec = JSON_CODEC,
+        max_size: int = settings.WEBSOCKET_SEND_QUEUE_SIZE,
+        policy: str = settings.WEBSOCKET_SLOW_CONSUMER_POLICY,
+        send_timeout: float = settings.WEBSOCKET_SEND_TIMEOUT_SECONDS,
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}, expected one of {SLOW_CONSUMER_POLICIES}")
+        self.websocket = websocket
+        self.stats = stats
+        self.on_evict = on_evict
+        self.codec = codec
+        self.max_size = max_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        # [payload, coalesce_key, queued_at], oldest first
+        self._queue: deque[list] = deque()
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._write())
+
+    def stop(self) -> None:
+        self.closed = True
+        self._queue.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def put(self, payload: Frame, coalesce_key: Optional[str] = None) -> None:
+        """Queue a message without waiting, applying the policy when the queue is full"""
+        if self.closed:
+            return
+
+        if len(self._queue) >= self.max_size:
+            if self.policy == "disconnect":
+                self._evict("send queue full")
+                return
+            replaced = None
+            if self.policy == "coalesce" and coalesce_key is not None:
+                replaced = next((entry for entry in self._queue if entry[1] == coalesce_key), None)
+            if replaced is not None:
+                # the newer message goes to the back, so a client never gets an older state after a newer one
+                self._queue.remove(replaced)
+                self.stats.coalesced += 1
+            else:
+                self._queue.popleft()
+                self.stats.dropped += 1
+
+        self._queue.append([payload, coalesce_key, time.perf_counter()])
+        self._ready.set()
+
+    async def _write(self) -> None:
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            payload, _, queued_at = self._queue.popleft()
+            try:
+                async with asyncio.timeout(self.send_timeout):
+                    if isinstance(payload, bytes):
+                        await self.websocket.send_bytes(payload)
+                    else:
+                        await self.websocket.send_text(payload)
+            except TimeoutError:
+                self._evict("send timed out")
+                return
+            except Exception as e:
+                # the socket is gone, the endpoint's receive loop takes care of leaving the room
+                logger.debug("Error sending message: %s", e)
+                self.stop()
+                return
+            self.stats.observe_send((time.perf_counter() - queued_at) * 1000)
+
+    def _evict(self, reason: str) -> None:
+        logger.warning("Evicting slow websocket consumer: %s", reason)
+        self.stats.evicted += 1
+        self.stop()
+        self.on_evict()
+
+
 class WebSocketManager:
     """
-    A reusable WebSocket manager that handles connections, rooms, and message broadcasting.
-    
+    A reusable WebSocket manager that handles rooms and message broadcasting across worker processes.
+
     Design decisions:
-    1. Using a class-based approach for better organization and state management
-    2. Supporting both room-based and direct messaging
-    3. Implementing connection tracking with nested dictionaries for O(1) lookups
-    4. Adding support for custom message handlers
+    1. Rooms (e.g. one per note) only hold the connections of this process, the other worker processes
+       are reached through a pub/sub channel per room, subscribed while the room has local members
+    2. Connections are keyed by a per-connection id, one user can be connected several times (tabs, devices)
+    3. A broadcast is encoded once per codec in use (JSON, MessagePack), queued for the local members
+       and published once (as JSON) for the others
+    4. Every connection has a bounded outbound queue and its own writer task, so broadcasting never
+       waits on a client and a slow client can't delay the others (see OutboundQueue)
+    5. Connections are pinged every `ping_interval`, and any message from the client counts as alive
+       (see touch), the ones silent for `idle_timeout` are closed: a half-open socket never errors
+    6. Connections are capped per user and in total, so a worker's socket memory stays bounded
+    7. Adding support for custom message handlers
     """
 
-    def __init__(self):
-        # Store active connections as: {client_id: {room_id: websocket}}
-        # Pros: O(1) lookup for specific client/room combinations
-        # Cons: More memory usage than a flat structure
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
-        
-        # Store room subscribers as: {room_id: set(client_ids)}
-        # Pros: Fast room-based operations, easy to manage subscriptions
-        # Cons: Additional memory overhead for tracking relationships
-        self.room_subscribers: Dict[str, Set[str]] = {}
-        
+    def __init__(
+        self,
+        backend: PubSubBackend,
+        ping_interval: float = settings.WEBSOCKET_PING_INTERVAL_SECONDS,
+        idle_timeout: float = settings.WEBSOCKET_IDLE_TIMEOUT_SECONDS,
+        max_connections: int = settings.WEBSOCKET_MAX_CONNECTIONS,
+        max_connections_per_user: int = settings.WEBSOCKET_MAX_CONNECTIONS_PER_USER,
+        **queue_options
+    ):
+        self.backend = backend
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
+
+        # OutboundQueue options (max_size, policy, send_timeout), the settings by default
+        self.queue_options = queue_options
+
+        # Tags messages published by this process so they aren't delivered here twice
+        self.process_id = uuid.uuid4().hex
+
+        # Store room members as: {room_id: {connection_id: outbound queue (holding the websocket)}}
+        # Pros: O(1) join/leave, a broadcast walks exactly the room's sockets
+        self.rooms: Dict[str, Dict[str, OutboundQueue]] = {}
+
+        # Delivery counters of every active room: {room_id: RoomStats}
+        self.room_stats: Dict[str, RoomStats] = {}
+
+        # Store the client (user) of every connection as: {connection_id: client_id}
+        self.connection_clients: Dict[str, str] = {}
+
+        # Number of connections of every connected client as: {client_id: count}
+        self.client_connections: Dict[str, int] = {}
+
+        # Last time anything was received on a connection as: {connection_id: monotonic time}
+        self.last_seen: Dict[str, float] = {}
+
+        # Connections closed for being idle, and refused for the limits, since start
+        self.idle_closed = 0
+        self.rejected = 0
+
         # Store custom message handlers as: {message_type: handler_function}
-        # Pros: Extensible, allows custom behavior per message type
-        # Cons: Requires more setup code
         self.message_handlers: Dict[str, Callable] = {}
 
+        # Closing of evicted connections, referenced until they finish
+        self._tasks: Set[asyncio.Task] = set()
+        self._heartbeat_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self.backend.start()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        await self.backend.stop()
+
+    @staticmethod
+    def channel(room_id: str) -> str:
+        return f"room:{room_id}"
+
     async def connect(
-        self, 
-        websocket: WebSocket, 
-        client_id: str, 
-        room_id: str
-    ) -> None:
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        room_id: str,
+        codec: Codec = JSON_CODEC
+    ) -> str:
         """
-        Establish a new WebSocket connection.
-        
+        Add an (already accepted) WebSocket connection to a room.
+
         Args:
             websocket: The WebSocket connection instance
             client_id: Unique identifier for the client (e.g., user_id)
             room_id: Identifier for the room/feature (e.g., note_id, chat_id)
+            codec: Encoding of the messages sent to it, negotiated when accepting (see ws_codec.negotiate)
+
+        Returns:
+            The connection id, used to leave the room and to exclude the sender from broadcasts
+
+        Raises:
+            ConnectionLimitExceeded: too many connections in this process, for the client or in total
         """
-        try:
-            await websocket.accept()
-            
-            # Initialize nested dictionaries if they don't exist
-            if client_id not in self.active_connections:
-                self.active_connections[client_id] = {}
-            self.active_connections[client_id][room_id] = websocket
-            
-            # Initialize room if it doesn't exist
-            if room_id not in self.room_subscribers:
-                self.room_subscribers[room_id] = set()
-            self.room_subscribers[room_id].add(client_id)
-            
-            # Notify room subscribers about new connection
+        if len(self.connection_clients) >= self.max_connections:
+            self.rejected += 1
+            raise ConnectionLimitExceeded("Too many connections, try again later", SLOW_CONSUMER_CLOSE_CODE)
+        if self.client_connections.get(client_id, 0) >= self.max_connections_per_user:
+            self.rejected += 1
+            # policy violation, retrying won't help until the client closes some
+            raise ConnectionLimitExceeded("Too many connections for this user", 1008)
+
+        connection_id = uuid.uuid4().hex
+
+        room = self.rooms.get(room_id)
+        if room is None:
+            # first local member, start receiving the room's messages from the other processes
+            room = self.rooms[room_id] = {}
+            self.room_stats[room_id] = RoomStats()
+            await self.backend.subscribe(self.channel(room_id), partial(self._on_published, room_id))
+
+        queue = OutboundQueue(
+            websocket,
+            self.room_stats[room_id],
+            on_evict=partial(self._evict, room_id, connection_id),
+            codec=codec,
+            **self.queue_options,
+        )
+        queue.start()
+        room[connection_id] = queue
+        self.connection_clients[connection_id] = client_id
+        self.client_connections[client_id] = self.client_connections.get(client_id, 0) + 1
+        self.last_seen[connection_id] = time.monotonic()
+
+        # Notify room subscribers about new connection
+        await self.broadcast_to_room(
+            room_id,
+            {
+                "type": "connection_status",
+                "status": "connected",
+                "client_id": client_id,
+                "timestamp": datetime.utcnow().isoformat()
+            },
+            exclude_connection=connection_id,
+            coalesce_key=f"connection_status:{client_id}"
+        )
+        return connection_id
+
+    async def disconnect(self, room_id: str, connection_id: str) -> None:
+        """
+        Remove a connection from its room (the socket itself is closed by the caller).
+
+        Design: Gracefully handle all cleanup operations to prevent memory leaks
+        """
+        client_id = self.connection_clients.pop(connection_id, None)
+        self.last_seen.pop(connection_id, None)
+        if client_id is not None:
+            remaining = self.client_connections.pop(client_id) - 1
+            if remaining:
+                self.client_connections[client_id] = remaining
+
+        room = self.rooms.get(room_id)
+        queue = room.pop(connection_id, None) if room is not None else None
+        if queue is None:
+            return
+        queue.stop()
+
+        if not room:
+            del self.rooms[room_id]
+            del self.room_stats[room_id]
+            await self.backend.unsubscribe(self.channel(room_id))
+        else:
+            # Notify remaining room subscribers about disconnection
             await self.broadcast_to_room(
                 room_id,
                 {
                     "type": "connection_status",
-                    "status": "connected",
+                    "status": "disconnected",
                     "client_id": client_id,
                     "timestamp": datetime.utcnow().isoformat()
                 },
-                exclude_client=client_id
+                coalesce_key=f"connection_status:{client_id}"
             )
-            
-        except Exception as e:
-            print(f"Error connecting client {client_id}: {str(e)}")
-            await self.disconnect(client_id, room_id)
 
-    async def disconnect(self, client_id: str, room_id: str) -> None:
-        """
-        Handle WebSocket disconnection cleanup.
-        
-        Design: Gracefully handle all cleanup operations to prevent memory leaks
-        """
-        # Remove from active connections
-        if client_id in self.active_connections:
-            self.active_connections[client_id].pop(room_id, None)
-            if not self.active_connections[client_id]:
-                del self.active_connections[client_id]
-        
-        # Remove from room subscribers
-        if room_id in self.room_subscribers:
-            self.room_subscribers[room_id].discard(client_id)
-            if not self.room_subscribers[room_id]:
-                del self.room_subscribers[room_id]
-            else:
-                # Notify remaining room subscribers about disconnection
-                await self.broadcast_to_room(
-                    room_id,
-                    {
-                        "type": "connection_status",
-                        "status": "disconnected",
-                        "client_id": client_id,
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                )
+    def touch(self, connection_id: str) -> None:
+        """Record that the client is alive, call it for every message received from it"""
+        if connection_id in self.last_seen:
+            self.last_seen[connection_id] = time.monotonic()
+
+    async def _heartbeat(self) -> None:
+        # one ping payload per round, coalesced so a slow client never has more than one queued
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            ping = EncodedMessage({"type": "ping"})
+            for room_id, room in list(self.rooms.items()):
+                for connection_id, queue in list(room.items()):
+                    if now - self.last_seen.get(connection_id, now) > self.idle_timeout:
+                        logger.info("Closing idle websocket connection %s", connection_id)
+                        self.idle_closed += 1
+                        self._evict(room_id, connection_id, IDLE_CLOSE_CODE)
+                    else:
+                        queue.put(ping.encode(queue.codec), coalesce_key="ping")
+
+    def _evict(self, room_id: str, connection_id: str, code: int = SLOW_CONSUMER_CLOSE_CODE) -> None:
+        """Close a connection's socket (slow or idle), its endpoint then leaves the room as for any disconnect"""
+        queue = self.rooms.get(room_id, {}).get(connection_id)
+        if queue is None:
+            return
+        queue.stop()
+
+        async def close():
+            try:
+                await queue.websocket.close(code=code)
+            except Exception as e:
+                logger.debug("Error closing websocket: %s  might already be closed", e)
+            await self.disconnect(room_id, connection_id)
+
+        task = asyncio.get_running_loop().create_task(close())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def send(self, room_id: str, connection_id: str, message: dict) -> None:
+        """Queue a message for a single connection, behind what was already broadcast to it"""
+        queue = self.rooms.get(room_id, {}).get(connection_id)
+        if queue is not None:
+            queue.put(queue.codec.encode(message))
+
+    def send_many(self, room_id: str, connection_ids: Iterable[str], message: dict) -> None:
+        """Queue a message for some of this process' connections of a room, encoded once per codec"""
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        encoded = EncodedMessage(message)
+        for connection_id in connection_ids:
+            if (queue := room.get(connection_id)) is not None:
+                queue.put(encoded.encode(queue.codec))
 
     async def broadcast_to_room(
-        self, 
-        room_id: str, 
-        message: dict, 
-        exclude_client: Optional[str] = None
-    ) -> None:
-        """
-        Broadcast a message to all clients in a room.
-        
-        Design: Using async broadcasting for better performance with many clients
-        """
-        if room_id in self.room_subscribers:
-            # Create tasks for all sends to handle them concurrently
-            tasks = []
-            for client_id in self.room_subscribers[room_id]:
-                if client_id != exclude_client:
-                    if websocket := self.get_connection(client_id, room_id):
-                        tasks.append(self._safe_send(websocket, message))
-            
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
-
-    async def _safe_send(
-        self, 
-        websocket: WebSocket, 
-        message: dict
+        self,
+        room_id: str,
+        message: dict,
+        exclude_connection: Optional[str] = None,
+        coalesce_key: Optional[str] = None
     ) -> None:
         """
-        Safely send a message through a WebSocket connection.
-        
-        Design: Wrapper method to handle send errors gracefully
+        Broadcast a message to all clients in a room, in every worker process.
+
+        Design: Encode once per codec, queue for the local members without waiting on any of them,
+        a single publish reaches the other processes. Queued messages with the same
+        `coalesce_key` may be replaced by this one for clients that fell behind.
         """
+        encoded = EncodedMessage(message)
+        self._deliver(room_id, encoded, exclude_connection, coalesce_key)
+
         try:
-            await websocket.send_json(message)
+            payload = encoded.encode(JSON_CODEC)
+            await self.backend.publish(self.channel(room_id), f"{self.process_id}\n{coalesce_key or ''}\n{payload}")
         except Exception as e:
-            print(f"Error sending message: {str(e)}")
+            logger.error("Error publishing to room %s: %s", room_id, e)
 
-    def get_connection(
-        self, 
-        client_id: str, 
-        room_id: str
-    ) -> Optional[WebSocket]:
-        """
-        Get a specific WebSocket connection.
-        
-        Design: Safe access to nested dictionaries with None fallback
-        """
-        return self.active_connections.get(client_id, {}).get(room_id)
+    def _on_published(self, room_id: str, data: str) -> None:
+        """Backend callback for every message published on a room's channel, including our own"""
+        origin, coalesce_key, payload = data.split("\n", 2)
+        if origin != self.process_id:
+            self._deliver(room_id, EncodedMessage(json_text=payload), coalesce_key=coalesce_key or None)
+
+    def _deliver(
+        self,
+        room_id: str,
+        encoded: EncodedMessage,
+        exclude_connection: Optional[str] = None,
+        coalesce_key: Optional[str] = None
+    ) -> None:
+        """Queue a message for this process' members of a room, in the codec of each"""
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        self.room_stats[room_id].broadcasts += 1
+        for connection_id, queue in list(room.items()):
+            if connection_id != exclude_connection:
+                queue.put(encoded.encode(queue.codec), coalesce_key)
+
+    def room_size(self, room_id: str) -> int:
+        """Number of this process' connections in a room"""
+        return len(self.rooms.get(room_id, ()))
+
+    def stats(self) -> dict:
+        """Rooms, connections and per-room delivery counters of this process"""
+        return {
+            "rooms": len(self.rooms),
+            "connections": len(self.connection_clients),
+            "users": len(self.client_connections),
+            "max_connections": self.max_connections,
+            "max_connections_per_user": self.max_connections_per_user,
+            "idle_closed": self.idle_closed,
+            "rejected": self.rejected,
+            "queued": sum(len(queue) for room in self.rooms.values() for queue in room.values()),
+            "per_room": {room_id: stats.snapshot() for room_id, stats in self.room_stats.items()},
+        }
 
     def register_handler(
-        self, 
-        message_type: str, 
+        self,
+        message_type: str,
         handler: Callable
     ) -> None:
         """
         Register a custom message handler.
-        
+
         Design: Allows extending functionality without modifying core code
         """
         self.message_handlers[message_type] = handler
 
     async def handle_message(
-        self, 
-        client_id: str, 
-        room_id: str, 
+        self,
+        client_id: str,
+        room_id: str,
         message: dict
     ) -> None:
         """
         Process incoming messages using registered handlers.
-        
+
         Design: Dynamic message handling based on message type
         """
         message_type = message.get("type")
         if message_type and (handler := self.message_handlers.get(message_type)):
             await handler(client_id, room_id, message)
         else:
-            print(f"No handler registered for message type: {message_type}")
+            logger.warning("No handler registered for message type: %s", message_type)
 
-# Create a global instance
-websocket_manager = WebSocketManager() 
\ No newline at end of file
+# Create a global instance, rooms are fanned out across workers by WEBSOCKET_BACKEND
+websocket_manager = WebSocketManager(get_pubsub_backend(settings.WEBSOCKET_BACKEND, DATABASE_URL))
@@ -12,38 +12,33 @@ class WebSocketManager:
     def __init__(self):
         # Track pending connections {client_id: set(websocket)}
         self.pending_connections: Dict[str, WebSocket] = {}
-        # Track active connections {client_id: set(websocket)}
-        self.active_connections: Dict[str, WebSocket] = {}
+        # Track active connections {client_id: set(websocket)}, client_id must be the authenticated user,
+        # a user can have several connections (tabs, devices)
+        self.active_connections: Dict[str, Set[WebSocket]] = {}
 
     async def connect(self, websocket: WebSocket, client_id: str) -> None:
 
-        # check if current user already has a connection open
-        if client_id in self.active_connections:
-            try:
-                old_connection = self.active_connections[client_id]
-                await old_connection.close(code=1000)
-                logger.info(f"Closed existing connection for client {client_id}")
-            except Exception as e:
-                logger.error(f"Error closing existing connection: {e}")
-        
         # Accept the new connection
         await websocket.accept()
         
         # Store the connection
-        self.active_connections[client_id] = websocket
-        logger.info(f"Client {client_id} connected successfully")
+        self.active_connections.setdefault(client_id, set()).add(websocket)
+        logger.info("Client %s connected successfully", client_id)
 
 
     async def disconnect(self, client_id: str, websocket: WebSocket) -> None:
-        # Remove from active connections
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-        logger.info(f"Client {client_id} disconnected successfully")
+        # Remove from active connections, the client's other connections stay open
+        connections = self.active_connections.get(client_id)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:
+                del self.active_connections[client_id]
+        logger.info("Client %s disconnected successfully", client_id)
 
         try:
             await websocket.close()
         except Exception as e:
-            logger.error(f"Error closing websocket: {e}  might already be closed")
+            logger.error("Error closing websocket: %s  might already be closed", e)
 
 
 # Create a global instance
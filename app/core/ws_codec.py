@@ -0,0 +1,148 @@
+"""
+Wire encodings of websocket messages, negotiated per connection with the WebSocket subprotocol.
+
+A client offers them in Sec-WebSocket-Protocol, in order of preference:
+    senya.msgpack.v1   binary MessagePack frames, [type code, {other fields}]
+    senya.json.v1      JSON text frames, {"type": "...", ...}
+Clients that offer none get JSON (the original protocol). The auth message is always JSON text.
+
+permessage-deflate is negotiated by the server (uvicorn enables it by default), it applies to both
+encodings when the client offers it.
+"""
+import json
+from typing import Any, Dict, Optional, Union
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # optional, MessagePack just isn't offered without it
+    msgpack = None
+
+
+# integer codes of the message types in MessagePack frames, never reuse a code
+MESSAGE_TYPE_CODES = {
+    "joined": 1,
+    "connection_status": 2,
+    "message": 3,
+    "snapshot": 4,
+    "ops": 5,
+    "op": 6,
+    "error": 7,
+    "ping": 8,
+    "pong": 9,
+}
+MESSAGE_TYPES = {code: name for name, code in MESSAGE_TYPE_CODES.items()}
+
+Frame = Union[str, bytes]
+
+
+class CodecError(ValueError):
+    """A frame that can't be decoded with the connection's encoding."""
+
+
+class Codec:
+    name: str = ""
+    subprotocol: str = ""
+
+    def encode(self, message: dict) -> Frame:
+        raise NotImplementedError
+
+    def decode(self, frame: Frame) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+    subprotocol = "senya.json.v1"
+
+    def encode(self, message: dict) -> Frame:
+        return json.dumps(message)
+
+    def decode(self, frame: Frame) -> Any:
+        try:
+            return json.loads(frame)
+        except ValueError as e:
+            raise CodecError(str(e))
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    subprotocol = "senya.msgpack.v1"
+
+    def encode(self, message: dict) -> Frame:
+        body = dict(message)
+        code = MESSAGE_TYPE_CODES.get(body.get("type"))
+        if code is None:
+            # unknown types keep their name in the body
+            return msgpack.packb([0, body])
+        del body["type"]
+        return msgpack.packb([code, body])
+
+    def decode(self, frame: Frame) -> Any:
+        if isinstance(frame, str):
+            raise CodecError("Expected a binary frame")
+        try:
+            decoded = msgpack.unpackb(frame)
+        except Exception as e:
+            raise CodecError(str(e))
+        if isinstance(decoded, list) and len(decoded) == 2 and isinstance(decoded[1], dict):
+            code, body = decoded
+            if code in MESSAGE_TYPES:
+                return {"type": MESSAGE_TYPES[code], **body}
+            return body
+        return decoded
+
+
+JSON_CODEC = JsonCodec()
+
+# by subprotocol
+CODECS: Dict[str, Codec] = {JSON_CODEC.subprotocol: JSON_CODEC}
+if msgpack is not None:
+    CODECS[MsgpackCodec.subprotocol] = MsgpackCodec()
+
+
+def negotiate(subprotocols: list[str]) -> tuple[Codec, Optional[str]]:
+    """The codec for a client's offered subprotocols, and the subprotocol to accept (None if it offered none we know)"""
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol], subprotocol
+    return JSON_CODEC, None
+
+
+class EncodedMessage:
+    """A message to deliver to several connections, encoded at most once per codec"""
+
+    def __init__(self, message: Optional[dict] = None, json_text: Optional[str] = None):
+        self.message = message
+        self._frames: Dict[str, Frame] = {}
+        if json_text is not None:
+            self._frames[JSON_CODEC.name] = json_text
+
+    def encode(self, codec: Codec) -> Frame:
+        frame = self._frames.get(codec.name)
+        if frame is None:
+            if self.message is None:
+                # received as JSON from another process
+                self.message = json.loads(self._frames[JSON_CODEC.name])
+            frame = self._frames[codec.name] = codec.encode(self.message)
+        return frame
+
+
+async def send_message(websocket: WebSocket, codec: Codec, message: dict) -> None:
+    """Send a message directly (not through a room's queue), in the connection's codec"""
+    frame = codec.encode(message)
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+async def receive_frame(websocket: WebSocket) -> Frame:
+    """The next text or binary frame, raises WebSocketDisconnect when the client is gone"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("text") is not None:
+        return message["text"]
+    return message.get("bytes") or b""
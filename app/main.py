@@ -1,8 +1,17 @@
 # main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.core.config import settings
 from app.config.logger import logger 
+from app.core.database import engine, async_engine, replica_async_engine
+from app.core.pool import pool_status
+from app.core.auth import user_cache, token_cache
+from app.core.queries import query_stats
+from app.core.websocket import websocket_manager
+from app.core.collab import collab_service
+from app.core.middleware import MetricsMiddleware, RequestIdMiddleware, TokenRefreshMiddleware, ReadYourWritesMiddleware, NEW_ACCESS_TOKEN_HEADER, metrics_response, mark_process_dead
 
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="passlib.utils")
@@ -11,7 +20,18 @@ from .v1.router import api_router
 
 logger.info("Starting application...")
 
-app = FastAPI(title=settings.APP_NAME, debug=settings.DEBUG, openapi_url=f"{settings.API_V1_STR}/openapi.json")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # connects the websocket pub/sub backend (the LISTEN connection) in this worker's event loop
+    await websocket_manager.start()
+    yield
+    # writes back the notes being edited in this worker
+    await collab_service.stop()
+    await websocket_manager.stop()
+    mark_process_dead()
+
+# endpoints returning dicts and models are rendered with orjson, the large listings return json_response() themselves
+app = FastAPI(title=settings.APP_NAME, debug=settings.DEBUG, openapi_url=f"{settings.API_V1_STR}/openapi.json", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,8 +39,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # readable by the frontend's javascript
+    expose_headers=[NEW_ACCESS_TOKEN_HEADER, "X-Request-ID", "ETag"],
 )
 
+app.add_middleware(TokenRefreshMiddleware)
+if replica_async_engine is not None:
+    app.add_middleware(ReadYourWritesMiddleware, sticky_seconds=settings.DB_REPLICA_STICKY_SECONDS)
+app.add_middleware(RequestIdMiddleware)
+
+# outermost, so the timings include the other middlewares
+app.add_middleware(MetricsMiddleware)
+
 @app.get("/")
 async def read_root():
     return {"message": "Hello, World!"}
@@ -29,6 +59,49 @@ async def read_root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/health/db")
+async def health_db():
+    # pool stats are per worker process, each uvicorn worker reports its own pools
+    pools = {
+        "sync": pool_status(engine),
+        "async": pool_status(async_engine.sync_engine),
+    }
+    if replica_async_engine is not None:
+        pools["replica"] = pool_status(replica_async_engine.sync_engine)
+    return {"status": "healthy", "pools": pools}
+
+@app.get("/health/cache")
+async def health_cache():
+    # cache stats are per worker process
+    return {
+        "status": "healthy",
+        "caches": {
+            "user": user_cache.stats(),
+            "token": token_cache.stats(),
+        },
+    }
+
+@app.get("/health/queries")
+async def health_queries():
+    # executions of the named SQL statements in this worker process, the most time spent first
+    return {
+        "status": "healthy",
+        "queries": query_stats(),
+    }
+
+@app.get("/health/websocket")
+async def health_websocket():
+    # rooms and delivery counters of this worker process only
+    return {
+        "status": "healthy",
+        "websocket": websocket_manager.stats(),
+    }
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # a sync endpoint: in multiprocess mode this reads every worker's metric files
+    return metrics_response()
+
 
 # This code configures CORS policies for your FastAPI backend. Here's a detailed breakdown:
 # What is CORS?
@@ -1,18 +1,35 @@
 from app.models.base import BaseModel
 from sqlalchemy import (
-    Column, String, Integer, ForeignKey, Text, DateTime, func, Boolean
+    Column, String, Integer, ForeignKey, Text, DateTime, func, Boolean, Index, Computed, DDL, event
 )
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR
+
+# full text search document of a note: title (weight A) and text body (weight B)
+NOTE_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content->>'content', '')), 'B')"
+)
+
+# the (user_id, name gin_trgm_ops) indexes below need pg_trgm, and btree_gin for the uuid column,
+# create them before the tables (migrations do the same)
+event.listen(BaseModel.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+event.listen(BaseModel.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS btree_gin"))
 
 class NoteFolder(BaseModel):
     __tablename__ = "note_folder"
+    # substring (ILIKE '%q%') lookups of a user's folder names for typeahead
+    __table_args__ = (
+        Index("ix_note_folder_user_name_trgm", "user_id", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), index=True, nullable=False)
     name = Column(String(50), nullable=False)
     is_root = Column(Boolean, default=False, nullable=False)
-    parent_id = Column(Integer, ForeignKey("note_folder.id"), nullable=True)
+    parent_id = Column(Integer, ForeignKey("note_folder.id"), index=True, nullable=True)
+    # materialized path of ids from the top level folder down to this one, e.g. "1/5/9/"
+    path = Column(String(collation="C"), index=True, nullable=False)
 
     # Relationships
     user = relationship("User", back_populates="note_folders")
@@ -21,13 +38,30 @@ class NoteFolder(BaseModel):
 
 class Note(BaseModel):
     __tablename__ = "note"
+    # keyset pagination of a user's notes, optionally filtered by folder or format
+    __table_args__ = (
+        Index("ix_note_user_updated_at", "user_id", "updated_at", "id"),
+        Index("ix_note_user_folder_updated_at", "user_id", "folder_id", "updated_at", "id"),
+        Index("ix_note_user_format_updated_at", "user_id", "format", "updated_at", "id"),
+        Index("ix_note_search_vector", "search_vector", postgresql_using="gin"),
+        # typeahead on the user's note names
+        Index("ix_note_user_name_trgm", "user_id", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     name = Column(String(150), nullable=False)
-    folder_id = Column(Integer, ForeignKey("note_folder.id"), nullable=False)
+    folder_id = Column(Integer, ForeignKey("note_folder.id"), index=True, nullable=False)
     content = Column(JSONB, nullable=True)
     format = Column(String(20), nullable=False)
+    # always set (pagination sorts on it), raw SQL updates must set it to now() themselves
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    # revision counter, every content write must increment it (it is the note's ETag)
+    version = Column(Integer, server_default="1", nullable=False)
+    # collaborative editing sequence number the stored content corresponds to (see app/core/collab.py)
+    collab_rev = Column(Integer, server_default="0", nullable=False)
+    # maintained by postgres, never written by the app
+    search_vector = Column(TSVECTOR, Computed(NOTE_SEARCH_VECTOR, persisted=True))
 
     # Relationships
     user = relationship("User", back_populates="notes")
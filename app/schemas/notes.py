@@ -1,7 +1,7 @@
 from email import contentmanager
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, StrictInt, field_validator
 from datetime import datetime, date
-from typing import List, Dict
+from typing import Any, List, Dict, Literal
 import uuid
 class NoteFolder(BaseModel):
     id: int
@@ -58,6 +58,21 @@ class NoteEdit(BaseModel):
     content: Dict 
     folder_id: int 
 
+class NotePatchOperation(BaseModel):
+    # RFC 6902 operations plus "splice": replace `length` characters at `offset` of a string with `value`
+    op: Literal["add", "remove", "replace", "move", "copy", "test", "splice"]
+    path: str
+    value: Any = None
+    from_: str | None = Field(None, alias="from")
+    # strict: true would otherwise become 1
+    offset: StrictInt | None = None
+    length: StrictInt | None = None
+
+class NotePatch(BaseModel):
+    # version the patch was made against, see Note.version
+    version: int
+    operations: List[NotePatchOperation] = Field(..., min_length=1)
+
 class NoteDelete(BaseModel):
     id: int
     user_id: str
\ No newline at end of file
@@ -6,18 +6,16 @@ from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends, Cookie, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.queries import sql
 from app.schemas.login import LoginRequest, LoginResponse
-from app.core.database import get_db
-from app.core.security import verify_password, get_password_hash
+from app.core.database import get_async_db
+from app.core.security import verify_password_async, get_password_hash_async
 from app.config.logger import logger
 import uuid
-from jose import JWTError, jwt
 
 from app.core.helper import row2dict
 from app.core.auth import (
-    token_auth,
     create_access_token,
     create_refresh_token,
     refresh_access_token,
@@ -26,7 +24,7 @@ from app.config.constants import REFRESH_TOKEN_EXPIRE_DAYS
 from app.core.config import settings
 from app.schemas.login import RegisterRequest, RegisterResponse, Token
 from app.schemas.user import User
-from app.core.auth import get_current_user
+from app.core.auth import get_current_user, invalidate_user
 
 from app.v1.endpoints.note_folder import create_default_folder
 
@@ -36,8 +34,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
 @router.post("/login", response_model=LoginResponse)
-async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
-    logger.info(f"Login attempt with email: {login_data.email}")
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    logger.info("Login attempt with email: %s", login_data.email)
 
     # Get user and hashed password
     query = """
@@ -46,13 +44,13 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
         WHERE email = :email
     """
 
-    res = db.execute(text(query), {"email": login_data.email}).first()
+    res = (await db.execute(sql("auth.login_user", query), {"email": login_data.email})).first()
 
     res_dict = row2dict(res)
     if (
         not res_dict
         or not res_dict.get("email")
-        or not verify_password(login_data.password, res_dict.get("password_hash", ""))
+        or not await verify_password_async(login_data.password, res_dict.get("password_hash", ""))
     ):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
 
@@ -89,9 +87,9 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/register")
-async def register(register_data: RegisterRequest, db: Session = Depends(get_db)):
+async def register(register_data: RegisterRequest, db: AsyncSession = Depends(get_async_db)):
 
-    logger.debug(f"register_data: {register_data}")
+    logger.debug("register_data: %s", register_data)
     # Check if user exists by username and email
     check_query = """
         SELECT email 
@@ -99,16 +97,16 @@ async def register(register_data: RegisterRequest, db: Session = Depends(get_db)
         WHERE email = :email
         OR username = :username
     """
-    existing_user = db.execute(
-        text(check_query), {"email": register_data.email, "username": register_data.username}
-    ).first()
+    existing_user = (await db.execute(
+        sql("auth.check_existing_user", check_query), {"email": register_data.email, "username": register_data.username}
+    )).first()
 
 
     if existing_user:
         raise HTTPException(status_code=400, detail="Email or username already registered")
 
     # Hash the password
-    hashed_password = get_password_hash(register_data.password)
+    hashed_password = await get_password_hash_async(register_data.password)
 
     # generate a unique id for the user
     user_id = uuid.uuid4()
@@ -122,22 +120,25 @@ async def register(register_data: RegisterRequest, db: Session = Depends(get_db)
 
     try:
         # add new user to db
-        res = db.execute(
-            text(insert_query),
+        res = (await db.execute(
+            sql("auth.insert_user", insert_query),
             {
                 "id": user_id,
                 "email": register_data.email,
                 "username": register_data.username,
                 "password_hash": hashed_password,
             },
-        ).one()
+        )).one()
 
 
         # create a default root folder for the user
-        create_default_folder(db, register_data.username, user_id)
+        await create_default_folder(db, register_data.username, user_id)
 
         # commit the transaction
-        db.commit()
+        await db.commit()
+
+        # make sure no stale entry for this id survives the write
+        invalidate_user(user_id)
 
         # get the user data from db response
         user_data = row2dict(res)
@@ -183,13 +184,13 @@ async def register(register_data: RegisterRequest, db: Session = Depends(get_db)
         return response
     
     except Exception as e:
-        db.rollback()
-        logger.error(f"Error creating user: {str(e)}")
+        await db.rollback()
+        logger.error("Error creating user: %s", e)
         raise HTTPException(status_code=500, detail="Error creating user")
 
 
 @router.post("/logout")
-async def logout(db: Session = Depends(get_db)):
+async def logout(db: AsyncSession = Depends(get_async_db)):
     response = JSONResponse(content={"message": "Logout successful"})
 
     # Clear the refresh token cookie
@@ -205,22 +206,20 @@ async def logout(db: Session = Depends(get_db)):
 
 
 @router.get("/me")
-@token_auth()
-async def read_me(request: Request, db: Session = Depends(get_db)):
-    logger.debug(f"/me start")
-    user = get_current_user(request, db)
-    logger.debug(f"/me user: {user}")
+async def read_me(user: User = Depends(get_current_user)):
+    logger.debug("/me user: %s", user)
     return user
 
 
 @router.post("/refresh")
 async def refresh_token(
-    refresh_token: str | None = Cookie(None, alias="refresh_token")
+    refresh_token: str | None = Cookie(None, alias="refresh_token"),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if not refresh_token:
         raise HTTPException(401, "Refresh token missing")
 
-    new_access_token = await refresh_access_token(refresh_token)
+    new_access_token, _ = await refresh_access_token(refresh_token, db)
     return {"access_token": new_access_token}
 
 # @router.get("/debug/get_cookies")
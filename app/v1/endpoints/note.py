@@ -1,30 +1,35 @@
 import token
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, Cookie, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from sqlalchemy import event, text
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, Cookie, WebSocketDisconnect, Query
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import event
+from app.core.queries import sql
 from typing import List
 import json
-from app.core.database import get_db
-from app.core.helper import row2dict, rows2dict
+from app.core.database import get_async_db, get_async_read_db, read_session_factory, AsyncSessionLocal
+from app.core.helper import row2dict, rows2dict, rows2json, json_response, encode_cursor, decode_cursor, escape_like, parse_etags
 from app.schemas.notes import (
     NoteCreate,
     NoteEdit,
     NoteDelete,
+    NotePatch,
     Note
 )
-from app.core.websocket_super_simple import WebSocketManager
-from app.core.auth import token_auth, token_auth_ws, token_auth_ws_v2
+from app.core.websocket import websocket_manager, ConnectionLimitExceeded
+from app.core.collab import collab_service
+from app.core.ws_codec import JSON_CODEC, CodecError, receive_frame, send_message
+from app.core.auth import token_auth_ws, token_auth_ws_v2, close_websocket
+from app.core.json_patch import apply_patch, JsonPatchError
 from app.config.logger import logger
 from fastapi import Request
 import uuid
 from datetime import datetime
 from app.core.auth import get_current_user
+from app.schemas.user import User
 from app.config.constants import NOTE_FORMAT_MARKDOWN, NOTE_FORMAT_TEXT, NOTE_FORMAT_HTML, NOTE_FORMAT_PDF, NOTE_FORMAT_IMAGE, NOTE_FORMAT_AUDIO
 
 router = APIRouter(prefix="/note", tags=["notes"])
 
-ws_manager = WebSocketManager()
-
 @router.get("/file_formats")
 def get_file_formats():
     return [NOTE_FORMAT_MARKDOWN, NOTE_FORMAT_TEXT, NOTE_FORMAT_HTML, NOTE_FORMAT_PDF, NOTE_FORMAT_IMAGE, NOTE_FORMAT_AUDIO]
@@ -35,87 +40,327 @@ def get_file_formats():
 
 @router.websocket("/ws/{note_id}")
 @token_auth_ws_v2()
-async def note_websocket(websocket: WebSocket, note_id: str, user_id: str = '', db: Session = Depends(get_db)):
-    """WebSocket endpoint for note collaboration with authentication"""
-    logger.info(f"--------------------------------------: WEBSOCKET ENDPOINT")
-    logger.info(f"WebSocket connection established for note_id: {note_id}, user_id: {user_id}")
+async def note_websocket(websocket: WebSocket, note_id: int, user_id: str = '', rev: int | None = None):
+    """
+    WebSocket endpoint for note collaboration. "op" messages edit the note's text (see app/core/collab.py),
+    "pong" answers the server's {"type": "ping"} heartbeats (any message keeps the connection alive),
+    any other message is broadcast to the note's room in all workers (presence, cursors...).
+    A reconnecting editor passes the last revision it has as ?rev= to only get the ops it missed.
+    Messages are JSON text frames, or MessagePack binary frames if the client negotiated it (see app/core/ws_codec.py).
+    """
+    logger.info("WebSocket connection established for note_id: %s, user_id: %s", note_id, user_id)
+    codec = websocket.state.codec
+
+    # short lived session, a Depends(get_async_db) one would hold a pooled connection for the socket's lifetime
+    async with AsyncSessionLocal() as session:
+        res = (await session.execute(
+            sql("note.check_owner", "SELECT id FROM note WHERE id = :id AND user_id = :user_id"),
+            {"id": note_id, "user_id": uuid.UUID(user_id)},
+        )).one_or_none()
+
+    if res is None:
+        await send_message(websocket, codec, {"type": "error", "message": "Note not found"})
+        await close_websocket(websocket, code=1008)
+        return
 
+    room_id = f"note:{note_id}"
     try:
+        connection_id = await websocket_manager.connect(websocket, user_id, room_id, codec)
+    except ConnectionLimitExceeded as e:
+        await send_message(websocket, codec, {"type": "error", "message": str(e)})
+        await close_websocket(websocket, code=e.close_code)
+        return
+    websocket_manager.send(room_id, connection_id, {"type": "joined", "note_id": note_id, "connection_id": connection_id})
+
+    try:
+        document = await collab_service.open(note_id)
+        collab_service.join(document, connection_id, rev)
+
         while True:
-            data = await websocket.receive_text()
-            logger.info(f"Received data from user {user_id}: {data}")
-            
-            # Send response as JSON instead of plain text for better client handling
-            await websocket.send_json({
+            data = await receive_frame(websocket)
+            logger.debug("Received data from user %s: %r", user_id, data)
+            websocket_manager.touch(connection_id)
+
+            try:
+                message = codec.decode(data)
+            except CodecError:
+                message = None
+            if isinstance(message, dict) and message.get("type") == "op":
+                await collab_service.submit(document, connection_id, message)
+                continue
+            if isinstance(message, dict) and message.get("type") == "pong":
+                # answer to the heartbeat ping, touching the connection was all it's for
+                continue
+
+            if codec is JSON_CODEC:
+                # relayed as sent, like before the encodings were negotiable
+                content = data.decode("utf-8", "replace") if isinstance(data, bytes) else data
+            else:
+                content = message
+
+            await websocket_manager.broadcast_to_room(room_id, {
                 "type": "message",
-                "content": data,
+                "content": content,
                 "note_id": note_id,
+                "user_id": user_id,
                 "timestamp": datetime.now().isoformat()
-            })
+            }, exclude_connection=connection_id)
     except WebSocketDisconnect:
-        logger.info(f"Client {user_id} disconnected")
-        await ws_manager.disconnect(user_id, websocket)
+        logger.info("Client %s disconnected", user_id)
     except Exception as e:
-        logger.error(f"Error in WebSocket communication: {e}")
-        try:
-            await ws_manager.disconnect(user_id, websocket)
-        except:
-            pass
+        logger.error("Error in WebSocket communication: %s", e)
+        await close_websocket(websocket)
+    finally:
+        await websocket_manager.disconnect(room_id, connection_id)
+        await collab_service.leave(note_id, connection_id)
 
 # ------------------------------------------------------------------------------------------------
 # Note endpoints
 # ------------------------------------------------------------------------------------------------
 
-# get all notes for a user
-@router.get("/{user_id}")
-@token_auth()
-def get_user_notes(request: Request, user_id: str, db: Session = Depends(get_db)):
+# max results per kind (folders, notes) of a typeahead lookup
+TYPEAHEAD_LIMIT_MAX = 25
 
-    # get current user
-    user = get_current_user(request, db)
+# Substring match through the (user_id, name gin_trgm_ops) GIN indexes, names starting with the input first,
+# then the closest ones by trigram similarity
+FOLDER_TYPEAHEAD_QUERY = """
+    SELECT id, name, parent_id
+    FROM note_folder
+    WHERE user_id = :user_id AND name ILIKE :pattern
+    ORDER BY name ILIKE :prefix DESC, similarity(name, :q) DESC, name, id
+    LIMIT :limit
+"""
 
-    # validate is user's match and user exists
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
+NOTE_TYPEAHEAD_QUERY = """
+    SELECT id, name, folder_id, format
+    FROM note
+    WHERE user_id = :user_id AND name ILIKE :pattern
+    ORDER BY name ILIKE :prefix DESC, similarity(name, :q) DESC, name, id
+    LIMIT :limit
+"""
+
+
+# folders and notes of the user whose name contains q, for search-as-you-type
+@router.get("/typeahead")
+async def typeahead(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=TYPEAHEAD_LIMIT_MAX),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+
+    escaped = escape_like(q)
+    params = {
+        "user_id": uuid.UUID(user.id),
+        "q": q,
+        "pattern": f"%{escaped}%",
+        "prefix": f"{escaped}%",
+        "limit": limit,
+    }
+    folders = (await db.execute(sql("note.typeahead_folders", FOLDER_TYPEAHEAD_QUERY), params)).all()
+    notes = (await db.execute(sql("note.typeahead_notes", NOTE_TYPEAHEAD_QUERY), params)).all()
+
+    return json_response({"folders": folders, "notes": notes})
+
+
+# max results of a note search
+NOTE_SEARCH_LIMIT_MAX = 100
+
+# Ranks matches through the GIN index on search_vector, then builds snippets for the returned page only
+# (ts_headline re-parses the document). The body is HTML escaped first so the only markup in a snippet is <mark>.
+NOTE_SEARCH_QUERY = """
+    SELECT ranked.id, ranked.name, ranked.folder_id, ranked.format, ranked.updated_at, ranked.rank,
+           ts_headline(
+               'english',
+               replace(replace(replace(coalesce(ranked.body, ''), '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+               ranked.query,
+               'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MinWords=5, MaxWords=20'
+           ) AS snippet
+    FROM (
+        SELECT note.id, note.name, note.folder_id, note.format, note.updated_at, note.content->>'content' AS body,
+               query, ts_rank_cd(note.search_vector, query) AS rank
+        FROM note, websearch_to_tsquery('english', :q) AS query
+        WHERE note.user_id = :user_id AND note.search_vector @@ query
+        ORDER BY rank DESC, note.id DESC
+        LIMIT :limit
+    ) ranked
+    ORDER BY ranked.rank DESC, ranked.id DESC
+"""
+
+
+# full text search over the user's note titles and bodies
+@router.get("/search")
+async def search_notes(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=NOTE_SEARCH_LIMIT_MAX),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+
+    res = (await db.execute(sql("note.search", NOTE_SEARCH_QUERY), {"q": q, "user_id": uuid.UUID(user.id), "limit": limit})).all()
+
+    return json_response(res)
+
+
+# notes per page of get_user_notes
+NOTE_PAGE_SIZE_DEFAULT = 50
+NOTE_PAGE_SIZE_MAX = 500
+# rows fetched from the server side cursor (and written to the response) at a time
+NOTE_STREAM_BATCH_SIZE = 100
+
+
+async def stream_note_page(query: str, params: dict, limit: int, session_factory: async_sessionmaker):
+    """
+    Write one page of notes as JSON while the rows come off a server side cursor:
+    {"notes": [...], "next_cursor": "..." | null}
+
+    Runs after the endpoint returned, so it opens its own session from session_factory (the request's
+    read_session_factory). One row past `limit` is fetched only to know whether there is a next page.
+    """
+    async with session_factory() as session:
+        result = await session.stream(sql("note.page", query), params)
+
+        yield b'{"notes":['
+        written = 0
+        last_row = None
+        has_more = False
+
+        async for rows in result.partitions(NOTE_STREAM_BATCH_SIZE):
+            if written + len(rows) > limit:
+                rows = rows[:limit - written]
+                has_more = True
+
+            if rows:
+                # the batch as a JSON array, without its brackets
+                chunk = rows2json(rows)[1:-1]
+                yield (b"," if written else b"") + chunk
+                written += len(rows)
+                last_row = rows[-1]
+
+            if has_more:
+                break
+
+        next_cursor = encode_cursor(last_row.updated_at, last_row.id) if has_more else None
+        yield b'],"next_cursor":' + rows2json(next_cursor) + b"}"
+
+
+# get a page of notes for a user, most recently updated first
+@router.get("/{user_id}")
+async def get_user_notes(
+    request: Request,
+    user_id: str,
+    cursor: str | None = None,
+    limit: int = Query(NOTE_PAGE_SIZE_DEFAULT, ge=1, le=NOTE_PAGE_SIZE_MAX),
+    folder_id: int | None = None,
+    note_format: str | None = Query(None, alias="format"),
+    user: User = Depends(get_current_user),
+):
+
+    # validate is user's match
     if user.id != user_id:
         raise HTTPException(status_code=401, detail="Wrong user")
     
-    # get all note data with the user's id
-    query = """
-        SELECT id, user_id, name, folder_id, format FROM note
-        WHERE (user_id = :user_id)
+    # keyset pagination on (updated_at, id), every filter combination has a matching composite index
+    conditions = ["user_id = :user_id"]
+    params = {"user_id": uuid.UUID(user.id), "limit": limit + 1}
+
+    if folder_id is not None:
+        conditions.append("folder_id = :folder_id")
+        params["folder_id"] = folder_id
+
+    if note_format is not None:
+        conditions.append("format = :format")
+        params["format"] = note_format
+
+    if cursor is not None:
+        try:
+            cursor_updated_at, cursor_id = decode_cursor(cursor)
+            params["cursor_updated_at"] = datetime.fromisoformat(cursor_updated_at)
+            params["cursor_id"] = int(cursor_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        conditions.append("(updated_at, id) < (:cursor_updated_at, :cursor_id)")
+
+    query = f"""
+        SELECT id, user_id, name, folder_id, format, updated_at FROM note
+        WHERE {" AND ".join(conditions)}
+        ORDER BY updated_at DESC, id DESC
+        LIMIT :limit
     """
 
-    res = db.execute(text(query), {'user_id': uuid.UUID(user.id)}).all()
-    
-    notes= [Note.model_validate(note) for note in res]
-    logger.info(f"notes: {notes}")
+    logger.debug("notes page for user %s: cursor=%s limit=%s folder_id=%s format=%s", user.id, cursor, limit, folder_id, note_format)
+
+    return StreamingResponse(stream_note_page(query, params, limit, read_session_factory(request)), media_type="application/json")
+
+def note_etag(note_id: int, version: int) -> str:
+    """Strong ETag of a note's content, changes whenever its version is incremented"""
+    return f'"{note_id}-{version}"'
+
+
+def etag_versions(etags: list[str], note_id: int) -> list[int]:
+    """Versions of this note named by the client's ETags, ETags of other notes or garbage are ignored"""
+    versions = []
+    prefix = f'"{note_id}-'
+    for etag in etags:
+        if etag.startswith(prefix) and etag.endswith('"'):
+            try:
+                versions.append(int(etag[len(prefix):-1]))
+            except ValueError:
+                pass
+    return versions
 
-    return notes
 
-# get the contents of a note
+# The content is only read (and detoasted) when the client doesn't already have this version
+# (or any version, If-None-Match: *), and comes back as JSON text so it is written to the response
+# without a decode/encode round trip
+NOTE_CONTENT_QUERY = """
+    SELECT version,
+           CASE WHEN :any_version OR version = ANY(:known_versions) THEN NULL ELSE coalesce(content::text, 'null') END AS content
+    FROM note
+    WHERE id = :id AND user_id = :user_id
+"""
+
+
+# get the contents of a note, answers 304 if the client's If-None-Match already names this version
+# (read from the primary: live edits are written back by the collab service, the replica may not have them yet)
 @router.get("/{user_id}/{note_id}")
-def get_note_contents(user_id: str, note_id: int, db: Session = Depends(get_db)):
-    return
+async def get_note_contents(request: Request, user_id: str, note_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+
+    if user.id != user_id:
+        raise HTTPException(status_code=401, detail="Wrong user")
+
+    etags = parse_etags(request.headers.get("If-None-Match"))
+    res = (await db.execute(sql("note.content", NOTE_CONTENT_QUERY), {
+        "id": note_id,
+        "user_id": uuid.UUID(user.id),
+        "known_versions": etag_versions(etags, note_id),
+        "any_version": "*" in etags,
+    })).one_or_none()
+
+    if res is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    # private: the body is per user, no-cache: always revalidate with If-None-Match
+    headers = {"ETag": note_etag(note_id, res.version), "Cache-Control": "private, no-cache"}
+
+    if res.content is None:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=res.content, media_type="application/json", headers=headers)
 
 # create a note
 @router.post("/")
-@token_auth()
-async def create_note(request: Request, note: NoteCreate, db: Session = Depends(get_db)):
-
-    user = get_current_user(request, db)
+async def create_note(request: Request, note: NoteCreate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
 
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
     user_id = user.id
 
     # check if folder exists and user can access it
     query = """
         SELECT * FROM note_folder WHERE id = :id AND user_id = :user_id
     """
-    res = db.execute(text(query), {"id": note.folder_id, "user_id": uuid.UUID(user_id)}).one()
+    res = (await db.execute(sql("note.check_folder", query), {"id": note.folder_id, "user_id": uuid.UUID(user_id)})).first()
     
     if res is None:
         raise HTTPException(status_code=404, detail="Folder not found")
@@ -138,22 +383,61 @@ async def create_note(request: Request, note: NoteCreate, db: Session = Depends(
     query = """
         INSERT INTO note (user_id, name, folder_id, content, format)
         VALUES (:user_id, :name, :folder_id, :content, :format)
-        RETURNING *
+        RETURNING id, user_id, name, folder_id, content, format, version, created_at, updated_at
     """
 
-    res = db.execute(text(query), {"user_id": user_id, "name": note.title, "folder_id": note.folder_id, "content": json.dumps(structured_content), "format": note.format}).one()
+    res = (await db.execute(sql("note.insert", query), {"user_id": user_id, "name": note.title, "folder_id": note.folder_id, "content": json.dumps(structured_content), "format": note.format})).one()
 
     # insert note into database
-    return row2dict(res)
+    return json_response(res)
 
 
-@router.put("/", response_model=NoteEdit)
-def update_note(note: NoteEdit, db: Session = Depends(get_db)):
-    return
+# Only written if nobody saved since the client's version, 0 rows means a concurrent edit (or no such note)
+NOTE_PATCH_UPDATE_QUERY = """
+    UPDATE note SET content = CAST(:content AS jsonb), version = version + 1, updated_at = now()
+    WHERE id = :id AND user_id = :user_id AND version = :version
+    RETURNING id, version, updated_at
+"""
+
+
+# update a note's content with a JSON patch made against `version`, answers 409 if the note changed since
+@router.patch("/{user_id}/{note_id}")
+async def update_note(request: Request, user_id: str, note_id: int, patch: NotePatch, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+
+    if user.id != user_id:
+        raise HTTPException(status_code=401, detail="Wrong user")
+
+    params = {"id": note_id, "user_id": uuid.UUID(user.id)}
+    res = (await db.execute(sql("note.get_for_patch", "SELECT version, content FROM note WHERE id = :id AND user_id = :user_id"), params)).one_or_none()
+
+    if res is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    if res.version != patch.version:
+        raise HTTPException(status_code=409, detail="Note was modified, reload it")
+
+    try:
+        content = apply_patch(res.content, [op.model_dump(by_alias=True, exclude_unset=True) for op in patch.operations])
+    except JsonPatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    res = (await db.execute(sql("note.patch", NOTE_PATCH_UPDATE_QUERY), {**params, "version": patch.version, "content": json.dumps(content)})).one_or_none()
+
+    if res is None:
+        raise HTTPException(status_code=409, detail="Note was modified, reload it")
+
+    # live editors reload the note rather than their replica overwriting the patch
+    await db.commit()
+    await collab_service.note_changed(note_id)
+
+    return JSONResponse(
+        content={"id": res.id, "version": res.version, "updated_at": res.updated_at.isoformat()},
+        headers={"ETag": note_etag(res.id, res.version)},
+    )
 
 
 @router.delete("/")
-def delete_note(note: NoteDelete, db: Session = Depends(get_db)):
+async def delete_note(note: NoteDelete, db: AsyncSession = Depends(get_async_db)):
     return
 
 
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import event, text
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import event
+from app.core.queries import sql
 from typing import List
 
-from app.core.database import get_db
+from app.core.database import get_async_db, get_async_read_db
 from app.schemas.notes import (
     NoteCreate,
     NoteEdit,
@@ -14,9 +15,8 @@ from app.schemas.notes import (
 )
 from app.schemas.notes import Note, NoteFolder
 from app.schemas.user import User
-from app.core.auth import token_auth
 from app.config.logger import logger
-from app.core.helper import row2dict, rows2dict
+from app.core.helper import row2dict, rows2dict, json_response
 from fastapi import Request
 import uuid
 from datetime import datetime
@@ -24,27 +24,40 @@ from app.core.auth import get_current_user
 
 router = APIRouter(prefix="/note_folder", tags=["note_folders"])
 
+# Every folder stores its materialized path: the ids from the top level folder down to itself,
+# e.g. "1/5/9/". A folder's subtree is every path that starts with its own path, which is a
+# single range scan on ix_note_folder_path (the column uses the "C" collation so byte order applies).
+# The id comes from the sequence up front so the path can be written in the same INSERT.
+INSERT_FOLDER_QUERY = """
+    WITH new_folder AS (
+        SELECT nextval(pg_get_serial_sequence('note_folder', 'id')) AS id
+    )
+    INSERT INTO note_folder (id, user_id, name, parent_id, is_root, path)
+    SELECT new_folder.id, :user_id, :name, :parent_id, :is_root,
+           COALESCE((SELECT path FROM note_folder WHERE id = :parent_id), '') || new_folder.id || '/'
+    FROM new_folder
+    RETURNING id, user_id, name, parent_id, is_root, path;
+"""
+
+
+def subtree_range(path: str) -> dict:
+    """Bounds of every path under (and including) `path`: '/' + 1 is '0', so the upper bound ends the prefix"""
+    return {"path_lower": path, "path_upper": path[:-1] + "0"}
+
 
 # Create a default Root folder
-def create_default_folder(db, username, user_id) -> NoteFolder:
-    logger.debug(
-        f"create root folder for user: {username} with id: {user_id}"
-    )
+async def create_default_folder(db, username, user_id) -> NoteFolder:
+    logger.debug("create root folder for user: %s with id: %s", username, user_id)
 
-    query = """
-        INSERT INTO note_folder (user_id, name, parent_id, is_root) 
-        VALUES (:user_id ,:name, :parent_id, :is_root)
-        RETURNING id, user_id, name, parent_id, is_root;
-    """
-    res = db.execute(
-        text(query),
+    res = (await db.execute(
+        sql("note_folder.insert", INSERT_FOLDER_QUERY),
         {
             "user_id": user_id,
             "name": 'ROOT',
             "parent_id": None,
             "is_root": True,
         },
-    ).one()
+    )).one()
 
     new_folder = row2dict(res)
 
@@ -52,43 +65,135 @@ def create_default_folder(db, username, user_id) -> NoteFolder:
 
 
 @router.get("/")
-@token_auth()
-async def get_user_folders(request: Request, db: Session = Depends(get_db)):
-
-    user = get_current_user(request, db)
+async def get_user_folders(request: Request, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
 
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
     user_id = user.id
     
 
     query = """
         SELECT * FROM note_folder WHERE user_id = :user_id
     """
-    res = db.execute(text(query), {"user_id": user_id}).all()
+    res = (await db.execute(sql("note_folder.list", query), {"user_id": user_id})).all()
 
     #logger.debug(f"get user folders res: {res}")
 
-    validated_folders = [NoteFolder.model_validate(folder) for folder in res]
-    #logger.debug(f"get user folders validated_folders: {validated_folders}")
+    return json_response(res)
+
+
+# Whole folder tree (or the subtree under root_id) in one round trip.
+# The path array stops the recursion if a parent_id cycle ever sneaks into the table.
+FOLDER_TREE_QUERY = """
+    WITH RECURSIVE tree AS (
+        SELECT id, name, parent_id, is_root, 0 AS depth, ARRAY[id] AS path
+        FROM note_folder
+        WHERE user_id = :user_id
+          AND (id = CAST(:root_id AS INTEGER) OR (CAST(:root_id AS INTEGER) IS NULL AND parent_id IS NULL))
+        UNION ALL
+        SELECT f.id, f.name, f.parent_id, f.is_root, t.depth + 1, t.path || f.id
+        FROM note_folder f
+        JOIN tree t ON f.parent_id = t.id
+        WHERE f.user_id = :user_id
+          AND NOT f.id = ANY(t.path)
+          AND (CAST(:max_depth AS INTEGER) IS NULL OR t.depth < CAST(:max_depth AS INTEGER))
+    )
+    SELECT tree.id, tree.name, tree.parent_id, tree.is_root, tree.depth{note_count_column}
+    FROM tree{note_count_join}
+    ORDER BY tree.depth, tree.name
+"""
+
+NOTE_COUNT_COLUMN = ", COALESCE(note_counts.note_count, 0) AS note_count"
+NOTE_COUNT_JOIN = """
+    LEFT JOIN (
+        SELECT folder_id, COUNT(*) AS note_count FROM note WHERE user_id = :user_id GROUP BY folder_id
+    ) note_counts ON note_counts.folder_id = tree.id"""
+
+
+def build_folder_tree(rows) -> list[dict]:
+    """Nest flat (depth ordered) folder rows under their parents, returns the top level folders"""
+    nodes = {}
+    roots = []
+    for row in rows:
+        node = row._asdict()
+        node["children"] = []
+        nodes[node["id"]] = node
+
+        parent = nodes.get(node["parent_id"])
+        # depth 0 rows are the requested roots even when they have a parent
+        if node["depth"] == 0 or parent is None:
+            roots.append(node)
+        else:
+            parent["children"].append(node)
+    return roots
+
+
+@router.get("/tree")
+async def get_user_folder_tree(
+    request: Request,
+    root_id: int | None = None,
+    depth: int | None = Query(None, ge=0),
+    include_note_counts: bool = False,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+
+    query = FOLDER_TREE_QUERY.format(
+        note_count_column=NOTE_COUNT_COLUMN if include_note_counts else "",
+        note_count_join=NOTE_COUNT_JOIN if include_note_counts else "",
+    )
+    res = (await db.execute(sql("note_folder.tree", query), {"user_id": uuid.UUID(user.id), "root_id": root_id, "max_depth": depth})).all()
 
+    if root_id is not None and not res:
+        raise HTTPException(status_code=404, detail="Folder not found")
 
-    #logger.debug(f"get user folders res DICT: {rows2dict(res)}")
+    return json_response(build_folder_tree(res))
 
-    return rows2dict(res)
+
+@router.get("/{folder_id}/breadcrumbs")
+async def get_folder_breadcrumbs(request: Request, folder_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
+
+    # the folder's path holds its ancestor ids, so this is a primary key lookup per ancestor
+    query = """
+        SELECT ancestor.id, ancestor.name, ancestor.parent_id, ancestor.is_root
+        FROM note_folder folder
+        JOIN note_folder ancestor ON ancestor.id = ANY(string_to_array(rtrim(folder.path, '/'), '/')::int[])
+        WHERE folder.id = :id AND folder.user_id = :user_id AND ancestor.user_id = :user_id
+        ORDER BY length(ancestor.path)
+    """
+    res = (await db.execute(sql("note_folder.breadcrumbs", query), {"id": folder_id, "user_id": uuid.UUID(user.id)})).all()
+
+    if not res:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    return json_response(res)
+
+
+@router.get("/{folder_id}/notes")
+async def get_folder_subtree_notes(request: Request, folder_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
+
+    query = """
+        SELECT path FROM note_folder WHERE id = :id AND user_id = :user_id
+    """
+    folder = (await db.execute(sql("note_folder.path", query), {"id": folder_id, "user_id": uuid.UUID(user.id)})).first()
+
+    if folder is None:
+        raise HTTPException(status_code=404, detail="Folder not found")
+
+    # all notes in the folder and every folder below it, in the shape of the Note schema (without the content)
+    query = """
+        SELECT note.id, note.user_id, note.name, NULL AS content, note.folder_id
+        FROM note_folder folder
+        JOIN note ON note.folder_id = folder.id
+        WHERE folder.user_id = :user_id AND folder.path >= :path_lower AND folder.path < :path_upper
+    """
+    res = (await db.execute(sql("note_folder.subtree_notes", query), {"user_id": uuid.UUID(user.id), **subtree_range(folder.path)})).all()
+
+    return json_response(res)
 
 
 # Note Folder endpoints
 @router.post("/")
-@token_auth()
-async def create_note_folder(request: Request, folder: NoteFolderCreate, db: Session = Depends(get_db)):
-
-    user = get_current_user(request, db)
+async def create_note_folder(request: Request, folder: NoteFolderCreate, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
 
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
     user_id = user.id
 
     #check if authenticated user id matches user id of the folder to be created
@@ -100,34 +205,22 @@ async def create_note_folder(request: Request, folder: NoteFolderCreate, db: Ses
         query = """
             SELECT * FROM note_folder WHERE id = :parent_id AND user_id = :user_id
         """
-        res = db.execute(text(query), {"parent_id": folder.parent_id, "user_id": user_id}).one()
+        res = (await db.execute(sql("note_folder.get_parent", query), {"parent_id": folder.parent_id, "user_id": user_id})).first()
         
         if res is None:
             raise HTTPException(status_code=404, detail="Parent folder not found")
 
     # create new folder
-    query = """
-        INSERT INTO note_folder (user_id, name, parent_id, is_root) 
-        VALUES (:user_id, :name, :parent_id, :is_root)
-        RETURNING id, user_id, name, parent_id, is_root;
-    """
-    
-    res = db.execute(text(query), {"user_id": user_id, "name": folder.name, "parent_id": folder.parent_id, "is_root": False}).one()
+    res = (await db.execute(sql("note_folder.insert", INSERT_FOLDER_QUERY), {"user_id": user_id, "name": folder.name, "parent_id": folder.parent_id, "is_root": False})).one()
 
 
     new_folder = row2dict(res)
 
     return NoteFolder(id=new_folder["id"], user_id=new_folder["user_id"], name=new_folder["name"], parent_id=new_folder["parent_id"], is_root=new_folder["is_root"])
     
-@router.put("/{folder_id}", response_model=NoteFolderEdit)
-@token_auth()
-async def update_note_folder(request: Request, folder: NoteFolderEdit, db: Session = Depends(get_db)):
+@router.put("/{folder_id}")
+async def update_note_folder(request: Request, folder: NoteFolderEdit, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
 
-    user = get_current_user(request, db)
-
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
     user_id = user.id
 
     # check if user_id matches the user_id for the folder to be updated
@@ -139,9 +232,9 @@ async def update_note_folder(request: Request, folder: NoteFolderEdit, db: Sessi
         query = """
             SELECT * FROM note_folder WHERE id = :id  AND user_id = :user_id
         """
-        res = db.execute(text(query), {"id": folder.id, "user_id": uuid.UUID(user_id)}).one()
+        current = (await db.execute(sql("note_folder.get", query), {"id": folder.id, "user_id": uuid.UUID(user_id)})).first()
         
-        if res is None:
+        if current is None:
             raise HTTPException(status_code=404, detail="Folder not found")
         
     # check if parent_id is valid (root folder can not be edited)
@@ -149,30 +242,41 @@ async def update_note_folder(request: Request, folder: NoteFolderEdit, db: Sessi
         query = """
             SELECT * FROM note_folder WHERE id = :parent_id AND user_id = :user_id
         """
-        res = db.execute(text(query), {"parent_id": folder.parent_id, "user_id": uuid.UUID(user_id)}).one()
+        parent = (await db.execute(sql("note_folder.get_parent", query), {"parent_id": folder.parent_id, "user_id": uuid.UUID(user_id)})).first()
         
-        if res is None:
+        if parent is None:
             raise HTTPException(status_code=404, detail="Parent folder not found")  
 
+        # a folder can't become its own descendant
+        if parent.path.startswith(current.path):
+            raise HTTPException(status_code=400, detail="Folder can not be moved into itself")
+
     # update folder
     query = """
         UPDATE note_folder SET name = :name, parent_id = :parent_id WHERE id = :id AND user_id = :user_id
     """
-    res = db.execute(text(query), {"id": folder.id, "user_id": uuid.UUID(user_id), "name": folder.name, "parent_id": folder.parent_id})
+    res = await db.execute(sql("note_folder.update", query), {"id": folder.id, "user_id": uuid.UUID(user_id), "name": folder.name, "parent_id": folder.parent_id})
+
+    # moved: rewrite the path prefix of the whole subtree in one statement
+    if folder.parent_id != current.parent_id:
+        query = """
+            UPDATE note_folder SET path = :new_path || substr(path, :old_path_length + 1)
+            WHERE user_id = :user_id AND path >= :path_lower AND path < :path_upper
+        """
+        await db.execute(sql("note_folder.move_subtree", query), {
+            "user_id": uuid.UUID(user_id),
+            "new_path": f"{parent.path}{folder.id}/",
+            "old_path_length": len(current.path),
+            **subtree_range(current.path),
+        })
 
     return {"message": "Folder updated successfully"}
  
 
 @router.delete("/{folder_id}")
-@token_auth()
-async def delete_note_folder(request: Request, folder_id: int, db: Session = Depends(get_db)):
+async def delete_note_folder(request: Request, folder_id: int, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
 
     # check if user_id of folder matches the current user's user_id
-    user = get_current_user(request, db)
-
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
     user_id = user.id
     
     # check if folder exists
@@ -180,16 +284,24 @@ async def delete_note_folder(request: Request, folder_id: int, db: Session = Dep
         query = """
             SELECT * FROM note_folder WHERE id = :id AND user_id = :user_id
         """
-        res = db.execute(text(query), {"id": folder_id, "user_id": uuid.UUID(user_id)}).one()   
+        res = (await db.execute(sql("note_folder.get", query), {"id": folder_id, "user_id": uuid.UUID(user_id)})).first()   
         
         if res is None:
             raise HTTPException(status_code=404, detail="Folder not found")
         
-    # delete folder
+    # delete the folder with all its subfolders and their notes
+    params = {"user_id": uuid.UUID(user_id), **subtree_range(res.path)}
+    query = """
+        DELETE FROM note WHERE folder_id IN (
+            SELECT id FROM note_folder WHERE user_id = :user_id AND path >= :path_lower AND path < :path_upper
+        )
+    """
+    await db.execute(sql("note_folder.delete_subtree_notes", query), params)
+
     query = """
-        DELETE FROM note_folder WHERE id = :id AND user_id = :user_id
+        DELETE FROM note_folder WHERE user_id = :user_id AND path >= :path_lower AND path < :path_upper
     """
-    db.execute(text(query), {"id": folder_id, "user_id": uuid.UUID(user_id)})
+    await db.execute(sql("note_folder.delete_subtree", query), params)
 
     return {"message": "Folder deleted successfully"}
 
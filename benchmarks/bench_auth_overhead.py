@@ -0,0 +1,124 @@
+"""
+Per-request cost of authenticating an endpoint, in process (no server, no network, no queries).
+
+Two one-route apps answer GET /me for a valid access token whose user is in the user cache,
+both routes take the request's session like the real endpoints (it never connects):
+  - decorator    the former @token_auth() wrapper (signature and coroutine checks on every call)
+                 followed by the endpoint's own get_current_user lookup
+  - dependency   user: User = Depends(get_current_user)
+plus a route with the session and without any auth as the floor. Requests go straight into the ASGI app.
+Needs the app settings (.env) for the imports, the database isn't touched.
+
+    python -m benchmarks.bench_auth_overhead --rounds 10
+"""
+import argparse
+import asyncio
+import inspect
+import time
+import uuid
+from functools import wraps
+
+from fastapi import Depends, FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.auth import create_access_token, create_refresh_token, fetch_user, get_current_user, user_cache, verify_tokens
+from app.core.database import get_async_db
+from app.schemas.user import User
+
+
+def token_auth():
+    """The decorator get_current_user replaced, minus the body-rewriting refresh branch"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(request: Request, *args, **kwargs):
+            auth_header = request.headers.get("Authorization")
+            access_token = auth_header.split(" ")[1] if auth_header and auth_header.startswith("Bearer ") else None
+            _, user_id = await verify_tokens(access_token, request.cookies.get("refresh_token"), None)
+            if "request" in func.__code__.co_varnames:
+                kwargs["request"] = request
+            request.state.user = {"id": user_id}
+            if inspect.iscoroutinefunction(func):
+                return await func(*args, **kwargs)
+            return await run_in_threadpool(func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def build_apps() -> dict[str, FastAPI]:
+    decorated = FastAPI()
+
+    @decorated.get("/me")
+    @token_auth()
+    async def me_decorated(request: Request, db: AsyncSession = Depends(get_async_db)):
+        # what every endpoint did next: look the user up again
+        return await fetch_user(db, request.state.user["id"])
+
+    dependency = FastAPI()
+
+    @dependency.get("/me")
+    async def me_dependency(user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+        return user
+
+    anonymous = FastAPI()
+
+    @anonymous.get("/me")
+    async def me_anonymous(db: AsyncSession = Depends(get_async_db)):
+        return {"id": "anonymous"}
+
+    return {"no auth": anonymous, "decorator": decorated, "dependency": dependency}
+
+
+async def call(app: FastAPI, headers: list) -> int:
+    """One GET /me straight through the ASGI interface, returns the status code"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/me", "raw_path": b"/me", "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80), "state": {},
+    }
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run(requests: int, rounds: int):
+    user_id = str(uuid.uuid4())
+    user_cache.set(user_id, User(id=user_id, username="bench", email="bench@example.com", is_active=True))
+    headers = [
+        (b"authorization", f"Bearer {create_access_token(data={'sub': user_id})}".encode()),
+        (b"cookie", f"refresh_token={create_refresh_token(data={'sub': user_id})}".encode()),
+    ]
+
+    apps = build_apps()
+    for app in apps.values():
+        for _ in range(500):  # warm up
+            assert await call(app, headers) == 200
+
+    # the apps take turns, the best round of each is reported (the machine's noise only adds time)
+    best = {name: float("inf") for name in apps}
+    for _ in range(rounds):
+        for name, app in apps.items():
+            start = time.perf_counter()
+            for _ in range(requests):
+                await call(app, headers)
+            best[name] = min(best[name], (time.perf_counter() - start) / requests)
+
+    for name, seconds in best.items():
+        print(f"{name:<11} {seconds * 1e6:8.1f} us/request   {(seconds - best['no auth']) * 1e6:6.1f} us for the auth")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per round")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.rounds))
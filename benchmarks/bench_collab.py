@@ -0,0 +1,155 @@
+"""
+Collaborative editing of one note by several editors.
+
+Opens `--editors` websockets to the same note, each types `--keystrokes` single character inserts
+at a random position of its copy, `--interval` seconds apart, without waiting for the previous
+ones to be applied (unacknowledged ops are rebased by the editor as a real client does).
+Reports the submit-to-ack latency, checks that every editor ends with the same text as the
+server, and compares the ops applied with the note writes (the note's version).
+
+Run the server with several workers so the editors land on different processes:
+
+    uvicorn app.main:app --port 8000 --workers 4
+    python -m benchmarks.bench_collab --url http://localhost:8000 --editors 8
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+
+import httpx
+import websockets
+
+from app.core import ot
+from benchmarks.bench_ws_fanout import API_V1_PREFIX, setup_note
+from benchmarks.utils import summarize
+
+
+class Editor:
+    """Client side of the protocol: a confirmed document plus ops in flight, one op sent at a time"""
+
+    def __init__(self, websocket, connection_id: str, rev: int, document: str):
+        self.websocket = websocket
+        self.connection_id = connection_id
+        self.rev = rev
+        self.document = document
+        self.inflight = None  # (id, op, sent_at), sent and not acknowledged yet
+        self.pending = []  # ops typed meanwhile, sent once inflight is acknowledged
+        self.latencies = []
+        self.next_id = 0
+
+    @property
+    def text(self) -> str:
+        text = self.document
+        if self.inflight is not None:
+            text = ot.apply(text, self.inflight[1])
+        for op in self.pending:
+            text = ot.apply(text, op)
+        return text
+
+    async def type(self, character: str) -> None:
+        op = ot.normalize([random.randint(0, len(self.text)), character])
+        self.pending.append(op)
+        await self.flush()
+
+    async def flush(self) -> None:
+        if self.inflight is None and self.pending:
+            op = self.pending.pop(0)
+            self.next_id += 1
+            self.inflight = (self.next_id, op, time.perf_counter())
+            await self.websocket.send(json.dumps({"type": "op", "rev": self.rev, "op": op, "id": self.next_id}))
+
+    async def receive(self) -> None:
+        message = json.loads(await self.websocket.recv())
+        if message["type"] == "error":
+            raise RuntimeError(message)
+        if message["type"] != "ops":
+            return
+        for applied in message["ops"]:
+            self.rev = applied["rev"]
+            if self.inflight is not None and applied["connection"] == self.connection_id and applied["id"] == self.inflight[0]:
+                self.latencies.append((time.perf_counter() - self.inflight[2]) * 1000)
+                self.document = ot.apply(self.document, applied["op"])
+                self.inflight = None
+                continue
+            # someone else's op: the server put it before ours, rebase what we have in flight
+            self.document = ot.apply(self.document, applied["op"])
+            op = applied["op"]
+            if self.inflight is not None:
+                inflight_op = ot.transform(self.inflight[1], op, "left")
+                op = ot.transform(op, self.inflight[1], "right")
+                self.inflight = (self.inflight[0], inflight_op, self.inflight[2])
+            pending = []
+            for pending_op in self.pending:
+                pending.append(ot.transform(pending_op, op, "left"))
+                op = ot.transform(op, pending_op, "right")
+            self.pending = pending
+        await self.flush()
+
+
+async def run(url: str, editors: int, keystrokes: int, interval: float):
+    token, note_id, refresh_token = await setup_note(url)
+    ws_url = url.replace("http", "ws", 1) + f"{API_V1_PREFIX}/note/ws/{note_id}"
+
+    clients = []
+    for _ in range(editors):
+        websocket = await websockets.connect(ws_url, max_size=None)
+        await websocket.send(json.dumps({"token": token}))
+        joined = json.loads(await websocket.recv())
+        snapshot = json.loads(await websocket.recv())
+        while snapshot["type"] != "snapshot":
+            snapshot = json.loads(await websocket.recv())
+        clients.append(Editor(websocket, joined["connection_id"], snapshot["rev"], snapshot["text"]))
+
+    async def listen(editor: Editor):
+        while True:
+            await editor.receive()
+
+    listeners = [asyncio.create_task(listen(editor)) for editor in clients]
+
+    async def typist(editor: Editor):
+        for _ in range(keystrokes):
+            await editor.type(random.choice("abcdefghij "))
+            await asyncio.sleep(interval)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(typist(editor) for editor in clients))
+    total = editors * keystrokes
+    while any(editor.rev < total or editor.inflight or editor.pending for editor in clients):
+        for task in listeners:
+            if task.done():
+                task.result()
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    for task in listeners:
+        task.cancel()
+    for editor in clients:
+        await editor.websocket.close()
+
+    texts = {editor.document for editor in clients}
+    print(summarize(f"op ack ({editors} editors)", [latency for editor in clients for latency in editor.latencies], elapsed))
+    print(f"editors converged: {len(texts) == 1}, {total} ops applied, {len(clients[0].document)} characters")
+
+    # the last editor leaving writes the note back, give it a moment
+    await asyncio.sleep(1)
+    async with httpx.AsyncClient(base_url=url, cookies={"refresh_token": refresh_token}) as client:
+        headers = {"Authorization": f"Bearer {token}"}
+        # the user id is the access token's subject
+        user_id = json.loads(base64.urlsafe_b64decode(token.split(".")[1] + "=="))["sub"]
+        response = await client.get(f"{API_V1_PREFIX}/note/{user_id}/{note_id}", headers=headers)
+    version = int(response.headers["ETag"].strip('"').split("-")[1])
+    print(f"stored text matches: {response.json()['content'] == clients[0].document}, "
+          f"{version - 1} note writes for {total} ops")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--editors", type=int, default=8)
+    parser.add_argument("--keystrokes", type=int, default=200, help="inserts per editor")
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between two keystrokes of an editor")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.editors, args.keystrokes, args.interval))
@@ -0,0 +1,69 @@
+"""
+Rendering a large listing (folders/notes) as a JSON response body.
+
+Fetches `--rows` rows shaped like note_folder rows (uuid, text, bool, timestamps) through the
+async engine, so it needs the same settings/.env as the server, then times every way of turning
+them into response bytes:
+  - rows2dict + jsonable_encoder + json.dumps   what FastAPI did with a returned rows2dict list
+  - rows2dict + jsonable_encoder + orjson       the same with the ORJSONResponse default class
+  - rows2json                                   Rows straight to bytes (json_response)
+
+    python -m benchmarks.bench_json_listing --rows 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy import text
+
+from app.core.database import AsyncSessionLocal, async_engine
+from app.core.helper import rows2dict, rows2json
+from benchmarks.utils import summarize
+
+LISTING_QUERY = """
+    SELECT i AS id, gen_random_uuid() AS user_id, 'Folder number ' || i AS name, i / 10 AS parent_id,
+           i = 1 AS is_root, (i / 10) || '/' || i || '/' AS path,
+           now() - i * interval '1 minute' AS created_at, now() - i * interval '1 second' AS updated_at
+    FROM generate_series(1, :rows) AS i
+"""
+
+
+async def fetch(rows: int):
+    async with AsyncSessionLocal() as session:
+        result = (await session.execute(text(LISTING_QUERY), {"rows": rows})).all()
+    await async_engine.dispose()
+    return result
+
+
+def run(rows: int, repeat: int):
+    result = asyncio.run(fetch(rows))
+
+    renderers = {
+        "rows2dict + encoder + json": lambda: JSONResponse(jsonable_encoder(rows2dict(result))).body,
+        "rows2dict + encoder + orjson": lambda: ORJSONResponse(jsonable_encoder(rows2dict(result))).body,
+        "rows2json": lambda: rows2json(result),
+    }
+
+    bodies = {}
+    for name, render in renderers.items():
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            bodies[name] = render()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(summarize(f"{name} ({rows} rows)", samples) + f" size={len(bodies[name])}B")
+
+    # every renderer produces the same document
+    documents = [json.loads(body) for body in bodies.values()]
+    print("same output:", all(document == documents[0] for document in documents))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,70 @@
+"""
+Cost of a log call for the thread that logs (the event loop in the app).
+
+Compares writing records straight from the caller (the old StreamHandler setup) with handing them
+to the background listener thread, for an INFO line that is written and a DEBUG line that is
+disabled, formatted eagerly with an f-string or lazily with %s arguments.
+Output goes to a file (default /dev/null) so the terminal speed doesn't count.
+
+    python -m benchmarks.bench_logging --output /tmp/bench.log
+"""
+import argparse
+import logging
+import queue
+
+from app.config.logger import ColoredFormatter, JsonFormatter, LogListener, NonBlockingQueueHandler, RequestIdFilter
+from benchmarks.utils import ops_per_sec
+
+MESSAGE = {"type": "op", "rev": 1234, "op": [17, "a"], "id": 42}
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    return logger
+
+
+def run(iterations: int, output: str):
+    stream = open(output, "a")
+    user_id = "5f0c2f3e-8d0b-4a5e-9c43-2f0a4c3a1b7e"
+
+    direct = logging.StreamHandler(stream)
+    direct.setFormatter(ColoredFormatter(FORMAT))
+
+    setups = {"direct": (direct, None)}
+    for name, formatter in (("queued", ColoredFormatter(FORMAT)), ("queued json", JsonFormatter())):
+        console = logging.StreamHandler(stream)
+        console.setFormatter(formatter)
+        handler = NonBlockingQueueHandler(queue.Queue(2 * iterations))
+        handler.addFilter(RequestIdFilter())
+        setups[name] = (handler, LogListener(handler.queue, console))
+
+    for name, (handler, listener) in setups.items():
+        logger = make_logger(name, handler)
+        log = lambda: logger.info("Received data from user %s: %r", user_id, MESSAGE)
+        if listener is None:
+            print(f"{name:<12} info    {1e6 / ops_per_sec(log, iterations):8.2f} us/call")
+            continue
+        # the caller's part alone, then with the listener formatting and writing at the same time (sharing the GIL)
+        enqueued = ops_per_sec(log, iterations)
+        listener.start()
+        concurrent = ops_per_sec(log, iterations)
+        listener.stop()
+        print(f"{name:<12} info    {1e6 / enqueued:8.2f} us/call, {1e6 / concurrent:8.2f} us/call while the listener writes")
+
+    logger = make_logger("disabled", logging.NullHandler())
+    eager = ops_per_sec(lambda: logger.debug(f"Received data from user {user_id}: {MESSAGE!r}"), iterations)
+    lazy = ops_per_sec(lambda: logger.debug("Received data from user %s: %r", user_id, MESSAGE), iterations)
+    print(f"{'disabled':<12} debug   {1e6 / eager:8.2f} us/call f-string, {1e6 / lazy:8.2f} us/call lazy")
+    stream.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--output", default="/dev/null")
+    args = parser.parse_args()
+    run(args.iterations, args.output)
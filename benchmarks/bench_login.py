@@ -0,0 +1,68 @@
+"""
+Login throughput benchmark for a single worker.
+
+Registers one user, then fires CONCURRENCY logins at a time for DURATION seconds
+while a probe client polls /health. With bcrypt on the event loop the probe latency
+tracks the login backlog; with the hashing executor it stays flat and overload
+shows up as 503s instead.
+
+Start a single worker so the numbers are per worker:
+    uvicorn app.main:app --port 8000 --workers 1
+    python -m benchmarks.bench_login --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from benchmarks.utils import summarize
+
+API_V1_PREFIX = "/api/v1"
+
+
+async def run(url: str, concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        suffix = uuid.uuid4().hex[:10]
+        credentials = {"email": f"bench_{suffix}@example.com", "password": "benchpassword"}
+        response = await client.post(f"{API_V1_PREFIX}/auth/register", json={**credentials, "username": f"bench_{suffix}"})
+        response.raise_for_status()
+
+        login_samples: list[float] = []
+        probe_samples: list[float] = []
+        status_codes: dict[int, int] = {}
+        deadline = time.perf_counter() + duration
+
+        async def login_loop():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post(f"{API_V1_PREFIX}/auth/login", json=credentials)
+                login_samples.append((time.perf_counter() - start) * 1000)
+                status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+        async def probe_loop():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/health")
+                probe_samples.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.05)
+
+        start = time.perf_counter()
+        await asyncio.gather(probe_loop(), *[login_loop() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+        successful = status_codes.get(200, 0)
+        print(summarize(f"POST /auth/login c={concurrency}", login_samples, elapsed))
+        print(summarize("GET /health (probe during logins)", probe_samples))
+        print(f"successful logins/sec: {successful / elapsed:.1f}  status codes: {status_codes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.duration))
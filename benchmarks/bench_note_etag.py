@@ -0,0 +1,93 @@
+"""
+Bytes saved by conditional GETs of note contents over a simulated editing session.
+
+Creates a note with a `--size` KB body, then opens it `--opens` times like an editor that
+reopens/refocuses the note. Between opens the note is changed elsewhere (a small PATCH)
+with probability `--edit-ratio`. Every open is done twice: unconditionally, and with the
+If-None-Match of the copy the client already has.
+
+    uvicorn app.main:app --port 8000 --workers 1
+    python -m benchmarks.bench_note_etag --url http://localhost:8000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+import httpx
+from benchmarks.utils import summarize
+
+API_V1_PREFIX = "/api/v1"
+
+
+def run(url: str, size_kb: int, opens: int, edit_ratio: float):
+    with httpx.Client(base_url=url, timeout=60) as client:
+        suffix = uuid.uuid4().hex[:10]
+        response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+            "email": f"bench_{suffix}@example.com",
+            "username": f"bench_{suffix}",
+            "password": "benchpassword",
+        })
+        response.raise_for_status()
+        user_id = response.json()["user"]["id"]
+        headers = {"Authorization": f"Bearer {response.json()['token']['access_token']}"}
+        client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+
+        folder_id = client.get(f"{API_V1_PREFIX}/note_folder/", headers=headers).json()[0]["id"]
+        body = "lorem ipsum dolor sit amet " * (size_kb * 1024 // 27)
+        response = client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+            "title": "bench note", "format": "text", "content": body, "folder_id": folder_id,
+        })
+        response.raise_for_status()
+        note_id = response.json()["id"]
+        path = f"{API_V1_PREFIX}/note/{user_id}/{note_id}"
+
+        version = response.json()["version"]
+        plain_bytes = conditional_bytes = patch_bytes = not_modified = edits = 0
+        plain_samples: list[float] = []
+        conditional_samples: list[float] = []
+        etag = None
+        for i in range(opens):
+            if i and random.random() < edit_ratio:
+                edits += 1
+                patch = json.dumps({"version": version, "operations": [
+                    {"op": "splice", "path": "/content", "offset": random.randrange(len(body)), "length": 0, "value": f"edit {i} "},
+                ]})
+                patch_bytes += len(patch)
+                response = client.patch(path, headers={**headers, "Content-Type": "application/json"}, content=patch)
+                response.raise_for_status()
+                version = response.json()["version"]
+
+            start = time.perf_counter()
+            response = client.get(path, headers=headers)
+            plain_samples.append((time.perf_counter() - start) * 1000)
+            plain_bytes += len(response.content)
+
+            start = time.perf_counter()
+            response = client.get(path, headers={**headers, **({"If-None-Match": etag} if etag else {})})
+            conditional_samples.append((time.perf_counter() - start) * 1000)
+            conditional_bytes += len(response.content)
+            if response.status_code == 304:
+                not_modified += 1
+            else:
+                etag = response.headers["ETag"]
+
+        print(f"{opens} opens of a {size_kb}KB note, {edits} edits in between, {not_modified} answered 304")
+        print(summarize("GET (unconditional)", plain_samples))
+        print(summarize("GET (If-None-Match)", conditional_samples))
+        saved = plain_bytes - conditional_bytes
+        print(f"body bytes: unconditional={plain_bytes} conditional={conditional_bytes} "
+              f"saved={saved} ({saved / plain_bytes:.1%})")
+        if edits:
+            print(f"edit request bytes: {patch_bytes / edits:.0f} per PATCH vs {len(json.dumps(body))} for the whole body")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--size", type=int, default=256, help="note body size in KB")
+    parser.add_argument("--opens", type=int, default=200)
+    parser.add_argument("--edit-ratio", type=float, default=0.1, help="chance the note changed between two opens")
+    args = parser.parse_args()
+    run(args.url, args.size, args.opens, args.edit_ratio)
@@ -0,0 +1,70 @@
+"""
+Repeat executions of one hand-written statement, the way the endpoints run them.
+
+Runs `--executions` lookups over a single asyncpg connection (needs the same settings/.env as the
+server) with a catalog query that takes Postgres some parsing and planning:
+  - text() per call, unprepared     a new TextClause per execute, no prepared statement cache
+                                    (asyncpg then prepares the statement again for every execute)
+  - text() per call, prepared       the same with asyncpg's prepared statements (DB_PREPARED_STATEMENT_CACHE_SIZE)
+  - sql() registry, prepared        the statement from app.core.queries, built once
+and the SQLAlchemy side alone (building the TextClause and its cache key) without the round trip.
+
+    python -m benchmarks.bench_queries --executions 5000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.core.database import ASYNC_DATABASE_URL
+from app.core.queries import sql
+from benchmarks.utils import ops_per_sec, summarize
+
+LOOKUP_QUERY = """
+    SELECT c.relname, n.nspname, count(a.attnum) AS columns
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0
+    WHERE c.relname = :name
+    GROUP BY c.relname, n.nspname
+"""
+
+
+async def execute(prepared_statement_cache_size: int, statement, executions: int) -> list[float]:
+    """ms per execute, one sample per execution"""
+    engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool, connect_args={"prepared_statement_cache_size": prepared_statement_cache_size})
+    samples = []
+    async with engine.connect() as conn:
+        for _ in range(100):  # warm up
+            await conn.execute(statement(), {"name": "pg_class"})
+        for _ in range(executions):
+            start = time.perf_counter()
+            (await conn.execute(statement(), {"name": "pg_class"})).all()
+            samples.append((time.perf_counter() - start) * 1000)
+    await engine.dispose()
+    return samples
+
+
+def run(executions: int):
+    variants = {
+        "text() per call, unprepared": (0, lambda: text(LOOKUP_QUERY)),
+        "text() per call, prepared": (256, lambda: text(LOOKUP_QUERY)),
+        "sql() registry, prepared": (256, lambda: sql("bench.lookup", LOOKUP_QUERY)),
+    }
+    for name, (cache_size, statement) in variants.items():
+        print(summarize(name, asyncio.run(execute(cache_size, statement, executions))))
+
+    # what the registry saves in process: parsing the bind parameters and computing the cache key
+    built = ops_per_sec(lambda: text(LOOKUP_QUERY)._generate_cache_key(), executions)
+    registered = ops_per_sec(lambda: sql("bench.lookup", LOOKUP_QUERY)._generate_cache_key(), executions)
+    print(f"statement + cache key: {1e6 / built:.2f} us text(), {1e6 / registered:.2f} us sql()")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--executions", type=int, default=5000)
+    args = parser.parse_args()
+    run(args.executions)
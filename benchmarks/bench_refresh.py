@@ -0,0 +1,68 @@
+"""
+Latency of the token refresh path.
+
+Registers a user, mints an already-expired access token with the server's SECRET_KEY
+(so run it with the same settings/.env as the server) and measures:
+  - GET /auth/me with the expired access token, which refreshes inside get_current_user
+  - POST /auth/refresh
+  - GET /auth/me with a valid token, as the no-refresh baseline
+
+    uvicorn app.main:app --port 8000 --workers 1
+    python -m benchmarks.bench_refresh --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import timedelta
+
+import httpx
+
+from app.core.auth import create_access_token
+from benchmarks.utils import summarize
+
+API_V1_PREFIX = "/api/v1"
+
+
+async def run(url: str, concurrency: int, requests: int):
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=httpx.Limits(max_connections=concurrency)) as client:
+        suffix = uuid.uuid4().hex[:10]
+        response = await client.post(f"{API_V1_PREFIX}/auth/register", json={
+            "email": f"bench_{suffix}@example.com",
+            "username": f"bench_{suffix}",
+            "password": "benchpassword",
+        })
+        response.raise_for_status()
+        user_id = response.json()["user"]["id"]
+        valid_token = response.json()["token"]["access_token"]
+        client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+        expired_token = create_access_token(data={"sub": user_id}, expires_delta=timedelta(seconds=-1))
+
+        scenarios = {
+            "GET /auth/me (expired access token)": ("GET", "/auth/me", {"Authorization": f"Bearer {expired_token}"}),
+            "POST /auth/refresh": ("POST", "/auth/refresh", {}),
+            "GET /auth/me (valid access token)": ("GET", "/auth/me", {"Authorization": f"Bearer {valid_token}"}),
+        }
+
+        for name, (method, path, headers) in scenarios.items():
+            samples: list[float] = []
+
+            async def worker():
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = await client.request(method, f"{API_V1_PREFIX}{path}", headers=headers)
+                    samples.append((time.perf_counter() - start) * 1000)
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+            print(summarize(f"{name} c={concurrency}", samples, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=40, help="requests per client")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.requests))
@@ -0,0 +1,66 @@
+"""
+Encode/decode throughput of every token codec backend, plus a correctness check
+that each backend accepts the others' tokens and rejects tampered/expired ones.
+
+No app settings needed:
+    python -m benchmarks.bench_token_codecs
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app.core.token_codec import TOKEN_CODECS, TokenError, TokenExpiredError
+from benchmarks.utils import ops_per_sec
+
+SECRET_KEY = "benchmark-secret"
+ALGORITHM = "HS256"
+
+
+def claims(expires_in: timedelta = timedelta(minutes=30)) -> dict:
+    return {"sub": str(uuid.uuid4()), "exp": datetime.now() + expires_in, "token_type": "access", "iat": datetime.now()}
+
+
+def check(codecs: dict) -> list[str]:
+    failures = []
+    for issuer_name, issuer in codecs.items():
+        token = issuer.encode(claims())
+        for verifier_name, verifier in codecs.items():
+            if verifier.decode(token)["token_type"] != "access":
+                failures.append(f"{verifier_name} decoded a {issuer_name} token incorrectly")
+
+        tampered = token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1]
+        expired = issuer.encode(claims(timedelta(seconds=-5)))
+        for bad_token, error in ((tampered, TokenError), (expired, TokenExpiredError)):
+            try:
+                issuer.decode(bad_token)
+                failures.append(f"{issuer_name} accepted a bad token")
+            except error:
+                pass
+    return failures
+
+
+def run(iterations: int):
+    codecs = {}
+    for name, codec_class in TOKEN_CODECS.items():
+        try:
+            codecs[name] = codec_class(SECRET_KEY, ALGORITHM)
+        except RuntimeError as e:
+            print(f"{name:<6} skipped: {e}")
+
+    failures = check(codecs)
+    print("correctness:", "ok" if not failures else failures)
+
+    payload = claims()
+    for name, codec in codecs.items():
+        token = codec.encode(payload)
+        encode_rate = ops_per_sec(lambda: codec.encode(payload), iterations)
+        decode_rate = ops_per_sec(lambda: codec.decode(token), iterations)
+        print(f"{name:<6} encode {encode_rate:10.0f} ops/sec   decode {decode_rate:10.0f} ops/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+    run(args.iterations)
@@ -0,0 +1,127 @@
+"""
+Latency of the typeahead name lookup on a large synthetic table.
+
+Builds (once) an unlogged `bench_typeahead` table shaped like `note`, with `--rows` random
+three word names spread over `--users` users and the same indexes as the note table
+(GIN on user_id, name gin_trgm_ops), then times the /note/typeahead query against it
+straight through the sync engine, so it needs the same settings/.env as the server.
+
+    python -m benchmarks.bench_typeahead --rows 1000000
+    python -m benchmarks.bench_typeahead --drop
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import text
+
+from app.core.database import engine
+from app.core.helper import escape_like
+from app.v1.endpoints.note import NOTE_TYPEAHEAD_QUERY
+from benchmarks.utils import summarize
+
+TABLE = "bench_typeahead"
+
+# names are three pseudo words of 2-3 syllables each, ~70k distinct words, so a typed fragment
+# narrows the rows down roughly like it would on real note titles
+SYLLABLES = [
+    "ka", "ro", "mi", "te", "sa", "lu", "ne", "po", "di", "ga", "ve", "zo", "bri", "stan", "mor",
+    "fel", "quin", "dra", "lo", "pe", "shi", "tor", "vin", "cal", "ber", "nu", "wes", "ha", "jo", "rel",
+    "ski", "tam", "op", "ur", "en", "ix", "ad", "ol", "gri", "pha",
+]
+
+# the bench table has every column NOTE_TYPEAHEAD_QUERY reads, so the query runs unchanged
+QUERY = NOTE_TYPEAHEAD_QUERY.replace("FROM note\n", f"FROM {TABLE}\n")
+
+
+def setup(conn, rows: int, users: int):
+    exists = conn.execute(text("SELECT to_regclass(:table)"), {"table": TABLE}).scalar()
+    if exists:
+        count = conn.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar()
+        if count == rows:
+            return
+        conn.execute(text(f"DROP TABLE {TABLE}"))
+
+    print(f"building {TABLE} with {rows} rows over {users} users ...")
+    start = time.perf_counter()
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+    conn.execute(text(f"""
+        CREATE UNLOGGED TABLE {TABLE} (
+            id serial PRIMARY KEY,
+            user_id uuid NOT NULL,
+            name varchar(150) NOT NULL,
+            folder_id integer NOT NULL,
+            format varchar(20) NOT NULL
+        )
+    """))
+    conn.execute(text(f"""
+        WITH syllables AS (SELECT CAST(:syllables AS text[]) AS s),
+             words AS (
+                 SELECT array_agg(s[1 + floor(random() * array_length(s, 1))::int] ||
+                                  s[1 + floor(random() * array_length(s, 1))::int] ||
+                                  CASE WHEN random() < 0.5 THEN s[1 + floor(random() * array_length(s, 1))::int] ELSE '' END) AS w
+                 FROM generate_series(1, 20000), syllables
+             ),
+             bench_users AS (SELECT array_agg(gen_random_uuid()) AS u FROM generate_series(1, :users))
+        INSERT INTO {TABLE} (user_id, name, folder_id, format)
+        SELECT u[1 + (i % :users)],
+               initcap(w[1 + floor(random() * array_length(w, 1))::int]) || ' ' ||
+               w[1 + floor(random() * array_length(w, 1))::int] || ' ' ||
+               w[1 + floor(random() * array_length(w, 1))::int],
+               1 + (i % 50),
+               'text'
+        FROM generate_series(1, :rows) AS i, words, bench_users
+    """), {"syllables": SYLLABLES, "users": users, "rows": rows})
+    conn.execute(text(f"CREATE INDEX ON {TABLE} USING gin (user_id, name gin_trgm_ops)"))
+    conn.execute(text(f"ANALYZE {TABLE}"))
+    print(f"built in {time.perf_counter() - start:.1f}s")
+
+
+def params_for(q: str, user_id, limit: int) -> dict:
+    escaped = escape_like(q)
+    return {"user_id": user_id, "q": q, "pattern": f"%{escaped}%", "prefix": f"{escaped}%", "limit": limit}
+
+
+def run(rows: int, users: int, lookups: int, limit: int):
+    with engine.begin() as conn:
+        setup(conn, rows, users)
+
+    with engine.connect() as conn:
+        user_ids = conn.execute(text(f"SELECT DISTINCT user_id FROM {TABLE}")).scalars().all()
+        # what a user types: the first 3-6 characters of a word of some existing name
+        names = conn.execute(text(f"SELECT name FROM {TABLE} TABLESAMPLE SYSTEM (1) LIMIT 1000")).scalars().all()
+        inputs = [random.choice(name.split())[:random.randint(3, 6)] for name in names]
+
+        plan = conn.execute(text("EXPLAIN " + QUERY), params_for(inputs[0], user_ids[0], limit)).scalars().all()
+        print("\n".join(plan))
+
+        for name, scoped in (("typeahead (user scoped)", True), ("typeahead (all users)", False)):
+            query = QUERY if scoped else QUERY.replace("user_id = :user_id AND ", "")
+            samples: list[float] = []
+            start = time.perf_counter()
+            for _ in range(lookups):
+                params = params_for(random.choice(inputs), random.choice(user_ids), limit)
+                lookup_start = time.perf_counter()
+                conn.execute(text(query), params).all()
+                samples.append((time.perf_counter() - lookup_start) * 1000)
+            print(summarize(f"{name} rows={rows}", samples, time.perf_counter() - start))
+
+
+def drop():
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--drop", action="store_true", help="drop the bench table and exit")
+    args = parser.parse_args()
+    if args.drop:
+        drop()
+    else:
+        run(args.rows, args.users, args.lookups, args.limit)
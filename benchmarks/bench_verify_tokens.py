@@ -0,0 +1,42 @@
+"""
+Microbenchmark of verify_tokens with and without the verified-JWT cache.
+
+Needs the usual app settings in the environment (or a .env), no database:
+    python -m benchmarks.bench_verify_tokens
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from app.core.auth import verify_tokens, create_access_token, create_refresh_token, token_cache
+
+
+async def measure(access_token: str, refresh_token: str, iterations: int, cached: bool) -> float:
+    token_cache.clear()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if not cached:
+            token_cache.clear()
+        await verify_tokens(access_token, refresh_token)
+    return iterations / (time.perf_counter() - start)
+
+
+async def run(iterations: int):
+    user_id = str(uuid.uuid4())
+    access_token = create_access_token(data={"sub": user_id})
+    refresh_token = create_refresh_token(data={"sub": user_id})
+
+    uncached = await measure(access_token, refresh_token, iterations, cached=False)
+    cached = await measure(access_token, refresh_token, iterations, cached=True)
+
+    print(f"verify_tokens without cache: {uncached:12.0f} ops/sec")
+    print(f"verify_tokens with cache:    {cached:12.0f} ops/sec  ({cached / uncached:.1f}x)")
+    print(f"token cache: {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
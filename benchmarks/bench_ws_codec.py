@@ -0,0 +1,95 @@
+"""
+Bandwidth and CPU per message of the websocket encodings (JSON text vs MessagePack binary frames).
+
+Replays the server side of a note editing session: mostly single keystroke "ops" batches,
+some presence "message" broadcasts (with their ISO timestamp), heartbeat pings and a snapshot.
+For every codec it reports the bytes per message raw and after permessage-deflate, as uvicorn
+negotiates it by default (one deflate stream per connection, context kept between messages),
+and the CPU per message to encode, decode and compress.
+
+No server needed:
+    python -m benchmarks.bench_ws_codec --messages 20000
+"""
+import argparse
+import random
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+from app.core.ws_codec import CODECS
+
+CONNECTIONS = [uuid.uuid4().hex for _ in range(8)]
+
+
+def session(messages: int) -> list[dict]:
+    random.seed(1)
+    text_length = 2000
+    stream = [{"type": "snapshot", "rev": 0, "text": "lorem ipsum " * (text_length // 12)}]
+    for rev in range(1, messages):
+        kind = random.random()
+        if kind < 0.85:
+            text_length += 1
+            stream.append({"type": "ops", "ops": [{
+                "rev": rev,
+                "op": [random.randrange(text_length), random.choice("abcdefghij ")],
+                "id": random.randrange(1_000_000),
+                "connection": random.choice(CONNECTIONS),
+            }]})
+        elif kind < 0.97:
+            stream.append({
+                "type": "message",
+                "content": '{"cursor": %d}' % random.randrange(text_length),
+                "note_id": 42,
+                "user_id": str(uuid.uuid4()),
+                "timestamp": datetime.now().isoformat(),
+            })
+        else:
+            stream.append({"type": "ping"})
+    return stream
+
+
+def deflate_sizes(frames: list, takeover: bool) -> tuple[int, float]:
+    """Total bytes of the frames after permessage-deflate, and the seconds it took"""
+    total = 0
+    start = time.perf_counter()
+    compressor = zlib.compressobj(wbits=-15)
+    for frame in frames:
+        data = frame if isinstance(frame, bytes) else frame.encode()
+        if not takeover:
+            compressor = zlib.compressobj(wbits=-15)
+        # the 4 byte empty block trailer of the sync flush isn't sent (RFC 7692)
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total, time.perf_counter() - start
+
+
+def run(messages: int):
+    stream = session(messages)
+    print(f"{len(stream)} messages of an editing session\n")
+    print(f"{'codec':<8} {'raw B/msg':>10} {'deflate B/msg':>14} {'no-takeover B/msg':>18} "
+          f"{'encode us':>10} {'decode us':>10} {'deflate us':>11}")
+
+    for codec in CODECS.values():
+        start = time.perf_counter()
+        frames = [codec.encode(message) for message in stream]
+        encode_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for frame in frames:
+            codec.decode(frame)
+        decode_s = time.perf_counter() - start
+
+        raw = sum(len(frame if isinstance(frame, bytes) else frame.encode()) for frame in frames)
+        deflated, deflate_s = deflate_sizes(frames, takeover=True)
+        no_takeover, _ = deflate_sizes(frames, takeover=False)
+
+        count = len(frames)
+        print(f"{codec.name:<8} {raw / count:>10.1f} {deflated / count:>14.1f} {no_takeover / count:>18.1f} "
+              f"{encode_s / count * 1e6:>10.2f} {decode_s / count * 1e6:>10.2f} {deflate_s / count * 1e6:>11.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+    run(args.messages)
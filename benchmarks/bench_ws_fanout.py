@@ -0,0 +1,115 @@
+"""
+Fan-out latency of a note room broadcast.
+
+Opens `--clients` websockets to the same note, then one of them sends `--messages` messages.
+For every message it records the latency to each receiver and to the last receiver (the time
+until the whole room has it). Run the server with several workers so the room spans
+processes and messages go through the pub/sub backend (postgres LISTEN/NOTIFY).
+
+`--slow` extra clients join the room but never read, like a stalled mobile client; with
+bounded outbound queues they must not change the latency of the others.
+
+    uvicorn app.main:app --port 8000 --workers 4
+    python -m benchmarks.bench_ws_fanout --url http://localhost:8000 --clients 100
+    python -m benchmarks.bench_ws_fanout --url http://localhost:8000 --clients 100 --slow 10 --payload 4000
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+import websockets
+
+from benchmarks.utils import summarize
+
+API_V1_PREFIX = "/api/v1"
+
+
+async def setup_note(url: str) -> tuple[str, int, str]:
+    """Registers a user with a note, returns its access token, the note id and its refresh token"""
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        suffix = uuid.uuid4().hex[:10]
+        response = await client.post(f"{API_V1_PREFIX}/auth/register", json={
+            "email": f"bench_{suffix}@example.com",
+            "username": f"bench_{suffix}",
+            "password": "benchpassword",
+        })
+        response.raise_for_status()
+        token = response.json()["token"]["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        refresh_token = response.cookies.get("refresh_token")
+        client.cookies.set("refresh_token", refresh_token)
+        folder_id = (await client.get(f"{API_V1_PREFIX}/note_folder/", headers=headers)).json()[0]["id"]
+        response = await client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+            "title": "fan-out", "format": "text", "content": "", "folder_id": folder_id,
+        })
+        response.raise_for_status()
+        return token, response.json()["id"], refresh_token
+
+
+async def join(ws_url: str, token: str, **options):
+    websocket = await websockets.connect(ws_url, max_size=None, **options)
+    await websocket.send(json.dumps({"token": token}))
+    while json.loads(await websocket.recv())["type"] != "joined":
+        pass
+    return websocket
+
+
+async def receive(websocket, messages: int, received: dict[int, list[float]]):
+    count = 0
+    while count < messages:
+        message = json.loads(await websocket.recv())
+        if message["type"] != "message":
+            continue
+        now = time.perf_counter()
+        seq, sent_at, _ = message["content"].split(":", 2)
+        received.setdefault(int(seq), []).append((now - float(sent_at)) * 1000)
+        count += 1
+
+
+async def run(url: str, clients: int, messages: int, interval: float, slow: int, payload: int):
+    token, note_id, _ = await setup_note(url)
+    ws_url = url.replace("http", "ws", 1) + f"{API_V1_PREFIX}/note/ws/{note_id}"
+
+    sender = await join(ws_url, token)
+    receivers = [await join(ws_url, token) for _ in range(clients - 1)]
+    # a one message client side buffer, the server's sends to them block once the TCP buffers are full
+    stalled = [await join(ws_url, token, max_queue=1) for _ in range(slow)]
+    # let the join notifications settle before measuring
+    await asyncio.sleep(1)
+
+    received: dict[int, list[float]] = {}
+    receiving = [asyncio.create_task(receive(websocket, messages, received)) for websocket in receivers]
+
+    padding = "x" * payload
+    start = time.perf_counter()
+    for seq in range(messages):
+        await sender.send(f"{seq}:{time.perf_counter()}:{padding}")
+        await asyncio.sleep(interval)
+    await asyncio.wait_for(asyncio.gather(*receiving), timeout=60)
+    elapsed = time.perf_counter() - start
+
+    per_receiver = [latency for latencies in received.values() for latency in latencies]
+    whole_room = [max(latencies) for latencies in received.values()]
+    label = f"{clients} clients" + (f", {slow} stalled" if slow else "")
+    print(summarize(f"fan-out per receiver ({label})", per_receiver))
+    print(summarize(f"fan-out whole room ({label})", whole_room, elapsed))
+
+    for websocket in [sender, *receivers]:
+        await websocket.close()
+    for websocket in stalled:
+        websocket.transport.abort()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=100, help="websockets in the room, sender included")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between two sent messages")
+    parser.add_argument("--slow", type=int, default=0, help="extra clients that join but never read")
+    parser.add_argument("--payload", type=int, default=0, help="bytes of padding per message")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.messages, args.interval, args.slow, args.payload))
@@ -0,0 +1,71 @@
+"""
+Load benchmark for the async DB endpoints.
+
+Registers a throwaway user, then runs CONCURRENCY clients in parallel against the
+folder listing and /auth/me endpoints and prints p50/p99 latency per route.
+
+Run it against a server started from the commit you want to measure, e.g.
+    uvicorn app.main:app --port 8000 --workers 1
+    python -m benchmarks.load_test --url http://localhost:8000 --concurrency 200
+then check out the other commit, restart the server and run it again.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from benchmarks.utils import summarize
+
+API_V1_PREFIX = "/api/v1"
+
+
+async def register_user(client: httpx.AsyncClient) -> tuple[str, str]:
+    suffix = uuid.uuid4().hex[:10]
+    response = await client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": f"bench_{suffix}@example.com",
+        "username": f"bench_{suffix}",
+        "password": "benchpassword",
+    })
+    response.raise_for_status()
+    return response.json()["token"]["access_token"], response.cookies.get("refresh_token")
+
+
+async def worker(client: httpx.AsyncClient, path: str, requests: int, headers: dict, cookies: dict, samples: list[float], errors: list[int]):
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get(path, headers=headers, cookies=cookies)
+        samples.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+async def run(url: str, concurrency: int, requests: int):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        access_token, refresh_token = await register_user(client)
+        headers = {"Authorization": f"Bearer {access_token}"}
+        cookies = {"refresh_token": refresh_token}
+
+        for path in (f"{API_V1_PREFIX}/note_folder/", f"{API_V1_PREFIX}/auth/me"):
+            samples: list[float] = []
+            errors: list[int] = []
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                worker(client, path, requests, headers, cookies, samples, errors)
+                for _ in range(concurrency)
+            ])
+            elapsed = time.perf_counter() - start
+            print(summarize(f"GET {path} c={concurrency}", samples, elapsed))
+            if errors:
+                print(f"  {len(errors)} non-200 responses")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=25, help="requests per client")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.requests))
@@ -0,0 +1,33 @@
+import statistics
+import time
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(name: str, samples_ms: list[float], elapsed_s: float | None = None) -> str:
+    """One result line: count, p50/p99/max latency and throughput"""
+    line = (
+        f"{name:<40} n={len(samples_ms):<7} "
+        f"p50={percentile(samples_ms, 50):8.2f}ms "
+        f"p99={percentile(samples_ms, 99):8.2f}ms "
+        f"max={max(samples_ms, default=0):8.2f}ms "
+        f"mean={statistics.fmean(samples_ms) if samples_ms else 0:8.2f}ms"
+    )
+    if elapsed_s:
+        line += f" rps={len(samples_ms) / elapsed_s:9.1f}"
+    return line
+
+
+def ops_per_sec(fn, iterations: int = 10_000) -> float:
+    """Call fn() `iterations` times and return calls per second"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return iterations / (time.perf_counter() - start)
@@ -13,5 +13,10 @@ fi
 echo "Running database migrations..."
 alembic upgrade head
 
+# The workers share their metrics through this directory, stale files of a previous run would be added in
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Start the application in production mode
 exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers 4 --log-level info
\ No newline at end of file
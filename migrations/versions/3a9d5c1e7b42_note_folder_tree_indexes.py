@@ -0,0 +1,33 @@
+"""note folder tree indexes
+
+Revision ID: 3a9d5c1e7b42
+Revises: 68f3d6022b21
+Create Date: 2026-10-17 21:05:12.418220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a9d5c1e7b42'
+down_revision: Union[str, None] = '68f3d6022b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # recursive folder tree joins on parent_id, note counts group by folder_id
+    op.create_index(op.f('ix_note_folder_parent_id'), 'note_folder', ['parent_id'], unique=False)
+    op.create_index(op.f('ix_note_folder_user_id'), 'note_folder', ['user_id'], unique=False)
+    op.create_index(op.f('ix_note_folder_id'), 'note', ['folder_id'], unique=False)
+    op.create_index(op.f('ix_note_user_id'), 'note', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_note_user_id'), table_name='note')
+    op.drop_index(op.f('ix_note_folder_id'), table_name='note')
+    op.drop_index(op.f('ix_note_folder_user_id'), table_name='note_folder')
+    op.drop_index(op.f('ix_note_folder_parent_id'), table_name='note_folder')
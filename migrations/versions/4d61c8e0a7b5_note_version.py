@@ -0,0 +1,27 @@
+"""note version
+
+Revision ID: 4d61c8e0a7b5
+Revises: 7b3e9f2a4c61
+Create Date: 2026-10-18 09:41:03.552190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d61c8e0a7b5'
+down_revision: Union[str, None] = '7b3e9f2a4c61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # constant default, no table rewrite
+    op.add_column('note', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('note', 'version')
@@ -0,0 +1,32 @@
+"""name trigram indexes
+
+Revision ID: 7b3e9f2a4c61
+Revises: e2b8d4a6f153
+Create Date: 2026-10-17 23:05:12.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e9f2a4c61'
+down_revision: Union[str, None] = 'e2b8d4a6f153'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # lets a GIN index lead with the (uuid) user_id column
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    op.create_index('ix_note_user_name_trgm', 'note', ['user_id', 'name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_note_folder_user_name_trgm', 'note_folder', ['user_id', 'name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_note_folder_user_name_trgm', table_name='note_folder', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.drop_index('ix_note_user_name_trgm', table_name='note', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    # the extensions are left installed, other objects in the database may depend on them
@@ -0,0 +1,48 @@
+"""note folder materialized path
+
+Revision ID: 8e4f0b6c2d19
+Revises: 3a9d5c1e7b42
+Create Date: 2026-10-17 21:32:40.127093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4f0b6c2d19'
+down_revision: Union[str, None] = '3a9d5c1e7b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('note_folder', sa.Column('path', sa.String(collation='C'), nullable=True))
+
+    # backfill: walk every tree from its top level folder down
+    op.execute("""
+        WITH RECURSIVE tree AS (
+            SELECT id, id::text || '/' AS path
+            FROM note_folder
+            WHERE parent_id IS NULL
+            UNION ALL
+            SELECT f.id, t.path || f.id || '/'
+            FROM note_folder f
+            JOIN tree t ON f.parent_id = t.id
+        )
+        UPDATE note_folder SET path = tree.path
+        FROM tree
+        WHERE note_folder.id = tree.id
+    """)
+    # folders stuck in a parent_id cycle are unreachable from any top level folder, give them their own tree
+    op.execute("UPDATE note_folder SET path = id::text || '/' WHERE path IS NULL")
+
+    op.alter_column('note_folder', 'path', nullable=False)
+    op.create_index(op.f('ix_note_folder_path'), 'note_folder', ['path'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_note_folder_path'), table_name='note_folder')
+    op.drop_column('note_folder', 'path')
@@ -0,0 +1,27 @@
+"""note collab rev
+
+Revision ID: a9c3e5f71d26
+Revises: 4d61c8e0a7b5
+Create Date: 2026-10-18 14:12:47.204836
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c3e5f71d26'
+down_revision: Union[str, None] = '4d61c8e0a7b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # constant default, no table rewrite
+    op.add_column('note', sa.Column('collab_rev', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('note', 'collab_rev')
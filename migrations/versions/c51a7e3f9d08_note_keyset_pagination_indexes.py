@@ -0,0 +1,38 @@
+"""note keyset pagination indexes
+
+Revision ID: c51a7e3f9d08
+Revises: 8e4f0b6c2d19
+Create Date: 2026-10-17 21:58:03.551870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c51a7e3f9d08'
+down_revision: Union[str, None] = '8e4f0b6c2d19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # notes are paginated on (updated_at, id), so updated_at can't be NULL anymore
+    op.execute("UPDATE note SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL")
+    op.alter_column('note', 'updated_at', server_default=sa.text('now()'), nullable=False)
+
+    op.create_index('ix_note_user_updated_at', 'note', ['user_id', 'updated_at', 'id'], unique=False)
+    op.create_index('ix_note_user_folder_updated_at', 'note', ['user_id', 'folder_id', 'updated_at', 'id'], unique=False)
+    op.create_index('ix_note_user_format_updated_at', 'note', ['user_id', 'format', 'updated_at', 'id'], unique=False)
+    # leading column of ix_note_user_updated_at
+    op.drop_index(op.f('ix_note_user_id'), table_name='note')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_note_user_id'), 'note', ['user_id'], unique=False)
+    op.drop_index('ix_note_user_format_updated_at', table_name='note')
+    op.drop_index('ix_note_user_folder_updated_at', table_name='note')
+    op.drop_index('ix_note_user_updated_at', table_name='note')
+    op.alter_column('note', 'updated_at', server_default=None, nullable=True)
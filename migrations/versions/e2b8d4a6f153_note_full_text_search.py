@@ -0,0 +1,39 @@
+"""note full text search
+
+Revision ID: e2b8d4a6f153
+Revises: c51a7e3f9d08
+Create Date: 2026-10-17 22:21:47.903318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b8d4a6f153'
+down_revision: Union[str, None] = 'c51a7e3f9d08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # stored generated column, existing rows are filled in by the table rewrite
+    op.add_column('note', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(content->>'content', '')), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index('ix_note_search_vector', 'note', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_note_search_vector', table_name='note', postgresql_using='gin')
+    op.drop_column('note', 'search_vector')
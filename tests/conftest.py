@@ -1,7 +1,14 @@
+import os
+
+# websocket rooms fan out in-process during tests, the postgres backend is tested on its own
+os.environ.setdefault("WEBSOCKET_BACKEND", "memory")
+
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.core.database import SessionLocal, get_db, Base, engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from app.core.database import SessionLocal, get_db, get_async_db, Base, engine, async_engine, ASYNC_DATABASE_URL
 
 from app.models.user import User
 from app.models.login import LoginAttempts
@@ -38,7 +45,26 @@ def client(db_session):
         finally:
             pass
 
+    # every TestClient runs its own event loop, so async connections can't be pooled across tests
+    test_async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+    AsyncTestingSession = async_sessionmaker(bind=test_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async_session = AsyncTestingSession()
+        try:
+            yield async_session
+            await async_session.commit()
+        except Exception:
+            await async_session.rollback()
+            raise
+        finally:
+            await async_session.close()
+
     app.dependency_overrides[get_db] = override_get_db
+    # no replica in the tests, get_async_read_db hands out this same session
+    app.dependency_overrides[get_async_db] = override_get_async_db
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
+    # code that opens its own sessions uses the app's pooled engine, whose connections belong to this client's loop
+    async_engine.sync_engine.dispose(close=False)
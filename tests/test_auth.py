@@ -131,3 +131,56 @@ def test_login_user(client):
     assert data["user"]["email"] == TEST_USER["email"]
     assert "token" in data
     assert data["token"]["token_type"] == "access"
+
+def test_expired_access_token_is_refreshed(client):
+    from datetime import timedelta
+    from app.core.auth import create_access_token, user_cache
+
+    register_response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": "refresh@example.com",
+        "username": "refreshuser",
+        "password": "testpassword"
+    })
+    assert register_response.status_code == 200
+    user_id = register_response.json()["user"]["id"]
+    client.cookies.set("refresh_token", register_response.cookies.get("refresh_token"))
+
+    # the refresh path loads the user into the cache, so /me doesn't query it again
+    user_cache.invalidate(user_id)
+    expired_token = create_access_token(data={"sub": user_id}, expires_delta=timedelta(seconds=-1))
+    me_response = client.get(f"{API_V1_PREFIX}/auth/me", headers={"Authorization": f"Bearer {expired_token}"})
+    assert me_response.status_code == 200
+    assert me_response.json()["id"] == user_id
+    assert user_cache.get(user_id) is not None
+
+    # the new access token comes in a header and works
+    new_token = me_response.headers["X-New-Access-Token"]
+    me_response = client.get(f"{API_V1_PREFIX}/auth/me", headers={"Authorization": f"Bearer {new_token}"})
+    assert me_response.status_code == 200
+    assert "X-New-Access-Token" not in me_response.headers
+
+    refresh_response = client.post(f"{API_V1_PREFIX}/auth/refresh")
+    assert refresh_response.status_code == 200
+    assert isinstance(refresh_response.json()["access_token"], str)
+
+def test_refresh_returns_access_token(client):
+    from app.core.auth import decode_token
+
+    register_response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": "refreshshape@example.com",
+        "username": "refreshshapeuser",
+        "password": "testpassword"
+    })
+    assert register_response.status_code == 200
+    user_id = register_response.json()["user"]["id"]
+    client.cookies.set("refresh_token", register_response.cookies.get("refresh_token"))
+
+    refresh_response = client.post(f"{API_V1_PREFIX}/auth/refresh")
+    assert refresh_response.status_code == 200
+    data = refresh_response.json()
+    assert list(data) == ["access_token"]
+    assert isinstance(data["access_token"], str)
+    assert decode_token(data["access_token"])["sub"] == user_id
+
+    client.cookies.clear()
+    assert client.post(f"{API_V1_PREFIX}/auth/refresh").status_code == 401
@@ -0,0 +1,85 @@
+import time
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from app.core.cache import TTLCache
+from app.core.auth import user_cache, token_cache, decode_token, create_access_token
+from app.core.token_codec import TokenExpiredError
+from app.core.config import settings
+
+API_V1_PREFIX = settings.API_V1_STR
+
+
+def test_ttl_cache_lru_and_expiry():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # touching "a" makes "b" the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+    # per-entry ttl
+    cache.set("short", 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+
+    cache.invalidate("a")
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 3
+
+
+def test_current_user_is_cached(client):
+    response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": "cache@example.com",
+        "username": "cacheuser",
+        "password": "testpassword"
+    })
+    assert response.status_code == 200
+    user_id = response.json()["user"]["id"]
+    headers = {"Authorization": f"Bearer {response.json()['token']['access_token']}"}
+    client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+
+    hits_before = user_cache.hits
+    first = client.get(f"{API_V1_PREFIX}/auth/me", headers=headers)
+    second = client.get(f"{API_V1_PREFIX}/auth/me", headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert user_cache.hits > hits_before
+
+    response = client.get("/health/cache")
+    assert response.json()["caches"]["user"]["hits"] == user_cache.hits
+
+    user_cache.invalidate(user_id)
+    assert user_cache.get(user_id) is None
+
+
+def test_verified_tokens_are_cached():
+    token_cache.clear()
+    token = create_access_token(data={"sub": str(uuid.uuid4())})
+
+    first = decode_token(token)
+    hits_before = token_cache.hits
+    assert decode_token(token) == first
+    assert token_cache.hits == hits_before + 1
+
+    # callers can't change the cached claims
+    claims = dict(first)
+    first["sub"] = "someone else"
+    decode_token(token)["token_type"] = "refresh"
+    assert decode_token(token) == claims
+
+    # expired tokens still fail and are never cached
+    expired = create_access_token(data={"sub": str(uuid.uuid4())}, expires_delta=timedelta(seconds=-1))
+    with pytest.raises(TokenExpiredError):
+        decode_token(expired)
+    assert len(token_cache) == 1
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import async_engine, engine
+from app.core.queries import sql
+
+API_V1_PREFIX = settings.API_V1_STR
+
+
+def test_health_db(client):
+    def pools():
+        response = client.get("/health/db")
+        assert response.status_code == 200
+        return response.json()["pools"]
+
+    before = pools()
+
+    # the tests' requests run on their own NullPool engine, so check connections out of the app's pools directly
+    async def checkout():
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    asyncio.run(checkout())
+    # the pooled connection belongs to that (closed) loop
+    async_engine.sync_engine.dispose(close=False)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    for name, pool in pools().items():
+        assert pool["size"] == settings.DB_POOL_SIZE
+        assert pool["max_overflow"] == settings.DB_MAX_OVERFLOW
+        assert pool["checked_out"] >= 0
+        assert pool["checkouts"] > before[name]["checkouts"]
+        assert pool["wait_time_ms_histogram"]["+Inf"] == pool["checkouts"]
+
+
+def test_pool_events_not_logged(client, caplog):
+    # the app logger is at DEBUG in the tests, the pool loggers below it are not
+    with caplog.at_level(logging.DEBUG, logger="app"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        async_engine.sync_engine.dispose(close=False)
+    assert [record for record in caplog.records if record.name.startswith("app.core.pool")] == []
+
+
+def sample(client, name, **labels):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    for family in text_string_to_metric_families(response.text):
+        for metric in family.samples:
+            if metric.name == name and all(metric.labels.get(key) == value for key, value in labels.items()):
+                return metric.value
+    return 0.0
+
+
+def test_metrics(client):
+    route = f"{API_V1_PREFIX}/auth/login"
+    requests = sample(client, "http_requests_total", method="POST", route=route, status="401")
+    db_time = sample(client, "http_request_db_duration_seconds_sum", method="POST", route=route)
+
+    client.post(route, json={"email": "nobody@example.com", "password": "x"})
+    client.get("/no/such/path")
+
+    assert sample(client, "http_requests_total", method="POST", route=route, status="401") == requests + 1
+    assert sample(client, "http_request_duration_seconds_count", method="POST", route=route) >= 1
+    # the login looked the user up
+    assert sample(client, "http_request_db_duration_seconds_sum", method="POST", route=route) > db_time
+    assert sample(client, "http_requests_total", route="unmatched", status="404") >= 1
+    # /metrics itself is in progress
+    assert sample(client, "http_requests_in_progress", method="GET") == 1
+
+    ws_route = f"{API_V1_PREFIX}/note/ws/{{note_id}}"
+    received = sample(client, "websocket_messages_total", route=ws_route, direction="in")
+    with client.websocket_connect(f"{API_V1_PREFIX}/note/ws/1") as websocket:
+        assert sample(client, "websocket_connections", route=ws_route) == 1
+        websocket.send_text('{"token": "invalid"}')
+        websocket.receive_json()
+    assert sample(client, "websocket_messages_total", route=ws_route, direction="in") == received + 1
+    assert sample(client, "websocket_message_bytes_total", route=ws_route, direction="out") > 0
+    assert sample(client, "websocket_connections", route=ws_route) == 0
+
+
+def test_query_stats(client):
+    # the registry hands out one TextClause per statement
+    assert sql("test.select", "SELECT 1") is sql("test.select", "SELECT 1")
+
+    executions = client.get("/health/queries").json()["queries"].get("auth.login_user", {}).get("executions", 0)
+    timed = sample(client, "db_query_duration_seconds_count", query="auth.login_user")
+
+    client.post(f"{API_V1_PREFIX}/auth/login", json={"email": "nobody@example.com", "password": "x"})
+
+    stats = client.get("/health/queries").json()["queries"]["auth.login_user"]
+    assert stats["executions"] == executions + 1
+    assert stats["errors"] == 0
+    assert stats["max_ms"] >= stats["avg_ms"] > 0
+    assert sample(client, "db_query_duration_seconds_count", query="auth.login_user") == timed + 1
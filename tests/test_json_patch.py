@@ -0,0 +1,64 @@
+import pytest
+
+from app.core.json_patch import apply_patch, JsonPatchError
+
+
+def test_apply_patch_operations():
+    doc = {"content": "hello world", "metadata": {"tags": ["a", "b"], "title": "t"}}
+
+    patched = apply_patch(doc, [
+        {"op": "add", "path": "/metadata/tags/1", "value": "x"},
+        {"op": "add", "path": "/metadata/tags/-", "value": "z"},
+        {"op": "replace", "path": "/metadata/title", "value": "new"},
+        {"op": "remove", "path": "/metadata/tags/0"},
+        {"op": "copy", "from": "/metadata/title", "path": "/metadata/a~1b"},
+        {"op": "move", "from": "/metadata/a~1b", "path": "/name"},
+        {"op": "test", "path": "/name", "value": "new"},
+    ])
+    assert patched == {"content": "hello world", "name": "new", "metadata": {"tags": ["x", "b", "z"], "title": "new"}}
+    # the input is never modified
+    assert doc["metadata"] == {"tags": ["a", "b"], "title": "t"}
+
+
+def test_apply_patch_splice():
+    doc = {"content": "hello world"}
+    assert apply_patch(doc, [{"op": "splice", "path": "/content", "offset": 6, "length": 5, "value": "there"}]) == {"content": "hello there"}
+    assert apply_patch(doc, [{"op": "splice", "path": "/content", "offset": 0, "value": ">> "}]) == {"content": ">> hello world"}
+
+    with pytest.raises(JsonPatchError):
+        apply_patch(doc, [{"op": "splice", "path": "/content", "offset": 10, "length": 5, "value": ""}])
+
+
+def test_apply_patch_values():
+    doc = {"flag": True, "count": 1, "nested": {"list": [1, False]}}
+    assert apply_patch(doc, [{"op": "add", "path": "/none", "value": None}])["none"] is None
+    apply_patch(doc, [
+        {"op": "test", "path": "/flag", "value": True},
+        {"op": "test", "path": "/count", "value": 1.0},
+        {"op": "test", "path": "/nested", "value": {"list": [1, False]}},
+    ])
+    with pytest.raises(JsonPatchError):
+        apply_patch(doc, [{"op": "test", "path": "/nested", "value": {"list": [True, 0]}}])
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "remove", "path": "/missing"},
+    {"op": "replace", "path": "/list/5", "value": 1},
+    {"op": "add", "path": "/list/01", "value": 1},
+    {"op": "add", "path": "missing-slash", "value": 1},
+    {"op": "move", "from": "/obj", "path": "/obj/child"},
+    {"op": "test", "path": "/list/0", "value": 2},
+    {"op": "splice", "path": "/list", "offset": 0, "value": "x"},
+    {"op": "unknown", "path": "/list"},
+    # value is required, not null by default
+    {"op": "add", "path": "/obj/a"},
+    {"op": "replace", "path": "/list/0"},
+    {"op": "test", "path": "/obj/a"},
+    # true is not 1 in JSON
+    {"op": "test", "path": "/list/0", "value": True},
+    {"op": "test", "path": "/list", "value": [True]},
+    {"op": "splice", "path": "/obj", "offset": True, "value": "x"},
+])
+def test_apply_patch_errors(operation):
+    with pytest.raises(JsonPatchError):
+        apply_patch({"list": [1], "obj": {}}, [operation])
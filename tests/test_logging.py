@@ -0,0 +1,52 @@
+import json
+import logging
+import queue
+
+from app.config.logger import DebugRateLimitFilter, JsonFormatter, LogListener, NonBlockingQueueHandler, RequestIdFilter, request_id
+
+
+def record(level=logging.DEBUG, lineno=1):
+    return logging.LogRecord("app", level, "module.py", lineno, "user %s: %r", ("42", {"op": 1}), None)
+
+
+def test_queue_handler_json_output():
+    records = []
+
+    class Collect(logging.Handler):
+        def emit(self, record):
+            records.append(JsonFormatter().format(record))
+
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    handler.addFilter(RequestIdFilter())
+    token = request_id.set("req-1")
+    handler.handle(record(logging.INFO))
+    request_id.reset(token)
+    # full, dropped rather than waiting
+    handler.handle(record(logging.INFO))
+    assert handler.dropped == 1
+
+    listener = LogListener(handler.queue, Collect())
+    listener.start()
+    listener.stop()
+
+    entry = json.loads(records[0])
+    assert entry["message"] == "user 42: {'op': 1}"
+    assert entry["level"] == "INFO"
+    assert entry["request_id"] == "req-1"
+
+
+def test_debug_rate_limit():
+    rate_limit = DebugRateLimitFilter(rate=5)
+    assert sum(rate_limit.filter(record()) for _ in range(20)) == 5
+    # each logging call has its own budget, other levels aren't limited
+    assert rate_limit.filter(record(lineno=2))
+    assert all(rate_limit.filter(record(logging.INFO)) for _ in range(20))
+    assert rate_limit.dropped == 15
+
+    assert not DebugRateLimitFilter(sample_rate=0).filter(record())
+
+
+def test_request_id_header(client):
+    response = client.get("/health")
+    assert len(response.headers["X-Request-ID"]) == 32
+    assert client.get("/health", headers={"X-Request-ID": "abc-123"}).headers["X-Request-ID"] == "abc-123"
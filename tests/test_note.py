@@ -0,0 +1,197 @@
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.v1.endpoints.note import NOTE_CONTENT_QUERY
+
+API_V1_PREFIX = settings.API_V1_STR
+
+
+def register(client, name):
+    response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": f"{name}@example.com",
+        "username": name,
+        "password": "testpassword"
+    })
+    assert response.status_code == 200
+    client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+    headers = {"Authorization": f"Bearer {response.json()['token']['access_token']}"}
+    root_id = client.get(f"{API_V1_PREFIX}/note_folder/", headers=headers).json()[0]["id"]
+    return response.json()["user"]["id"], headers, root_id
+
+
+def create_note(client, headers, folder_id, title, content="hello", format="text"):
+    response = client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+        "title": title, "format": format, "content": content, "folder_id": folder_id
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_user_notes_pagination(client):
+    user_id, headers, root_id = register(client, "pageuser")
+    for i in range(5):
+        create_note(client, headers, root_id, f"note {i}", format="markdown" if i % 2 else "text")
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"{API_V1_PREFIX}/note/{user_id}", headers=headers, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["notes"]) <= 2
+        seen.extend(page["notes"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 5
+    assert len({note["id"] for note in seen}) == 5
+    keys = [(note["updated_at"], note["id"]) for note in seen]
+    assert keys == sorted(keys, reverse=True)
+
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}", headers=headers, params={"format": "markdown"})
+    assert {note["name"] for note in response.json()["notes"]} == {"note 1", "note 3"}
+
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}", headers=headers, params={"folder_id": root_id + 1000})
+    assert response.json() == {"notes": [], "next_cursor": None}
+
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}", headers=headers, params={"cursor": "garbage"})
+    assert response.status_code == 400
+
+
+def test_create_note_in_foreign_folder(client):
+    _, headers, _ = register(client, "folderowner")
+    _, other_headers, other_root_id = register(client, "folderintruder")
+
+    response = client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+        "title": "sneaky", "format": "text", "content": "hello", "folder_id": other_root_id
+    })
+    assert response.status_code == 404
+    assert client.get(f"{API_V1_PREFIX}/note/search", headers=other_headers, params={"q": "sneaky"}).json() == []
+
+
+def test_note_search(client):
+    user_id, headers, root_id = register(client, "searchuser")
+    create_note(client, headers, root_id, "Grocery list", "buy apples and <b>oranges</b>")
+    create_note(client, headers, root_id, "Apples", "a note about apple pie recipes")
+    create_note(client, headers, root_id, "Unrelated", "nothing to see here")
+
+    response = client.get(f"{API_V1_PREFIX}/note/search", headers=headers, params={"q": "apples"})
+    assert response.status_code == 200
+    results = response.json()
+    # the title match is weighted above the body match
+    assert [result["name"] for result in results] == ["Apples", "Grocery list"]
+    assert "<mark>" in results[1]["snippet"]
+    assert "<b>" not in results[1]["snippet"]
+
+    # other users don't see these notes
+    _, other_headers, _ = register(client, "othersearchuser")
+    response = client.get(f"{API_V1_PREFIX}/note/search", headers=other_headers, params={"q": "apples"})
+    assert response.json() == []
+
+
+def test_note_typeahead(client):
+    user_id, headers, root_id = register(client, "typeaheaduser")
+    create_note(client, headers, root_id, "Project roadmap")
+    create_note(client, headers, root_id, "Road trip packing")
+    create_note(client, headers, root_id, "100% done")
+    client.post(f"{API_V1_PREFIX}/note_folder/", headers=headers, json={
+        "name": "Roadside notes", "user_id": user_id, "parent_id": root_id
+    })
+
+    response = client.get(f"{API_V1_PREFIX}/note/typeahead", headers=headers, params={"q": "road"})
+    assert response.status_code == 200
+    results = response.json()
+    # names starting with the input come first
+    assert [note["name"] for note in results["notes"]] == ["Road trip packing", "Project roadmap"]
+    assert [folder["name"] for folder in results["folders"]] == ["Roadside notes"]
+
+    response = client.get(f"{API_V1_PREFIX}/note/typeahead", headers=headers, params={"q": "road", "limit": 1})
+    assert len(response.json()["notes"]) == 1
+
+    # LIKE wildcards in the input are matched literally
+    response = client.get(f"{API_V1_PREFIX}/note/typeahead", headers=headers, params={"q": "0%"})
+    assert [note["name"] for note in response.json()["notes"]] == ["100% done"]
+    response = client.get(f"{API_V1_PREFIX}/note/typeahead", headers=headers, params={"q": "%"})
+    assert [note["name"] for note in response.json()["notes"]] == ["100% done"]
+
+    _, other_headers, _ = register(client, "othertypeaheaduser")
+    response = client.get(f"{API_V1_PREFIX}/note/typeahead", headers=other_headers, params={"q": "road"})
+    assert response.json() == {"folders": [], "notes": []}
+
+
+def test_note_contents_conditional_get(client, db_session):
+    user_id, headers, root_id = register(client, "etaguser")
+    note = create_note(client, headers, root_id, "Big note", "lots of text")
+
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note['id']}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["content"] == "lots of text"
+    etag = response.headers["ETag"]
+    assert etag == f'"{note["id"]}-1"'
+
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note['id']}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    # any version will do, answered without reading the content
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note['id']}", headers={**headers, "If-None-Match": "*"})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    row = db_session.execute(text(NOTE_CONTENT_QUERY), {"id": note["id"], "user_id": user_id, "known_versions": [], "any_version": True}).one()
+    assert row.version == 1 and row.content is None
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note['id'] + 1000}", headers={**headers, "If-None-Match": "*"})
+    assert response.status_code == 404
+
+    # a stale or foreign ETag gets the full body
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note['id']}", headers={**headers, "If-None-Match": f'"{note["id"]}-0", "x"'})
+    assert response.status_code == 200
+
+    response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note['id'] + 1000}", headers=headers)
+    assert response.status_code == 404
+
+    other_id, other_headers, _ = register(client, "otheretaguser")
+    response = client.get(f"{API_V1_PREFIX}/note/{other_id}/{note['id']}", headers=other_headers)
+    assert response.status_code == 404
+
+
+def test_note_patch(client):
+    user_id, headers, root_id = register(client, "patchuser")
+    note = create_note(client, headers, root_id, "Draft", "hello world")
+    url = f"{API_V1_PREFIX}/note/{user_id}/{note['id']}"
+
+    response = client.patch(url, headers=headers, json={"version": 1, "operations": [
+        {"op": "splice", "path": "/content", "offset": 6, "length": 5, "value": "there"},
+        {"op": "add", "path": "/metadata/tags", "value": ["x"]},
+    ]})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert response.headers["ETag"] == f'"{note["id"]}-2"'
+
+    content = client.get(url, headers=headers).json()
+    assert content["content"] == "hello there"
+    assert content["metadata"]["tags"] == ["x"]
+
+    # a patch made against an older version is rejected, nothing is written
+    response = client.patch(url, headers=headers, json={"version": 1, "operations": [
+        {"op": "replace", "path": "/content", "value": "lost update"},
+    ]})
+    assert response.status_code == 409
+
+    response = client.patch(url, headers=headers, json={"version": 2, "operations": [
+        {"op": "remove", "path": "/missing"},
+    ]})
+    assert response.status_code == 422
+    # no value is not a null value, and true is not an offset
+    for operation in ({"op": "add", "path": "/content"}, {"op": "splice", "path": "/content", "offset": True, "value": "x"}):
+        response = client.patch(url, headers=headers, json={"version": 2, "operations": [operation]})
+        assert response.status_code == 422
+    assert client.get(url, headers=headers).headers["ETag"] == f'"{note["id"]}-2"'
+
+    other_id, other_headers, _ = register(client, "otherpatchuser")
+    response = client.patch(f"{API_V1_PREFIX}/note/{other_id}/{note['id']}", headers=other_headers, json={
+        "version": 2, "operations": [{"op": "remove", "path": "/content"}],
+    })
+    assert response.status_code == 404
@@ -0,0 +1,107 @@
+from app.core.config import settings
+
+API_V1_PREFIX = settings.API_V1_STR
+
+
+def register(client, name):
+    response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": f"{name}@example.com",
+        "username": name,
+        "password": "testpassword"
+    })
+    assert response.status_code == 200
+    client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+    return response.json()["user"]["id"], {"Authorization": f"Bearer {response.json()['token']['access_token']}"}
+
+
+def create_folder(client, headers, user_id, name, parent_id):
+    response = client.post(f"{API_V1_PREFIX}/note_folder/", headers=headers, json={
+        "name": name, "user_id": user_id, "parent_id": parent_id
+    })
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_folder_tree(client):
+    user_id, headers = register(client, "treeuser")
+
+    # ROOT -> a -> a1 -> a1x, ROOT -> b
+    root = client.get(f"{API_V1_PREFIX}/note_folder/tree", headers=headers).json()
+    assert len(root) == 1 and root[0]["is_root"]
+    root_id = root[0]["id"]
+    a = create_folder(client, headers, user_id, "a", root_id)
+    a1 = create_folder(client, headers, user_id, "a1", a)
+    create_folder(client, headers, user_id, "a1x", a1)
+    create_folder(client, headers, user_id, "b", root_id)
+
+    note = client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+        "title": "note", "format": "text", "content": "hello", "folder_id": a
+    })
+    assert note.status_code == 200
+
+    response = client.get(f"{API_V1_PREFIX}/note_folder/tree", headers=headers, params={"include_note_counts": True})
+    assert response.status_code == 200
+    tree = response.json()
+    assert [child["name"] for child in tree[0]["children"]] == ["a", "b"]
+    folder_a = tree[0]["children"][0]
+    assert folder_a["note_count"] == 1
+    assert folder_a["children"][0]["children"][0]["name"] == "a1x"
+
+    # subtree with a depth limit
+    response = client.get(f"{API_V1_PREFIX}/note_folder/tree", headers=headers, params={"root_id": a, "depth": 1})
+    subtree = response.json()
+    assert len(subtree) == 1 and subtree[0]["id"] == a
+    assert [child["name"] for child in subtree[0]["children"]] == ["a1"]
+    assert subtree[0]["children"][0]["children"] == []
+    assert "note_count" not in subtree[0]
+
+    # another user's folder is not found
+    _, other_headers = register(client, "othertreeuser")
+    response = client.get(f"{API_V1_PREFIX}/note_folder/tree", headers=other_headers, params={"root_id": a})
+    assert response.status_code == 404
+
+
+def test_folder_paths_move_and_delete(client):
+    user_id, headers = register(client, "pathuser")
+
+    root_id = client.get(f"{API_V1_PREFIX}/note_folder/tree", headers=headers).json()[0]["id"]
+    a = create_folder(client, headers, user_id, "a", root_id)
+    a1 = create_folder(client, headers, user_id, "a1", a)
+    b = create_folder(client, headers, user_id, "b", root_id)
+    for folder_id in (a, a1):
+        response = client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+            "title": f"note in {folder_id}", "format": "text", "content": "hello", "folder_id": folder_id
+        })
+        assert response.status_code == 200
+
+    response = client.get(f"{API_V1_PREFIX}/note_folder/{a1}/breadcrumbs", headers=headers)
+    assert [folder["id"] for folder in response.json()] == [root_id, a, a1]
+
+    response = client.get(f"{API_V1_PREFIX}/note_folder/{a}/notes", headers=headers)
+    assert sorted(note["folder_id"] for note in response.json()) == sorted([a, a1])
+    # same fields as the Note schema
+    assert response.json()[0].keys() == {"id", "user_id", "name", "content", "folder_id"}
+    assert response.json()[0]["user_id"] == user_id
+
+    # a folder can't be moved under its own subtree
+    response = client.put(f"{API_V1_PREFIX}/note_folder/{a}", headers=headers, json={
+        "id": a, "user_id": user_id, "name": "a", "parent_id": a1
+    })
+    assert response.status_code == 400
+
+    # move a (and a1 with it) under b
+    response = client.put(f"{API_V1_PREFIX}/note_folder/{a}", headers=headers, json={
+        "id": a, "user_id": user_id, "name": "a", "parent_id": b
+    })
+    assert response.status_code == 200
+    response = client.get(f"{API_V1_PREFIX}/note_folder/{a1}/breadcrumbs", headers=headers)
+    assert [folder["id"] for folder in response.json()] == [root_id, b, a, a1]
+    response = client.get(f"{API_V1_PREFIX}/note_folder/{b}/notes", headers=headers)
+    assert len(response.json()) == 2
+
+    # deleting b removes its whole subtree and the notes in it
+    response = client.delete(f"{API_V1_PREFIX}/note_folder/{b}", headers=headers)
+    assert response.status_code == 200
+    folders = client.get(f"{API_V1_PREFIX}/note_folder/", headers=headers).json()
+    assert [folder["id"] for folder in folders] == [root_id]
+    assert client.get(f"{API_V1_PREFIX}/note_folder/{root_id}/notes", headers=headers).json() == []
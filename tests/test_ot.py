@@ -0,0 +1,57 @@
+import pytest
+
+from app.core import ot
+
+
+def test_apply():
+    assert ot.apply("hello world", [6, {"d": 5}, "there"]) == "hello there"
+    assert ot.apply("abc", ["x"]) == "xabc"
+    assert ot.apply("abc", [3, "é"]) == "abcé"
+    assert ot.apply("", []) == ""
+
+    with pytest.raises(ot.OTError):
+        ot.apply("abc", [4])
+    with pytest.raises(ot.OTError):
+        ot.apply("abc", [1, {"d": 3}])
+
+
+@pytest.mark.parametrize("op", [
+    "abc",
+    [0],
+    [-1],
+    [""],
+    [{"d": 0}],
+    [{"d": 1, "x": 2}],
+    [True],
+    [None],
+])
+def test_check_rejects(op):
+    with pytest.raises(ot.OTError):
+        ot.check(op)
+
+
+def test_check_normalizes():
+    assert ot.check([1, 2, "a", "b", {"d": 1}, {"d": 2}, 3]) == [3, "ab", {"d": 3}]
+
+
+@pytest.mark.parametrize("doc, a, b", [
+    # inserts at the same position
+    ("abc", [1, "x"], [1, "y"]),
+    # insert inside a range the other deletes
+    ("abcdef", [3, "x"], [1, {"d": 4}]),
+    # overlapping deletes
+    ("abcdef", [1, {"d": 3}], [2, {"d": 3}]),
+    # edits at both ends
+    ("hello world", ["> ", 11, "!"], [6, {"d": 5}, "there"]),
+    ("", ["a"], ["b"]),
+])
+def test_transform_converges(doc, a, b):
+    # a is applied first on one side, b on the other, both end up with the same text
+    left = ot.apply(ot.apply(doc, a), ot.transform(b, a, "left"))
+    right = ot.apply(ot.apply(doc, b), ot.transform(a, b, "right"))
+    assert left == right
+
+
+def test_transform_tie_break():
+    assert ot.apply(ot.apply("", ["a"]), ot.transform(["b"], ["a"], "left")) == "ba"
+    assert ot.apply(ot.apply("", ["a"]), ot.transform(["b"], ["a"], "right")) == "ab"
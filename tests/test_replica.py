@@ -0,0 +1,95 @@
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool, Pool
+
+from app.core import database
+from app.core.database import ASYNC_DATABASE_URL, READ_PRIMARY_COOKIE, get_async_db, get_async_read_db
+from app.core.middleware import ReadYourWritesMiddleware
+
+
+def session_factory(application_name: str) -> async_sessionmaker:
+    # the test database under another application_name stands in for a second server
+    engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool, connect_args={"server_settings": {"application_name": application_name}})
+    return async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def server_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.api_route("/read", methods=["GET", "POST"])
+    async def read(db: AsyncSession = Depends(get_async_read_db)):
+        return (await db.execute(text("SELECT current_setting('application_name')"))).scalar()
+
+    @app.post("/write")
+    async def write(fail: bool = False, db: AsyncSession = Depends(get_async_db)):
+        if fail:
+            raise HTTPException(status_code=400, detail="Invalid")
+        return "ok"
+
+    app.add_middleware(ReadYourWritesMiddleware, sticky_seconds=5)
+    return app
+
+
+@pytest.fixture
+def replica_client(monkeypatch):
+    monkeypatch.setattr(database, "AsyncSessionLocal", session_factory("primary"))
+    monkeypatch.setattr(database, "ReplicaAsyncSessionLocal", session_factory("replica"))
+    with TestClient(server_app(), raise_server_exceptions=False) as client:
+        yield client
+
+
+def test_reads_go_to_the_replica(replica_client):
+    assert replica_client.get("/read").json() == "replica"
+    # a write request reads what it is about to change from the primary
+    assert replica_client.post("/read").json() == "primary"
+
+
+def test_read_your_writes(replica_client):
+    response = replica_client.post("/write")
+    assert response.status_code == 200
+    cookie = response.headers["set-cookie"]
+    assert cookie.startswith(f"{READ_PRIMARY_COOKIE}=1;") and "Max-Age=5" in cookie
+
+    replica_client.cookies.set(READ_PRIMARY_COOKIE, "1")
+    assert replica_client.get("/read").json() == "primary"
+    replica_client.cookies.clear()
+
+    # nothing was written
+    assert "set-cookie" not in replica_client.get("/read").headers
+    assert "set-cookie" not in replica_client.post("/write", params={"fail": True}).headers
+
+
+def test_no_replica(monkeypatch):
+    monkeypatch.setattr(database, "AsyncSessionLocal", session_factory("primary"))
+    monkeypatch.setattr(database, "ReplicaAsyncSessionLocal", None)
+    with TestClient(server_app()) as client:
+        assert client.get("/read").json() == "primary"
+
+
+def test_write_request_uses_one_primary_connection(client):
+    from app.core.auth import user_cache
+    from app.core.config import settings
+
+    response = client.post(f"{settings.API_V1_STR}/auth/register", json={"email": "onesession@example.com", "username": "onesession", "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['token']['access_token']}"}
+    user_id = response.json()["user"]["id"]
+    client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+    root_id = client.get(f"{settings.API_V1_STR}/note_folder/", headers=headers).json()[0]["id"]
+
+    checkouts = []
+
+    def listener(dbapi_connection, connection_record, connection_proxy):
+        checkouts.append(connection_record)
+
+    event.listen(Pool, "checkout", listener)
+    try:
+        # the user lookup on a cache miss runs on the session that creates the note
+        user_cache.invalidate(user_id)
+        response = client.post(f"{settings.API_V1_STR}/note/", headers=headers, json={"title": "one session", "format": "text", "content": "hello", "folder_id": root_id})
+    finally:
+        event.remove(Pool, "checkout", listener)
+    assert response.status_code == 200
+    assert len(checkouts) == 1
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.security import HashingExecutor
+
+
+def test_hashing_executor_overload():
+    release = threading.Event()
+
+    async def scenario():
+        executor = HashingExecutor(workers=1, queue_limit=1)
+        # one hash running, one queued
+        blocked = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert executor.in_flight == 2
+
+        with pytest.raises(HTTPException) as error:
+            await executor.run(lambda: None)
+        assert error.value.status_code == 503
+        assert error.value.headers == {"Retry-After": "1"}
+        assert executor.rejected == 1
+
+        # the clients gave up: the queued hash is dropped, the running one keeps its slot until it finishes
+        for task in blocked:
+            task.cancel()
+        await asyncio.sleep(0.01)
+        assert executor.in_flight == 1
+
+        release.set()
+        for _ in range(100):
+            if executor.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert executor.in_flight == 0
+        assert await executor.run(lambda: "hashed") == "hashed"
+        executor.executor.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
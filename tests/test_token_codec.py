@@ -0,0 +1,41 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.token_codec import HMACCodec, JoseCodec, TokenError, TokenExpiredError
+
+SECRET_KEY = "test-secret"
+
+
+def make_claims(expires_in: timedelta) -> dict:
+    return {"sub": str(uuid.uuid4()), "exp": datetime.now() + expires_in, "token_type": "access", "iat": datetime.now()}
+
+
+def test_hmac_codec_is_compatible_with_jose():
+    hmac_codec = HMACCodec(SECRET_KEY, "HS256")
+    jose_codec = JoseCodec(SECRET_KEY, "HS256")
+    claims = make_claims(timedelta(minutes=5))
+
+    from_hmac = hmac_codec.encode(claims)
+    from_jose = jose_codec.encode(claims)
+
+    assert jose_codec.decode(from_hmac)["sub"] == claims["sub"]
+    assert hmac_codec.decode(from_jose)["sub"] == claims["sub"]
+    assert isinstance(hmac_codec.decode(from_hmac)["exp"], int)
+
+
+def test_hmac_codec_rejects_bad_tokens():
+    codec = HMACCodec(SECRET_KEY, "HS256")
+    token = codec.encode(make_claims(timedelta(minutes=5)))
+
+    with pytest.raises(TokenError):
+        HMACCodec("other-secret", "HS256").decode(token)
+    with pytest.raises(TokenError):
+        HMACCodec(SECRET_KEY, "HS512").decode(token)
+    with pytest.raises(TokenError):
+        codec.decode("invalid.token.here")
+    with pytest.raises(TokenError):
+        codec.decode("not-a-jwt")
+    with pytest.raises(TokenExpiredError):
+        codec.decode(codec.encode(make_claims(timedelta(seconds=-1))))
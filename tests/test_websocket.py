@@ -0,0 +1,419 @@
+import asyncio
+import json
+import time
+
+import msgpack
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from sqlalchemy import text
+
+from app.core import ot
+from app.core.collab import CollabService
+from app.core.config import settings
+from app.core.database import DATABASE_URL, AsyncSessionLocal, async_engine
+from app.core.pubsub import InMemoryBackend, PostgresBackend
+from app.core.websocket import WebSocketManager, ConnectionLimitExceeded
+
+API_V1_PREFIX = settings.API_V1_STR
+
+
+def register(client, name):
+    response = client.post(f"{API_V1_PREFIX}/auth/register", json={
+        "email": f"{name}@example.com",
+        "username": name,
+        "password": "testpassword"
+    })
+    assert response.status_code == 200
+    client.cookies.set("refresh_token", response.cookies.get("refresh_token"))
+    token = response.json()["token"]["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    root_id = client.get(f"{API_V1_PREFIX}/note_folder/", headers=headers).json()[0]["id"]
+    note = client.post(f"{API_V1_PREFIX}/note/", headers=headers, json={
+        "title": "shared", "format": "text", "content": "", "folder_id": root_id
+    }).json()
+    return token, note["id"]
+
+
+def join(client, note_id, token, query=""):
+    websocket = client.websocket_connect(f"{API_V1_PREFIX}/note/ws/{note_id}{query}").__enter__()
+    websocket.send_text(json.dumps({"token": token}))
+    return websocket
+
+
+def test_note_room_broadcast(client):
+    token, note_id = register(client, "wsuser")
+
+    first = join(client, note_id, token)
+    assert first.receive_json()["type"] == "joined"
+    assert first.receive_json()["type"] == "snapshot"
+    second = join(client, note_id, token)
+    assert second.receive_json()["type"] == "joined"
+    assert second.receive_json()["type"] == "snapshot"
+    assert first.receive_json()["status"] == "connected"
+
+    first.send_text("hello")
+    message = second.receive_json()
+    assert message["type"] == "message"
+    assert message["content"] == "hello"
+    assert message["note_id"] == note_id
+
+    second.close()
+    assert first.receive_json()["status"] == "disconnected"
+    first.close()
+
+    # other users can't join the note's room
+    other_token, _ = register(client, "otherwsuser")
+    intruder = join(client, note_id, other_token)
+    assert intruder.receive_json() == {"type": "error", "message": "Note not found"}
+    with pytest.raises(WebSocketDisconnect):
+        intruder.receive_json()
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, payload):
+        self.sent.append(json.loads(payload))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+async def cross_process_broadcast(first_backend, second_backend):
+    # two managers stand in for two worker processes
+    first, second = WebSocketManager(first_backend), WebSocketManager(second_backend)
+    await first.start()
+    await second.start()
+    try:
+        local, remote = FakeWebSocket(), FakeWebSocket()
+        sender = await first.connect(local, "a", "note:1")
+        await second.connect(remote, "b", "note:1")
+        await first.broadcast_to_room("note:1", {"type": "message", "content": "hi"}, exclude_connection=sender)
+
+        for _ in range(100):
+            if any(message.get("content") == "hi" for message in remote.sent):
+                break
+            await asyncio.sleep(0.01)
+
+        # delivered once to the other process, not echoed back to the sender's process
+        assert [message.get("content") for message in remote.sent].count("hi") == 1
+        assert all(message.get("content") != "hi" for message in local.sent)
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+def test_cross_process_broadcast_in_memory():
+    bus = {}
+    asyncio.run(cross_process_broadcast(InMemoryBackend(bus), InMemoryBackend(bus)))
+    assert bus == {}
+
+
+def test_cross_process_broadcast_postgres():
+    asyncio.run(cross_process_broadcast(PostgresBackend(DATABASE_URL), PostgresBackend(DATABASE_URL)))
+
+
+class BlockedWebSocket:
+    """A client that stopped reading: every send blocks"""
+
+    def __init__(self):
+        self.close_code = None
+
+    async def send_text(self, payload):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+async def slow_consumer(policy, coalesce_key=None, **options):
+    manager = WebSocketManager(InMemoryBackend(), max_size=2, policy=policy, **options)
+    fast, slow = FakeWebSocket(), BlockedWebSocket()
+    await manager.connect(fast, "a", "note:1")
+    slow_id = await manager.connect(slow, "b", "note:1")
+    queue = manager.rooms["note:1"][slow_id]
+
+    for i in range(5):
+        await manager.broadcast_to_room("note:1", {"type": "message", "content": i}, coalesce_key=coalesce_key)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.05)
+
+    # the fast client isn't held back by the slow one
+    assert [message["content"] for message in fast.sent if message["type"] == "message"] == [0, 1, 2, 3, 4]
+    return manager, slow, queue
+
+
+def test_slow_consumer_drop_oldest():
+    async def check():
+        manager, slow, queue = await slow_consumer("drop_oldest")
+        # message 0 is stuck in the blocked send, the queue only keeps the latest two
+        assert [json.loads(entry[0])["content"] for entry in queue._queue] == [3, 4]
+        assert manager.room_stats["note:1"].dropped == 2
+    asyncio.run(check())
+
+
+def test_slow_consumer_coalesce():
+    async def check():
+        manager, slow, queue = await slow_consumer("coalesce", coalesce_key="cursor")
+        assert [json.loads(entry[0])["content"] for entry in queue._queue] == [3, 4]
+        assert manager.room_stats["note:1"].coalesced == 2
+        assert manager.room_stats["note:1"].dropped == 0
+    asyncio.run(check())
+
+
+def test_slow_consumer_disconnect():
+    async def check():
+        manager, slow, queue = await slow_consumer("disconnect")
+        assert slow.close_code == 1013
+        assert manager.room_size("note:1") == 1
+        assert manager.room_stats["note:1"].evicted == 1
+    asyncio.run(check())
+
+    async def check_send_timeout():
+        manager = WebSocketManager(InMemoryBackend(), max_size=100, policy="drop_oldest", send_timeout=0.05)
+        slow = BlockedWebSocket()
+        await manager.connect(slow, "b", "note:1")
+        manager.send("note:1", next(iter(manager.rooms["note:1"])), {"type": "joined"})
+        await asyncio.sleep(0.2)
+        assert slow.close_code == 1013
+        assert manager.rooms == {}
+    asyncio.run(check_send_timeout())
+
+
+def test_note_room_msgpack(client):
+    token, note_id = register(client, "msgpackuser")
+
+    with client.websocket_connect(f"{API_V1_PREFIX}/note/ws/{note_id}", subprotocols=["senya.msgpack.v1"]) as binary:
+        # the auth message stays JSON text
+        binary.send_text(json.dumps({"token": token}))
+        assert msgpack.unpackb(binary.receive_bytes())[0] == 1  # joined
+        assert msgpack.unpackb(binary.receive_bytes()) == [4, {"rev": 0, "text": ""}]  # snapshot
+
+        text_client = join(client, note_id, token)
+        assert text_client.receive_json()["type"] == "joined"
+        assert text_client.receive_json()["type"] == "snapshot"
+        assert msgpack.unpackb(binary.receive_bytes())[1]["status"] == "connected"
+
+        # both get the same op, each in its own encoding
+        binary.send_bytes(msgpack.packb([6, {"rev": 0, "op": ["hi"], "id": 1}]))
+        code, body = msgpack.unpackb(binary.receive_bytes())
+        assert (code, body["ops"][0]["op"]) == (5, ["hi"])
+        assert text_client.receive_json()["ops"][0]["op"] == ["hi"]
+
+        text_client.send_text("hello")
+        code, body = msgpack.unpackb(binary.receive_bytes())
+        assert (code, body["content"]) == (3, "hello")
+        text_client.close()
+
+
+def test_idle_connections_closed():
+    async def check():
+        manager = WebSocketManager(InMemoryBackend(), ping_interval=0.02, idle_timeout=0.1)
+        await manager.start()
+        try:
+            alive, silent = FakeWebSocket(), FakeWebSocket()
+            alive_id = await manager.connect(alive, "a", "note:1")
+            await manager.connect(silent, "b", "note:1")
+            for _ in range(15):
+                manager.touch(alive_id)
+                await asyncio.sleep(0.02)
+
+            assert silent.close_code == 1001
+            assert alive.close_code is None
+            assert any(message["type"] == "ping" for message in alive.sent)
+            assert manager.room_size("note:1") == 1
+            assert manager.stats()["idle_closed"] == 1
+        finally:
+            await manager.stop()
+    asyncio.run(check())
+
+
+def test_connection_limits():
+    async def check():
+        manager = WebSocketManager(InMemoryBackend(), max_connections=3, max_connections_per_user=2)
+        first = await manager.connect(FakeWebSocket(), "a", "note:1")
+        await manager.connect(FakeWebSocket(), "a", "note:2")
+        with pytest.raises(ConnectionLimitExceeded) as e:
+            await manager.connect(FakeWebSocket(), "a", "note:3")
+        assert e.value.close_code == 1008
+
+        await manager.connect(FakeWebSocket(), "b", "note:1")
+        with pytest.raises(ConnectionLimitExceeded) as e:
+            await manager.connect(FakeWebSocket(), "c", "note:1")
+        assert e.value.close_code == 1013
+
+        # a freed slot can be taken again
+        await manager.disconnect("note:1", first)
+        await manager.connect(FakeWebSocket(), "c", "note:1")
+        stats = manager.stats()
+        assert (stats["connections"], stats["users"], stats["rejected"]) == (3, 3, 2)
+    asyncio.run(check())
+
+
+def test_websocket_auth_timeout(client, monkeypatch):
+    _, note_id = register(client, "slowauthuser")
+    monkeypatch.setattr(settings, "WEBSOCKET_AUTH_TIMEOUT_SECONDS", 0.1)
+    with client.websocket_connect(f"{API_V1_PREFIX}/note/ws/{note_id}") as websocket:
+        assert websocket.receive_json() == {"type": "error", "message": "Authentication timed out"}
+        with pytest.raises(WebSocketDisconnect):
+            websocket.receive_json()
+
+
+def receive_ops(websocket, count):
+    """The next `count` applied ops, skipping other messages"""
+    ops = []
+    while len(ops) < count:
+        message = websocket.receive_json()
+        if message["type"] == "ops":
+            ops.extend(message["ops"])
+    return ops
+
+
+def test_note_collaborative_editing(client):
+    token, note_id = register(client, "collabuser")
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get(f"{API_V1_PREFIX}/auth/me", headers=headers).json()["id"]
+
+    first = join(client, note_id, token)
+    assert first.receive_json()["type"] == "joined"
+    assert first.receive_json() == {"type": "snapshot", "rev": 0, "text": ""}
+    second = join(client, note_id, token)
+    connection_id = second.receive_json()["connection_id"]
+    assert second.receive_json() == {"type": "snapshot", "rev": 0, "text": ""}
+
+    # both edit revision 0 at the same time
+    first.send_text(json.dumps({"type": "op", "rev": 0, "op": ["hello"], "id": "a"}))
+    second.send_text(json.dumps({"type": "op", "rev": 0, "op": ["world"], "id": "b"}))
+
+    texts = []
+    for websocket in (first, second):
+        ops = receive_ops(websocket, 2)
+        assert [op["rev"] for op in ops] == [1, 2]
+        # the sender's own op, its ack
+        assert next(op for op in ops if op["id"] == "b")["connection"] == connection_id
+        document = ""
+        for op in ops:
+            document = ot.apply(document, op["op"])
+        texts.append(document)
+    assert texts[0] == texts[1]
+    assert sorted(texts[0].replace("hello", "")) == sorted("world")
+
+    # an editor that has revision 1 only gets the op it missed
+    third = join(client, note_id, token, "?rev=1")
+    assert third.receive_json()["type"] == "joined"
+    assert [op["rev"] for op in third.receive_json()["ops"]] == [2]
+
+    second.send_text(json.dumps({"type": "op", "rev": 7, "op": ["x"], "id": "c"}))
+    error = second.receive_json()
+    while error["type"] != "error":
+        error = second.receive_json()
+    assert error["id"] == "c"
+
+    for websocket in (first, second, third):
+        websocket.close()
+
+    # written back once the last editor left
+    for _ in range(50):
+        response = client.get(f"{API_V1_PREFIX}/note/{user_id}/{note_id}", headers=headers)
+        if response.json()["content"] == texts[0]:
+            break
+        time.sleep(0.05)
+    assert response.json()["content"] == texts[0]
+    # version goes up by the revisions written (2)
+    assert response.headers["ETag"] == f'"{note_id}-3"'
+
+
+def test_note_patch_during_collaborative_editing(client):
+    token, note_id = register(client, "patchcollabuser")
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get(f"{API_V1_PREFIX}/auth/me", headers=headers).json()["id"]
+    url = f"{API_V1_PREFIX}/note/{user_id}/{note_id}"
+
+    editor = join(client, note_id, token)
+    assert editor.receive_json()["type"] == "joined"
+    assert editor.receive_json() == {"type": "snapshot", "rev": 0, "text": ""}
+    editor.send_text(json.dumps({"type": "op", "rev": 0, "op": ["hello"], "id": "a"}))
+    receive_ops(editor, 1)
+
+    response = client.patch(url, headers=headers, json={"version": 1, "operations": [
+        {"op": "replace", "path": "/content", "value": "patched"},
+    ]})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+
+    # the editor's unsaved document is replaced by the patched note
+    message = editor.receive_json()
+    while message["type"] != "snapshot":
+        message = editor.receive_json()
+    assert message == {"type": "snapshot", "rev": 0, "text": "patched"}
+
+    editor.send_text(json.dumps({"type": "op", "rev": 0, "op": ["> "], "id": "b"}))
+    receive_ops(editor, 1)
+    editor.close()
+
+    # the edit made after the patch is written back on top of it
+    for _ in range(50):
+        response = client.get(url, headers=headers)
+        if response.json()["content"] == "> patched":
+            break
+        time.sleep(0.05)
+    assert response.json()["content"] == "> patched"
+    assert response.headers["ETag"] == f'"{note_id}-3"'
+
+
+async def collab_replicas(note_id):
+    # two services on a shared bus stand in for two worker processes
+    bus = {}
+    services = [
+        CollabService(WebSocketManager(InMemoryBackend(bus)), flush_interval=60, sync_timeout=0.05)
+        for _ in range(2)
+    ]
+    room_id = f"note:{note_id}"
+
+    async def editor(service):
+        connection_id = await service.manager.connect(FakeWebSocket(), "u", room_id)
+        document = await service.open(note_id)
+        service.join(document, connection_id)
+        return document, connection_id
+
+    async def settle(*documents, rev):
+        for _ in range(100):
+            if all(document.rev == rev for document in documents):
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError(f"revisions {[document.rev for document in documents]}, expected {rev}")
+
+    first, first_id = await editor(services[0])
+    await services[0].submit(first, first_id, {"type": "op", "rev": 0, "op": ["hello"], "id": 1})
+    await settle(first, rev=1)
+
+    # the second replica gets the document from the first one, including the unsaved edit
+    second, second_id = await editor(services[1])
+    assert (second.rev, second.text) == (1, "hello")
+
+    await services[0].submit(first, first_id, {"type": "op", "rev": 1, "op": [5, " world"], "id": 2})
+    await services[1].submit(second, second_id, {"type": "op", "rev": 1, "op": ["> "], "id": 3})
+    await settle(first, second, rev=3)
+    assert first.text == second.text == "> hello world"
+
+    for service, connection_id in ((services[0], first_id), (services[1], second_id)):
+        await service.manager.disconnect(room_id, connection_id)
+        await service.leave(note_id, connection_id)
+    assert bus == {}
+
+    async with AsyncSessionLocal() as session:
+        res = (await session.execute(
+            text("SELECT content->>'content' AS text, collab_rev FROM note WHERE id = :id"), {"id": note_id}
+        )).one()
+    assert (res.text, res.collab_rev) == ("> hello world", 3)
+
+
+def test_collab_replicas(client):
+    _, note_id = register(client, "replicauser")
+    # the app engine's pooled connections belong to the client's loop
+    async_engine.sync_engine.dispose(close=False)
+    asyncio.run(collab_replicas(note_id))
+    async_engine.sync_engine.dispose(close=False)
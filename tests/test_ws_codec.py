@@ -0,0 +1,35 @@
+import msgpack
+import pytest
+
+from app.core.ws_codec import CODECS, JSON_CODEC, CodecError, EncodedMessage, MsgpackCodec, negotiate
+
+
+def test_negotiate():
+    assert negotiate([]) == (JSON_CODEC, None)
+    assert negotiate(["graphql-ws", "senya.json.v1"]) == (JSON_CODEC, "senya.json.v1")
+    codec, subprotocol = negotiate(["senya.msgpack.v1", "senya.json.v1"])
+    assert (codec.name, subprotocol) == ("msgpack", "senya.msgpack.v1")
+
+
+@pytest.mark.parametrize("codec", list(CODECS.values()), ids=lambda codec: codec.name)
+def test_round_trip(codec):
+    message = {"type": "ops", "ops": [{"rev": 3, "op": [2, "é", {"d": 1}], "id": "a", "connection": "c"}]}
+    assert codec.decode(codec.encode(message)) == message
+    # types without a code keep their name
+    assert codec.decode(codec.encode({"type": "cursor", "at": 4})) == {"type": "cursor", "at": 4}
+
+
+def test_msgpack_frames():
+    codec = MsgpackCodec()
+    assert msgpack.unpackb(codec.encode({"type": "ping"})) == [8, {}]
+    with pytest.raises(CodecError):
+        codec.decode('{"type": "pong"}')
+    with pytest.raises(CodecError):
+        codec.decode(b"\xc1")
+
+
+def test_encoded_once_per_codec():
+    encoded = EncodedMessage(json_text='{"type": "ping"}')
+    msgpack_codec = CODECS["senya.msgpack.v1"]
+    assert encoded.encode(JSON_CODEC) == '{"type": "ping"}'
+    assert encoded.encode(msgpack_codec) is encoded.encode(msgpack_codec)